@@ -1,11 +1,23 @@
 # config.py
 # 儲存全域參數，方便集中管理與日後擴充
+import os
 
-# 股票價格快照路徑
+# 股票價格快照路徑（舊版寬表，第一次使用 price_store 時會自動轉換）
 PRICE_SNAPSHOT_PATH = "data/monthly_price_history.parquet"
 
+# 長表格式的月收盤價存放區（依代碼分區 + 追加式 delta，delta 檔數達門檻時自動壓縮）
+PRICE_STORE_DIR = "data/price_store"
+PRICE_STORE_COMPACT_THRESHOLD = 20
+# 日收盤價存放區（依年份分區；月收盤價即由此縮減而來）
+DAILY_PRICE_STORE_DIR = "data/price_store_daily"
+
 # 匯率快照路徑
 FX_SNAPSHOT_PATH = "data/monthly_fx_history.parquet"
+# 外幣 ➔ Yahoo 匯率代碼（1 單位外幣兌台幣）；新增幣別只需加一行，例如 "JPY": "JPYTWD=X"、"HKD": "HKDTWD=X"
+# 所有幣別在同一次批次下載中補齊，快照欄位即為幣別
+FX_PAIRS = {
+    "USD": "TWD=X",
+}
 
 # 交易紀錄 Excel 檔案路徑
 TRANSACTION_FILE = "data/transactions.xlsx"
@@ -14,6 +26,52 @@ TRANSACTION_FILE = "data/transactions.xlsx"
 CASH_ACCOUNT_FILE = "data/cash_accounts.xlsx"
 CASH_ACCOUNT_SHEET = "monthly_balance"
 
+# 股利紀錄（沒有出資者欄位，依當時持股比例分配）
+DIVIDEND_FILE = "data/dividends.xlsx"
+DIVIDEND_SHEET = "股利紀錄"
+
+# Excel 解析結果的 parquet 快取（依檔案大小、mtime、內容雜湊判斷是否失效）
+WORKBOOK_CACHE_DIR = "data/cache/workbooks"
+
+# 資產計算的累計狀態快取（增量重算用）
+ASSET_STATE_DIR = "data/cache/asset_value"
+
+# 年度損益 cube（年度 × 出資者 × 股票代號，依年度指紋只重建有變動的年度）
+PNL_CUBE_DIR = "data/cache/pnl_cube"
+
+# 網路下載並行設定：執行緒數、每秒請求數上限（權杖桶）、瞬間可用請求數、單次請求逾時秒數
+FETCH_MAX_WORKERS = 8
+FETCH_RATE_PER_SEC = 4
+FETCH_BURST = 8
+FETCH_TIMEOUT = 20
+# 行情來源：yahoo（直接連網）、record（連網並錄製到本機資料夾）、replay（只讀本機資料夾，不連網）、
+# synthetic（可重現的合成行情）；可用環境變數 MARKET_DATA_PROVIDER 覆寫，方便離線測試
+MARKET_DATA_PROVIDER = os.environ.get("MARKET_DATA_PROVIDER", "yahoo")
+MARKET_DATA_CACHE_DIR = os.environ.get("MARKET_DATA_CACHE_DIR", "data/cache/market_data")
+MARKET_DATA_SEED = 0
+# 資料載入管線的並行階段數
+PIPELINE_MAX_WORKERS = 4
+
+# 即時報價快取：ttl 秒內直接使用；超過 ttl 但未超過 max_stale 時先回傳舊值並在背景更新
+QUOTE_TTL_SECONDS = 60
+QUOTE_MAX_STALE_SECONDS = 3600
+
+# 背景更新：開盤時間內每隔幾秒刷新一次當月股價與匯率（0 代表停用背景更新）
+REFRESH_INTERVAL_SECONDS = 300
+# 各市場的時區與交易時間（週一至週五）；收盤後會再補抓一次收盤價
+REFRESH_MARKET_HOURS = {
+    "TW": ("Asia/Taipei", "09:00", "13:30"),
+    "US": ("America/New_York", "09:30", "16:00"),
+}
+
+# 效能追蹤（各階段耗時、列數、網路請求數、快取命中率）；預設關閉，可用環境變數 INSTRUMENTATION=1 開啟
+INSTRUMENTATION_ENABLED = os.environ.get("INSTRUMENTATION", "0") == "1"
+# 每次追蹤的 JSON log（一行一筆）；設為 None 則只輸出到 logging
+INSTRUMENTATION_LOG_PATH = "data/cache/instrumentation.jsonl"
+# JSON log 超過此大小（bytes）時改名為 .1（只保留一份舊檔），避免無限成長
+INSTRUMENTATION_LOG_MAX_BYTES = 5 * 1024 * 1024
+# 除錯頁面保留的最近追蹤筆數
+INSTRUMENTATION_HISTORY = 20
 
 MONTHLY_PRICE_PATH = "data/monthly_price_history.parquet"
 # 可加上更多參數設定
@@ -0,0 +1,369 @@
+#dev_scripts/benchmark.py
+"""
+估值、現金與損益引擎的效能測試（以合成帳本執行，不需要連網）。
+
+    # 以目前的程式碼跑三種規模
+    python dev_scripts/benchmark.py --scales 1000,10000,50000
+
+    # 同時與另一個版本（git 版本號或另一份程式碼資料夾）比對輸出是否一致
+    python dev_scripts/benchmark.py --scales 1000,10000 --reference-rev HEAD~5
+
+每個規模、每個引擎都在獨立的子行程與全新的資料夾中執行（不共用行程內或磁碟快取），
+各階段先量測耗時，再以 tracemalloc 另外跑一次量測記憶體峰值。
+結果會印成表格，也可以用 --output 存成 JSON。
+"""
+import argparse
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.insert(0, SCRIPT_DIR)
+from synthetic_ledger import LedgerSpec, write_ledger  # noqa: E402
+
+# 比對輸出時的相對誤差容忍度
+RTOL = 1e-9
+
+
+# ---------------------------------------------------------------------------
+# 子行程：在指定的程式碼版本上跑各個階段
+# ---------------------------------------------------------------------------
+
+def _block_network(calls):
+    """
+    把 yfinance.download 換成回傳空表並記錄呼叫次數，確保不會連網
+    （有行情來源介面的版本改由 MARKET_DATA_PROVIDER 環境變數決定，這裡是給舊版本的保險）
+    """
+    try:
+        import yfinance
+    except ImportError:
+        return
+
+    def download(*args, **kwargs):
+        calls.append(kwargs.get('tickers', args[0] if args else None))
+        return pd.DataFrame()
+
+    yfinance.download = download
+
+
+def _joint_inputs(paths):
+    """依 expand_joint_transactions_by_ownership 的欄位格式整理交易主表與出資比例"""
+    sheets = pd.read_excel(paths['transactions'], sheet_name=None)
+    main, ownership = sheets['交易主表'], sheets['出資比例']
+    transactions = pd.DataFrame({
+        '交易編號': main['交易編號'],
+        '出資者': main['擁有者'],
+        '股票代號': main['股票代號'],
+        '日期': pd.to_datetime(main['交易日期']),
+        '類別': np.where(main['買賣股數'] < 0, '賣出', '買入'),
+        '股數': main['買賣股數'].abs().astype('float64'),
+        '單價': main['價格'],
+        '幣別': main['幣別'],
+        '收入': np.where(main['買賣股數'] < 0, main['買賣股數'].abs() * main['價格'] - main['手續費'] - main['稅金'], 0.0),
+        '手續費': main['手續費'],
+        '證交稅': main['稅金'],
+    })
+    joint_ids = set(main.loc[main['擁有者'] == 'Joint', '交易編號'])
+    ownership = ownership[ownership['交易編號'].isin(joint_ids)].rename(columns={'出資者': '擁有者'})
+    fx = pd.read_parquet(os.path.join(os.path.dirname(paths['transactions']), 'monthly_fx_history.parquet'))
+    fx.index = pd.PeriodIndex(fx.index, freq='M')
+    fx_long = pd.concat({
+        'USD': pd.to_numeric(fx['USD']).astype('float64'),
+        'TWD': pd.Series(1.0, index=fx.index),
+    }).swaplevel().sort_index()
+    return transactions, ownership, fx_long
+
+
+def _stages(paths):
+    """
+    回傳 [(階段名稱, 函式)]；函式回傳值會被保存以便比對。
+    只使用各版本都有的公開介面，較新的功能（股利、損益 cube）存在時才加入。
+    """
+    from modules.asset_value import calculate_monthly_asset_value
+    from modules.cash_parser import parse_cash_balances
+    from modules.profit_analyzer import expand_joint_transactions_by_ownership, calculate_realized_profit
+
+    kwargs = {}
+    if 'filepath_dividend' in inspect.signature(calculate_monthly_asset_value).parameters:
+        kwargs['filepath_dividend'] = paths['dividends']
+    state = {}
+
+    def asset_value():
+        state['result'] = calculate_monthly_asset_value(paths['transactions'], paths['cash'], **kwargs)
+        result = state['result']
+        return {name: getattr(result, name) for name in ('summary_df', 'summary_stock_df', 'summary_cash_df', 'stock_value_df')}
+
+    def expand_joint():
+        transactions, ownership, fx_long = _joint_inputs(paths)
+        state['fifo_input'] = (transactions, ownership, fx_long)
+        return expand_joint_transactions_by_ownership(transactions, ownership).reset_index(drop=True)
+
+    def realized_profit():
+        transactions, ownership, fx_long = state['fifo_input']
+        expanded = expand_joint_transactions_by_ownership(transactions, ownership)
+        return calculate_realized_profit(expanded, fx_long).reset_index(drop=True)
+
+    stages = [
+        ('cash_balances', lambda: parse_cash_balances(filepath=paths['cash'])),
+        ('asset_value_cold', asset_value),
+        ('asset_value_warm', asset_value),
+        ('expand_joint', expand_joint),
+        ('realized_fifo', realized_profit),
+    ]
+    try:
+        from modules.pnl_cube import build_pnl_cube
+        stages.append(('pnl_cube', lambda: build_pnl_cube(state['result'])))
+    except ImportError:
+        pass
+    return stages
+
+
+def _worker(args):
+    """子行程入口：切換到資料夾、載入指定版本的程式碼後依序執行各階段"""
+    os.chdir(args.data_root)
+    os.environ["MARKET_DATA_PROVIDER"] = args.market_data
+    os.environ["MARKET_DATA_CACHE_DIR"] = os.path.join(args.data_root, "market_data")
+    sys.path.insert(0, args.engine)
+    network_calls = []
+    _block_network(network_calls)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    paths = json.loads(args.paths)
+    timings, peaks, outputs = {}, {}, {}
+    if args.memory:
+        tracemalloc.start()
+    for name, func in _stages(paths):
+        if args.memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        output = func()
+        elapsed = time.perf_counter() - start
+        if args.memory:
+            peaks[name] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        else:
+            timings[name] = elapsed
+            outputs[name] = output
+
+    with open(args.result, 'wb') as f:
+        pickle.dump({'timings': timings, 'peaks': peaks, 'outputs': outputs, 'network_calls': len(network_calls)}, f)
+
+
+def _run_engine(engine, template_dir, paths, memory, market_data):
+    """複製一份全新的資料夾，在子行程中執行，回傳子行程的結果"""
+    with tempfile.TemporaryDirectory(prefix='bench_run_') as run_dir:
+        shutil.copytree(os.path.join(template_dir, 'data'), os.path.join(run_dir, 'data'))
+        run_paths = {key: os.path.join(run_dir, os.path.relpath(path, template_dir)) for key, path in paths.items() if key != 'rows'}
+        result_path = os.path.join(run_dir, 'result.pkl')
+        command = [
+            sys.executable, os.path.abspath(__file__), '_worker',
+            '--engine', engine, '--data-root', run_dir, '--paths', json.dumps(run_paths), '--result', result_path,
+            '--market-data', market_data,
+        ] + (['--memory'] if memory else [])
+        subprocess.run(command, check=True)
+        with open(result_path, 'rb') as f:
+            return pickle.load(f)
+
+
+# ---------------------------------------------------------------------------
+# 主行程：產生資料、跑各版本、比對輸出
+# ---------------------------------------------------------------------------
+
+def _export_revision(rev, target):
+    """以 git archive 匯出指定版本的程式碼（不影響目前的工作目錄）"""
+    os.makedirs(target, exist_ok=True)
+    archive = subprocess.run(['git', '-C', REPO_ROOT, 'archive', '--format=tar', rev], check=True, capture_output=True).stdout
+    tar_path = os.path.join(target, 'engine.tar')
+    with open(tar_path, 'wb') as f:
+        f.write(archive)
+    with tarfile.open(tar_path) as tar:
+        tar.extractall(target)
+    os.remove(tar_path)
+    return target
+
+
+def _compare(candidate, reference):
+    """逐一比對兩個版本的輸出，回傳 {階段: 'OK' 或差異說明}"""
+    report = {}
+    for name, expected in reference.items():
+        if name not in candidate:
+            continue
+        actual = candidate[name]
+        pairs = expected.items() if isinstance(expected, dict) else [(None, expected)]
+        problems = []
+        for key, frame in pairs:
+            other = actual[key] if key is not None else actual
+            try:
+                pd.testing.assert_frame_equal(
+                    other.sort_index(axis=1), frame.sort_index(axis=1),
+                    check_dtype=False, check_names=False, check_freq=False, check_index_type=False, rtol=RTOL
+                )
+            except AssertionError as e:
+                problems.append(f"{key or name}: {str(e).splitlines()[0]}")
+        report[name] = 'OK' if not problems else '；'.join(problems)
+    return report
+
+
+def _average_cost_reference(is_buy, qty, price, eps):
+    """移動平均成本的逐筆遞迴（作為向量化版本的比對基準）"""
+    shares = pool = 0.0
+    rows = []
+    for j, (buy, q, p) in enumerate(zip(is_buy, qty, price)):
+        if buy:
+            shares += q
+            pool += q * p
+            continue
+        sold = min(q, shares)
+        if sold > eps:
+            avg = pool / shares
+            rows.append((j, sold, avg))
+            pool -= avg * sold
+            shares -= sold
+        if shares <= eps:
+            shares = pool = 0.0
+    return rows
+
+
+def _average_cost_cases(seed):
+    """隨機買賣序列，加上長期不歸零、每次賣出九成庫存的序列（累乘比例會小到下溢）"""
+    rng = np.random.default_rng(seed)
+    cases = []
+    for _ in range(20):
+        n = int(rng.integers(1, 300))
+        is_buy = rng.random(n) < 0.55
+        cases.append((is_buy, rng.integers(1, 500, n).astype('float64'), rng.uniform(10, 500, n)))
+
+    is_buy, qty, price, held = [], [], [], 0.0
+    for _ in range(400):
+        is_buy += [True, False]
+        held += 100.0
+        sold = round(held * 0.9, 6)
+        qty += [100.0, sold]
+        price += [rng.uniform(50, 150), 0.0]
+        held -= sold
+    cases.append((np.array(is_buy), np.array(qty), np.array(price)))
+    return cases
+
+
+def _check_average_cost(engine, seed):
+    """以逐筆遞迴驗證 lot_matching.average_cost_match，回傳 'OK' 或差異說明"""
+    spec = importlib.util.spec_from_file_location('lot_matching', os.path.join(engine, 'modules', 'lot_matching.py'))
+    if spec is None or not os.path.exists(spec.origin):
+        return None
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    problems = []
+    for i, (is_buy, qty, price) in enumerate(_average_cost_cases(seed)):
+        with np.errstate(all='raise'):
+            try:
+                sell_pos, matched, avg_cost = module.average_cost_match(is_buy, qty, price)
+            except FloatingPointError as e:
+                problems.append(f"case {i}: {e}")
+                continue
+        expected = np.array(_average_cost_reference(is_buy, qty, price, module.EPS)).reshape(-1, 3)
+        actual = np.column_stack([sell_pos, matched, avg_cost])
+        if actual.shape != expected.shape or not np.allclose(actual, expected, rtol=RTOL, atol=0):
+            problems.append(f"case {i}: 與逐筆遞迴不一致")
+    return 'OK' if not problems else '；'.join(problems)
+
+
+def _format_table(rows):
+    frame = pd.DataFrame(rows)
+    return frame.to_string(index=False, float_format=lambda v: f"{v:,.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="估值、現金與損益引擎的效能測試")
+    parser.add_argument('--scales', default='1000,10000', help="交易筆數，以逗號分隔")
+    parser.add_argument('--tickers', type=int, default=40)
+    parser.add_argument('--owners', type=int, default=2)
+    parser.add_argument('--years', type=int, default=6)
+    parser.add_argument('--joint-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engine', default=REPO_ROOT, help="受測的程式碼資料夾（預設為目前的工作目錄）")
+    parser.add_argument('--reference', help="作為比對基準的程式碼資料夾")
+    parser.add_argument('--reference-rev', help="作為比對基準的 git 版本（例如 HEAD~3、baseline 的 commit）")
+    parser.add_argument('--market-data', choices=('replay', 'synthetic'), default='replay',
+                        help="行情來源：replay（空的本機資料夾，缺漏的價格視為無資料）或 synthetic（以合成行情補抓）")
+    parser.add_argument('--no-memory', action='store_true', help="略過記憶體量測")
+    parser.add_argument('--output', help="將結果另存為 JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_') as work_dir:
+        engines = {'candidate': os.path.abspath(args.engine)}
+        if args.reference:
+            engines['reference'] = os.path.abspath(args.reference)
+        elif args.reference_rev:
+            engines['reference'] = _export_revision(args.reference_rev, os.path.join(work_dir, 'reference'))
+
+        rows, equivalence = [], {}
+        for scale in [int(value) for value in args.scales.split(',')]:
+            spec = LedgerSpec(
+                transactions=scale, tickers=args.tickers, owners=args.owners,
+                years=args.years, joint_ratio=args.joint_ratio, seed=args.seed
+            )
+            template_dir = os.path.join(work_dir, f"ledger_{scale}")
+            paths = write_ledger(template_dir, spec)
+            print(f"🧪 規模 {scale:,}：{paths['rows']}", flush=True)
+
+            outputs = {}
+            for label, engine in engines.items():
+                timed = _run_engine(engine, template_dir, paths, False, args.market_data)
+                peaks = {} if args.no_memory else _run_engine(engine, template_dir, paths, True, args.market_data)['peaks']
+                outputs[label] = timed['outputs']
+                for stage, seconds in timed['timings'].items():
+                    rows.append({
+                        'scale': scale, 'engine': label, 'stage': stage, 'seconds': seconds,
+                        'peak_mb': peaks.get(stage, np.nan), 'network_calls': timed['network_calls'],
+                    })
+
+            if 'reference' in outputs:
+                equivalence[scale] = _compare(outputs['candidate'], outputs['reference'])
+
+        print(_format_table(rows))
+        for scale, report in equivalence.items():
+            print(f"\n🔍 規模 {scale:,} 與基準版本比對：")
+            for stage, status in report.items():
+                print(f"  {'✅' if status == 'OK' else '❌'} {stage}：{status}")
+
+        average_cost = _check_average_cost(engines['candidate'], args.seed)
+        if average_cost is not None:
+            print(f"\n🔍 移動平均成本與逐筆遞迴比對：{'✅' if average_cost == 'OK' else '❌'} {average_cost}")
+
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'spec': vars(args), 'results': rows, 'equivalence': {str(k): v for k, v in equivalence.items()}},
+                          f, ensure_ascii=False, indent=2, default=str)
+            print(f"\n📀 結果已儲存至：{args.output}")
+
+
+def _parse_worker_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', required=True)
+    parser.add_argument('--data-root', required=True)
+    parser.add_argument('--paths', required=True)
+    parser.add_argument('--result', required=True)
+    parser.add_argument('--market-data', default='replay')
+    parser.add_argument('--memory', action='store_true')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '_worker':
+        _worker(_parse_worker_args(sys.argv[2:]))
+    else:
+        main()
@@ -0,0 +1,243 @@
+#dev_scripts/synthetic_ledger.py
+"""
+產生合成帳本（與 data/ 底下相同的 Excel 工作表格式），並預先寫好價格 / 匯率快照，
+讓效能測試與結果比對完全不需要連網。
+
+    python dev_scripts/synthetic_ledger.py --out /tmp/ledger --transactions 10000
+
+產生的資料夾結構：
+    <out>/data/transactions.xlsx   交易主表、出資比例
+    <out>/data/cash_accounts.xlsx  monthly_balance
+    <out>/data/dividends.xlsx      股利紀錄
+    <out>/data/monthly_price_history.parquet  月收盤價（舊版寬表快照，新版 price_store 會自動轉換）
+    <out>/data/monthly_fx_history.parquet     月匯率
+"""
+import argparse
+import os
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+OWNER_NAMES = ['Sean', 'Lo', 'Amy', 'Ben', 'Cara', 'Dan', 'Eve', 'Finn']
+
+
+@dataclass
+class LedgerSpec:
+    transactions: int = 1000
+    tickers: int = 20
+    owners: int = 2
+    years: int = 5
+    joint_ratio: float = 0.2
+    us_ratio: float = 0.4
+    seed: int = 0
+
+
+def _tickers(spec: LedgerSpec):
+    """前段為台股（.TW，TWD），後段為美股（USD）"""
+    n_us = int(round(spec.tickers * spec.us_ratio))
+    tw = [f"{9000 + i}.TW" for i in range(spec.tickers - n_us)]
+    us = [f"SYN{i:03d}" for i in range(n_us)]
+    return pd.DataFrame({
+        '股票代號': tw + us,
+        '資產名稱': [f"合成{i}" for i in range(spec.tickers)],
+        '台股/美股': ['台股'] * len(tw) + ['美股'] * len(us),
+        '幣別': ['TWD'] * len(tw) + ['USD'] * len(us),
+    })
+
+
+def _months(spec: LedgerSpec, today: pd.Timestamp):
+    last = today.to_period('M')
+    return pd.period_range(last - spec.years * 12 + 1, last, freq='M')
+
+
+def generate_prices(tickers: pd.DataFrame, months: pd.PeriodIndex, rng) -> pd.DataFrame:
+    """每檔代碼一條幾何隨機漫步的月收盤價，格式與舊版價格快照相同"""
+    steps = rng.normal(0.005, 0.06, size=(len(months), len(tickers)))
+    start = np.where(tickers['幣別'] == 'TWD', rng.uniform(20, 600, len(tickers)), rng.uniform(10, 400, len(tickers)))
+    prices = pd.DataFrame(start * np.exp(np.cumsum(steps, axis=0)), index=months, columns=tickers['股票代號'])
+    prices.columns.name = None
+    prices['資料日期'] = months.end_time.normalize()
+    return prices
+
+
+def generate_fx(months: pd.PeriodIndex, rng) -> pd.DataFrame:
+    """USD 匯率在 30 上下波動，格式與匯率快照相同"""
+    usd = 30 + np.cumsum(rng.normal(0, 0.3, len(months))).clip(-3, 3)
+    return pd.DataFrame({
+        'USD': pd.array(np.round(usd, 4), dtype='Float64'),
+        '來源': pd.array(['synthetic'] * len(months), dtype='string'),
+        'TWD': pd.array([1] * len(months), dtype='Int64'),
+        '資料日期': pd.Series(pd.NaT, index=months, dtype='datetime64[ns]'),
+    }, index=months)
+
+
+def generate_transactions(spec: LedgerSpec, tickers: pd.DataFrame, prices: pd.DataFrame, owners, rng):
+    """
+    產生交易主表與出資比例：每筆交易隨機挑代碼與擁有者，約 joint_ratio 比例為 Joint 交易；
+    賣出股數不超過當時該代碼、該擁有者的庫存（Joint 以 Joint 本身的庫存計）。
+    """
+    months = prices.index
+    first_day = months[0].start_time
+    last_day = min(pd.Timestamp.today().normalize(), months[-1].end_time.normalize())
+    days = np.sort(rng.integers(0, (last_day - first_day).days + 1, spec.transactions))
+    dates = first_day + pd.to_timedelta(days, unit='D')
+
+    ticker_idx = rng.integers(0, len(tickers), spec.transactions)
+    is_joint = rng.random(spec.transactions) < spec.joint_ratio if len(owners) > 1 else np.zeros(spec.transactions, bool)
+    holder = np.where(is_joint, 'Joint', np.asarray(owners)[rng.integers(0, len(owners), spec.transactions)])
+    lot = np.where(tickers['幣別'].to_numpy()[ticker_idx] == 'TWD', 1000, 10)
+    wants_sell = rng.random(spec.transactions) < 0.35
+    size = rng.integers(1, 6, spec.transactions) * lot
+
+    # 庫存限制需要依時間累計，這裡只有單純的整數加減
+    position = {}
+    shares = np.empty(spec.transactions, dtype='int64')
+    for i in range(spec.transactions):
+        key = (ticker_idx[i], holder[i])
+        held = position.get(key, 0)
+        qty = -min(size[i], held) if wants_sell[i] and held > 0 else size[i]
+        position[key] = held + qty
+        shares[i] = qty
+
+    price_matrix = prices.drop(columns='資料日期').to_numpy()
+    price = price_matrix[months.get_indexer(dates.to_period('M')), ticker_idx] * rng.uniform(0.97, 1.03, spec.transactions)
+    price = np.round(price, 2)
+    amount = np.abs(shares) * price
+    fee = np.round(amount * 0.001425, 4)
+    tax = np.where(shares < 0, np.round(amount * 0.003, 4), 0.0)
+
+    txn_ids = [f"SX{i:07d}" for i in range(spec.transactions)]
+    picked = tickers.iloc[ticker_idx].reset_index(drop=True)
+    main = pd.DataFrame({
+        '交易日期': dates,
+        '交易編號': txn_ids,
+        '資產名稱': picked['資產名稱'],
+        '台股/美股': picked['台股/美股'],
+        '股票代號': picked['股票代號'],
+        '幣別': picked['幣別'],
+        '動作': np.where(shares < 0, '賣出', '買進'),
+        '價格': price,
+        '擁有者': holder,
+        '買賣股數': shares,
+        '手續費': fee,
+        '稅金': tax,
+        '備註': np.nan,
+    })
+
+    # 出資比例：單一擁有者為 1.0，Joint 隨機拆給 2 位以上出資者
+    ownership = [pd.DataFrame({'交易編號': np.asarray(txn_ids)[~is_joint], '出資者': holder[~is_joint], '出資比例': 1.0})]
+    joint_ids = np.asarray(txn_ids)[is_joint]
+    if len(joint_ids):
+        n_split = min(len(owners), 2 + rng.integers(0, max(len(owners) - 1, 1)))
+        weights = rng.dirichlet(np.ones(n_split), len(joint_ids)).round(4)
+        weights[:, -1] = 1 - weights[:, :-1].sum(axis=1)
+        for j in range(n_split):
+            ownership.append(pd.DataFrame({'交易編號': joint_ids, '出資者': owners[j], '出資比例': weights[:, j]}))
+    ownership = pd.concat(ownership, ignore_index=True).sort_values('交易編號', kind='stable').reset_index(drop=True)
+    return main, ownership
+
+
+def generate_cash(months: pd.PeriodIndex, owners, rng) -> pd.DataFrame:
+    """每位擁有者各有一個台幣、一個美金帳戶，每月月底一筆餘額"""
+    frames = []
+    for owner in owners:
+        for bank, account, kind, currency, scale in [
+            ('合成銀行', '台幣帳戶', '台幣活存', 'TWD', 500000),
+            ('合成銀行', '美金帳戶', '美金活存', 'USD', 20000),
+        ]:
+            frames.append(pd.DataFrame({
+                '日期': months.end_time.normalize(),
+                '銀行': bank,
+                '帳戶': account,
+                '帳戶類型': kind,
+                '擁有者': owner,
+                '出資比例': 1.0,
+                '幣別': currency,
+                '金額': np.round(scale * rng.uniform(0.5, 1.5, len(months)), 0),
+                '備註': np.nan,
+            }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def generate_dividends(main: pd.DataFrame, ownership: pd.DataFrame, tickers: pd.DataFrame) -> pd.DataFrame:
+    """每檔代碼每年 7 月配息一次（當月底仍有庫存時），代號不帶 .TW 後綴，與實際股利紀錄相同"""
+    flows = main.merge(ownership, on='交易編號')
+    flows['股數'] = flows['買賣股數'] * flows['出資比例']
+    flows['月份'] = flows['交易日期'].dt.to_period('M')
+    monthly = flows.groupby(['股票代號', '月份'])['股數'].sum().groupby(level=0).cumsum()
+
+    rows = []
+    for code, series in monthly.groupby(level=0):
+        series = series.droplevel(0)
+        payout_months = pd.period_range(series.index.min(), pd.Timestamp.today().to_period('M'), freq='M')
+        held = series.reindex(payout_months).ffill()
+        for month in payout_months[(payout_months.month == 7) & (held.round(6) > 0)]:
+            rows.append((month.start_time + pd.Timedelta(days=14), code, held[month]))
+    if not rows:
+        return pd.DataFrame(columns=['交易日期', '資產名稱', '台股/美股', '股票代號', '幣別', '動作', '庫存股數', '每股股息', '現金股利'])
+
+    info = tickers.set_index('股票代號')
+    dividends = pd.DataFrame(rows, columns=['交易日期', '代碼', '庫存股數'])
+    dividends['資產名稱'] = dividends['代碼'].map(info['資產名稱'])
+    dividends['台股/美股'] = dividends['代碼'].map(info['台股/美股'])
+    dividends['幣別'] = dividends['代碼'].map(info['幣別'])
+    dividends['股票代號'] = dividends['代碼'].str.replace('.TW', '', regex=False)
+    dividends['動作'] = '股息'
+    dividends['每股股息'] = np.where(dividends['幣別'] == 'TWD', 2.5, 0.5)
+    dividends['現金股利'] = (dividends['庫存股數'] * dividends['每股股息']).round(2)
+    return dividends[['交易日期', '資產名稱', '台股/美股', '股票代號', '幣別', '動作', '庫存股數', '每股股息', '現金股利']]
+
+
+def write_ledger(out_dir, spec: LedgerSpec) -> dict:
+    """產生整組合成資料並寫入 <out_dir>/data，回傳各檔案路徑與筆數"""
+    rng = np.random.default_rng(spec.seed)
+    owners = OWNER_NAMES[:spec.owners]
+    tickers = _tickers(spec)
+    months = _months(spec, pd.Timestamp.today())
+
+    prices = generate_prices(tickers, months, rng)
+    fx = generate_fx(months, rng)
+    main, ownership = generate_transactions(spec, tickers, prices, owners, rng)
+    cash = generate_cash(months, owners, rng)
+    dividends = generate_dividends(main, ownership, tickers)
+
+    data_dir = os.path.join(out_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    paths = {
+        'transactions': os.path.join(data_dir, 'transactions.xlsx'),
+        'cash': os.path.join(data_dir, 'cash_accounts.xlsx'),
+        'dividends': os.path.join(data_dir, 'dividends.xlsx'),
+    }
+    with pd.ExcelWriter(paths['transactions']) as writer:
+        main.to_excel(writer, sheet_name='交易主表', index=False)
+        ownership.to_excel(writer, sheet_name='出資比例', index=False)
+    with pd.ExcelWriter(paths['cash']) as writer:
+        cash.to_excel(writer, sheet_name='monthly_balance', index=False)
+    with pd.ExcelWriter(paths['dividends']) as writer:
+        dividends.to_excel(writer, sheet_name='股利紀錄', index=False)
+    prices.to_parquet(os.path.join(data_dir, 'monthly_price_history.parquet'))
+    fx.to_parquet(os.path.join(data_dir, 'monthly_fx_history.parquet'))
+
+    return {**paths, 'rows': {'交易主表': len(main), '出資比例': len(ownership), 'monthly_balance': len(cash), '股利紀錄': len(dividends)}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="產生合成帳本與價格 / 匯率快照")
+    parser.add_argument('--out', required=True, help="輸出資料夾（會建立 data/ 子資料夾）")
+    parser.add_argument('--transactions', type=int, default=1000)
+    parser.add_argument('--tickers', type=int, default=20)
+    parser.add_argument('--owners', type=int, default=2)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--joint-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    info = write_ledger(args.out, LedgerSpec(
+        transactions=args.transactions, tickers=args.tickers, owners=args.owners,
+        years=args.years, joint_ratio=args.joint_ratio, seed=args.seed
+    ))
+    print(f"✅ 已產生合成帳本：{args.out}（{info['rows']}）")
+
+
+if __name__ == '__main__':
+    main()
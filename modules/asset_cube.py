@@ -0,0 +1,137 @@
+#asset_cube.py
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+from modules.encoding import encode, month_keys, month_positions
+
+# 股票依市場分類；現金桶以幣別命名（與 summary_df 的欄位後綴一致）
+STOCK_CLASSES = {'台股': 'TW_STOCK', '美股': 'US_STOCK'}
+OTHER_STOCK_CLASS = 'OTHER_STOCK'
+CASH_SUFFIX = '_CASH'
+
+
+@dataclass
+class AssetCube:
+    """
+    出資者 × 月份 × 資產 的 TWD 市值，以一個連續的 ndarray（values[出資者, 月份, 資產]）儲存。
+    - assets：股票代號 + 現金桶（TWD_CASH、USD_CASH）
+    - asset_class：每個資產的類別（TW_STOCK、US_STOCK、TWD_CASH、USD_CASH）
+    - held：(出資者, 資產) 是否曾經出現，用來還原寬表欄位
+    依出資者、月份區間切片都是 ndarray 的 view，不需要掃描欄位名稱。
+    """
+    values: np.ndarray
+    owners: pd.Index
+    months: pd.PeriodIndex
+    assets: pd.Index
+    asset_class: np.ndarray
+    held: np.ndarray
+
+    @property
+    def classes(self) -> pd.Index:
+        return pd.Index(pd.unique(self.asset_class), name='類別')
+
+    def owner(self, name, held_only=True) -> pd.DataFrame:
+        """單一出資者每月各資產的市值（index 為月份、欄位為資產）；held_only 只保留曾持有的資產"""
+        i = self.owners.get_loc(name)
+        frame = pd.DataFrame(self.values[i], index=self.months, columns=self.assets)
+        return frame.loc[:, self.held[i]] if held_only else frame
+
+    def select(self, owners=None, classes=None, start=None, end=None) -> 'AssetCube':
+        """依出資者、資產類別、月份區間（含頭尾）切出子 cube；只選月份時回傳 view"""
+        owner_idx = slice(None)
+        if owners is not None:
+            owner_idx = self.owners.get_indexer(owners)
+            if (owner_idx < 0).any():
+                raise ValueError(f"❌ 找不到出資者：{[o for o, i in zip(owners, owner_idx) if i < 0]}")
+        asset_idx = slice(None) if classes is None else np.flatnonzero(np.isin(self.asset_class, list(classes)))
+
+        keys = month_keys(self.months)
+        lo = 0 if start is None else int(np.searchsorted(keys, month_keys(pd.Period(start, 'M'))))
+        hi = len(keys) if end is None else int(np.searchsorted(keys, month_keys(pd.Period(end, 'M')), side='right'))
+
+        values = self.values[owner_idx][:, lo:hi][:, :, asset_idx]
+        return AssetCube(
+            values=values,
+            owners=self.owners[owner_idx],
+            months=self.months[lo:hi],
+            assets=self.assets[asset_idx],
+            asset_class=self.asset_class[asset_idx],
+            held=self.held[owner_idx][:, asset_idx],
+        )
+
+    def by_owner(self) -> pd.DataFrame:
+        """每月各出資者的總資產（月份 × 出資者）"""
+        return pd.DataFrame(self.values.sum(axis=2).T, index=self.months, columns=self.owners)
+
+    def by_asset(self) -> pd.DataFrame:
+        """每月各資產的合計市值（月份 × 資產）"""
+        return pd.DataFrame(self.values.sum(axis=0), index=self.months, columns=self.assets)
+
+    def by_class(self, month=None) -> pd.DataFrame:
+        """
+        各出資者各類別的市值。
+        - month=None：回傳 (月份 × [出資者, 類別]) 的 DataFrame
+        - 指定月份（或 -1 取最新月份）：回傳 (出資者 × 類別) 的 DataFrame
+        """
+        class_codes, classes = encode(self.asset_class, self.classes)
+        onehot = np.zeros((len(self.assets), len(classes)))
+        onehot[np.arange(len(self.assets)), class_codes] = 1.0
+        if month is not None:
+            m = month if isinstance(month, int) else self.months.get_loc(pd.Period(month, 'M'))
+            return pd.DataFrame(self.values[:, m, :] @ onehot, index=self.owners, columns=classes)
+        totals = self.values @ onehot  # (出資者, 月份, 類別)
+        columns = pd.MultiIndex.from_product([self.owners, classes])
+        return pd.DataFrame(
+            totals.transpose(1, 0, 2).reshape(len(self.months), -1), index=self.months, columns=columns
+        )
+
+    def wide(self) -> pd.DataFrame:
+        """相容舊版的寬表：欄位為「出資者_資產」（例如 Sean_2330、Lo_TWD_CASH），只含曾出現的組合"""
+        owner_idx, asset_idx = np.nonzero(self.held)
+        columns = [f'{self.owners[o]}_{self.assets[a]}' for o, a in zip(owner_idx, asset_idx)]
+        return pd.DataFrame(self.values[owner_idx, :, asset_idx].T, index=self.months, columns=columns)
+
+
+def build_asset_cube(holdings: pd.DataFrame, summary_cash_df: pd.DataFrame, months: pd.PeriodIndex, owners, market_map) -> AssetCube:
+    """
+    由已估值的持股（需含「月份」「出資者」「股票代號」「市值」）與現金寬表建立 AssetCube。
+    股票以 int32 代碼一次散佈到 cube；現金欄位名稱（出資者_幣別_CASH）只在建立時解析一次。
+    """
+    owners = pd.Index(owners, name='出資者')
+    months = pd.PeriodIndex(months, name='月份')
+
+    owner_codes, _ = encode(holdings['出資者'], owners)
+    ticker_codes, tickers = encode(holdings['股票代號'])
+    rows = month_positions(month_keys(holdings['月份']), months)
+
+    cash_columns = [col for col in summary_cash_df.columns if str(col).endswith(CASH_SUFFIX)]
+    cash_keys = [str(col)[:-len(CASH_SUFFIX)].rsplit('_', 1) for col in cash_columns]
+    buckets = sorted({f'{currency}{CASH_SUFFIX}' for _, currency in cash_keys})
+
+    assets = pd.Index(list(tickers) + buckets, dtype=object, name='資產')
+    asset_class = np.array(
+        [STOCK_CLASSES.get(market_map.get(ticker), OTHER_STOCK_CLASS) for ticker in tickers] + buckets, dtype=object
+    )
+    shape = (len(owners), len(months), len(assets))
+
+    # 股票：(出資者, 月份, 股票) 一次 bincount 到連續陣列
+    value = holdings['市值'].to_numpy(dtype='float64')
+    valid = (owner_codes >= 0) & (rows >= 0) & (ticker_codes >= 0) & ~np.isnan(value)
+    flat = (owner_codes[valid].astype('int64') * shape[1] + rows[valid]) * shape[2] + ticker_codes[valid]
+    values = np.bincount(flat, weights=value[valid], minlength=np.prod(shape)).reshape(shape)
+
+    held = np.zeros((len(owners), len(assets)), dtype=bool)
+    stock_pairs = (owner_codes >= 0) & (ticker_codes >= 0)
+    held[owner_codes[stock_pairs], ticker_codes[stock_pairs]] = True
+
+    # 現金：寬表欄位放進對應的 (出資者, 現金桶)
+    cash = summary_cash_df.reindex(months).fillna(0)
+    for column, (owner, currency) in zip(cash_columns, cash_keys):
+        o = owners.get_indexer([owner])[0]
+        if o < 0:
+            continue
+        a = assets.get_loc(f'{currency}{CASH_SUFFIX}')
+        values[o, :, a] += cash[column].to_numpy(dtype='float64')
+        held[o, a] = True
+
+    return AssetCube(values=values, owners=owners, months=months, assets=assets, asset_class=asset_class, held=held)
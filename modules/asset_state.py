@@ -0,0 +1,109 @@
+#asset_state.py
+import logging
+import threading
+from dataclasses import dataclass
+import pandas as pd
+from config import ASSET_STATE_DIR, FX_PAIRS
+from modules.snapshot_store import save_frame_set, load_frame_set
+from modules.encoding import month_keys
+
+logger = logging.getLogger(__name__)
+
+# 累計狀態的格式版本；計算邏輯變更時遞增，讓舊快取自動失效
+STATE_VERSION = 1
+
+STATE_FRAMES = ['holdings_df', 'summary_df', 'summary_stock_df', 'stock_value_df', 'fingerprints']
+FINGERPRINT_COLUMNS = ['交易', '股價', '匯率', '現金']
+
+# 串行化累計狀態的讀取 ➔ 計算 ➔ 儲存（資產累計狀態與年度損益 cube 共用；可重入）
+state_lock = threading.RLock()
+
+
+@dataclass
+class AssetState:
+    holdings_df: pd.DataFrame
+    summary_df: pd.DataFrame
+    summary_stock_df: pd.DataFrame
+    stock_value_df: pd.DataFrame
+    fingerprints: pd.DataFrame
+    layout_key: str
+
+    def opening_positions(self, start_month: pd.Period) -> pd.DataFrame:
+        """取出 start_month 前一個月為止，每個 (股票代號, 出資者) 最後的累計股數與累計成本"""
+        before = self.holdings_df[self.holdings_df['月份'] < start_month]
+        last = before.sort_values('月份').groupby(['股票代號', '出資者'], as_index=False).last()
+        return last[['股票代號', '出資者', '累計股數', '累計成本']]
+
+
+def _hash_by_month(df: pd.DataFrame, months, month_values) -> pd.Series:
+    """將每列內容雜湊後依月份加總，得到每月一個指紋（沒有資料的月份為 0）"""
+    if df.empty:
+        return pd.Series(0, index=months, dtype='uint64')
+    row_hash = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    # 以 int32 月份鍵分組，不需要對 Period 物件做雜湊
+    sums = pd.Series(row_hash).groupby(month_keys(month_values)).sum()
+    return pd.Series(
+        sums.reindex(month_keys(months), fill_value=0).to_numpy(dtype='uint64'), index=months
+    )
+
+
+def compute_month_fingerprints(months, transactions, stock_price_df, fx_df, summary_cash_df) -> pd.DataFrame:
+    """
+    計算每月輸入資料的指紋：交易、股價、匯率、現金。
+    任何一欄改變，代表該月份（以及之後累計的結果）需要重算。
+    """
+    months = pd.PeriodIndex(months, name='月份')
+    tx_cols = ['月份', '股票代號', '出資者', '股數', '成本']
+    prices = stock_price_df.reindex(months).drop(columns=['資料日期'], errors='ignore')
+    fx = pd.DataFrame({
+        currency: pd.to_numeric(fx_df[currency], errors='coerce') for currency in FX_PAIRS if currency in fx_df.columns
+    }).reindex(months)
+    cash = summary_cash_df.reindex(months)
+
+    return pd.DataFrame({
+        '交易': _hash_by_month(transactions[tx_cols], months, transactions['月份']),
+        '股價': _hash_by_month(prices.reset_index(drop=True), months, months),
+        '匯率': _hash_by_month(fx.reset_index(drop=True), months, months),
+        '現金': _hash_by_month(cash.reset_index(drop=True), months, months),
+    }, index=months)
+
+
+def find_first_changed_month(state, fingerprints: pd.DataFrame, layout_key: str):
+    """
+    比對新舊指紋，回傳最早需要重算的月份。
+    - 沒有快取或版面（出資者、代碼對照、起始月份）改變 ➔ 回傳第一個月份（全部重算）
+    - 全部相同 ➔ 回傳 None（直接沿用快取）
+    """
+    if state is None or state.layout_key != layout_key:
+        return fingerprints.index[0]
+
+    missing = ~fingerprints.index.isin(state.fingerprints.index)
+    previous = state.fingerprints.reindex(fingerprints.index, fill_value=0)
+    changed = missing | (previous[FINGERPRINT_COLUMNS] != fingerprints[FINGERPRINT_COLUMNS]).any(axis=1).to_numpy()
+    if not changed.any():
+        return None
+    return fingerprints.index[changed][0]
+
+
+def load_asset_state(state_dir=ASSET_STATE_DIR):
+    try:
+        loaded = load_frame_set(state_dir, STATE_FRAMES)
+        if loaded is None:
+            return None
+        meta, frames = loaded
+        if meta.get('version') != STATE_VERSION:
+            return None
+    except Exception as e:
+        logger.warning("⚠️ 無法讀取資產累計狀態，將全部重算：%s", e)
+        return None
+    return AssetState(layout_key=meta['layout_key'], **frames)
+
+
+def save_asset_state(state: AssetState, state_dir=ASSET_STATE_DIR):
+    """所有 frame 與 meta 以同一世代提交（見 save_frame_set），不會留下新舊混合的狀態"""
+    save_frame_set(
+        state_dir,
+        {name: getattr(state, name) for name in STATE_FRAMES},
+        {'version': STATE_VERSION, 'layout_key': state.layout_key}
+    )
+    logger.info("📀 資產累計狀態已儲存至：%s", state_dir)
@@ -1,10 +1,23 @@
 from dataclasses import dataclass
+from functools import cached_property
+import hashlib
+import json
+import logging
+import numpy as np
 import pandas as pd
-from modules.fx_fetcher import fetch_monthly_fx
-from modules.price_fetcher import fetch_monthly_prices_batch
+from modules.fx_fetcher import fetch_monthly_fx, fx_rate_matrix, lookup_rates, fill_missing_rates
+from modules.price_fetcher import fetch_monthly_prices_batch, fetch_daily_prices
 from modules.time_utils import to_period_index, get_today_period
-from modules.transaction_parser import parse_transaction
+from modules.encoding import encode, month_keys, month_positions, grid_sum
+from modules.transaction_parser import load_transactions, convert_transaction_cost
+from modules.pipeline import Stage, run_stages
+from modules.instrumentation import traced, span, count
+from config import PIPELINE_MAX_WORKERS
+from modules.holdings import build_sparse_holdings
+from modules.asset_cube import AssetCube, build_asset_cube
 from modules.cash_parser import parse_cash_balances
+from modules.dividend_parser import load_dividends, allocate_dividends, summarize_dividends
+from modules.asset_state import AssetState, compute_month_fingerprints, find_first_changed_month, load_asset_state, save_asset_state, state_lock
 
 @dataclass
 class AssetValueResult:
@@ -16,77 +29,96 @@ class AssetValueResult:
     stock_value_df: pd.DataFrame
     fx_df: pd.DataFrame
     all_months: pd.PeriodIndex
+    holdings_df: pd.DataFrame
+    daily_df: pd.DataFrame = None
+    dividend_df: pd.DataFrame = None
+    summary_dividend_df: pd.DataFrame = None
 
-def calculate_monthly_asset_value(filepath_transaction, filepath_cash=None) -> AssetValueResult:
-    df = parse_transaction(filepath_main=filepath_transaction, filepath_ownership=filepath_transaction)
-    df = to_period_index(df, column='月份')
-
-    today_month = get_today_period()
-    all_months = pd.period_range(df['月份'].min(), today_month, freq='M')
+    @cached_property
+    def cube(self) -> AssetCube:
+        """
+        出資者 × 月份 × 資產（含現金桶）的市值 cube，第一次使用時才由 holdings_df 與 summary_cash_df 建立。
+        stock_value_df、summary_cash_df 等寬表仍保留供相容使用，內容等同 cube.wide() 的欄位。
+        """
+        markets = self.raw_df.drop_duplicates('股票代號').set_index('股票代號')['台股/美股'].to_dict()
+        return build_asset_cube(
+            self.holdings_df, self.summary_cash_df, self.summary_df.index,
+            sorted(self.raw_df['出資者'].unique()), markets
+        )
 
-    grouped = df.groupby(['月份', '股票代號', '出資者']).agg({'股數': 'sum', '成本': 'sum'}).reset_index()
+def calculate_market_value(holdings: pd.DataFrame, stock_price_df: pd.DataFrame, fx_df: pd.DataFrame) -> np.ndarray:
+    """
+    向量化計算市值：以 (月份, Yahoo代碼) 對齊股價矩陣、以月份對齊 USD 匯率，一次相乘。
+    holdings 需包含「月份」「Yahoo代碼」「幣別」「累計股數」欄位。
+    - 快照中沒有該月份或該代碼 ➔ 股價視為 0（快照中存在但為空值則保留 NaN）
+    - 外幣持股以 (月份, 幣別) 從匯率矩陣取當月匯率；缺值依 fill_missing_rates 處理（USD 用預設匯率，其他幣別報錯）
+    """
+    price_cols = [col for col in stock_price_df.columns if col != '資料日期']
+    price_matrix = stock_price_df[price_cols].to_numpy(dtype='float64', na_value=np.nan)
 
-    all_owners = sorted(df['出資者'].unique())
-    full_index = pd.MultiIndex.from_product([
-        all_months,
-        grouped['股票代號'].unique(),
-        all_owners
-    ], names=['月份', '股票代號', '出資者'])
+    # 月份以 int32 月份鍵對齊；代碼只對唯一值查表一次，再以代碼取回每列的欄位位置
+    months = month_keys(holdings['月份'])
+    row_idx = month_positions(months, stock_price_df.index)
+    ticker_codes, tickers = encode(holdings['Yahoo代碼'])
+    col_idx = np.append(pd.Index(price_cols).get_indexer(tickers), -1)[ticker_codes]
+    found = (row_idx >= 0) & (col_idx >= 0)
 
-    grouped = grouped.set_index(['月份', '股票代號', '出資者']).reindex(full_index, fill_value=0).reset_index()
+    price = np.zeros(len(holdings), dtype='float64')
+    price[found] = price_matrix[row_idx[found], col_idx[found]]
 
-    grouped['累計股數'] = grouped.groupby(['股票代號', '出資者'])['股數'].cumsum()
-    grouped['累計成本'] = grouped.groupby(['股票代號', '出資者'])['成本'].cumsum()
+    fx = fill_missing_rates(lookup_rates(fx_rate_matrix(fx_df), months, holdings['幣別']), months, holdings['幣別'])
 
-    market_map = df.drop_duplicates('股票代號').set_index('股票代號')['台股/美股'].to_dict()
-    currency_map = df.drop_duplicates('股票代號').set_index('股票代號')['幣別'].to_dict()
-    ticker_map = (
-        df.drop_duplicates('股票代號').set_index('股票代號')['Yahoo代碼'].to_dict()
-        if 'Yahoo代碼' in df.columns
-        else df.set_index('股票代號').apply(lambda r: r.name, axis=1).to_dict()
-    )
+    return holdings['累計股數'].to_numpy(dtype='float64') * fx * price
 
-    grouped['Yahoo代碼'] = grouped['股票代號'].map(ticker_map)
-    grouped['幣別'] = grouped['股票代號'].map(currency_map).fillna('TWD')
+def summarize_holdings(grouped: pd.DataFrame, month_index: pd.PeriodIndex, all_owners, market_map, summary_cash_df: pd.DataFrame):
+    """
+    將已估值的持股（需含「市值」欄）依月份彙總，回傳 (summary_df, summary_stock_df, stock_value_df)。
+    只會輸出 month_index 涵蓋的月份，增量重算時可只彙總變動的月份。
+    """
+    owner_index = pd.Index(all_owners, name='出資者')
+    shape = (len(month_index), len(owner_index))
 
-    fx_df = fetch_monthly_fx(all_months)
-    fx_rate = fx_df.squeeze().to_dict()
+    # 以 int32 代碼彙總：月份 ➔ 列位置、出資者 ➔ 欄位置，不在 month_index / all_owners 的列略過
+    rows = month_positions(month_keys(grouped['月份']), month_index)
+    owner_codes, _ = encode(grouped['出資者'], owner_index)
+    ticker_codes, tickers = encode(grouped['股票代號'])
+    value = grouped['市值'].to_numpy(dtype='float64')
 
-    needed_codes = grouped['Yahoo代碼'].dropna().unique()
-    stock_price_df = fetch_monthly_prices_batch(needed_codes, all_months)
+    def sum_by_owner(mask=None):
+        if mask is None:
+            matrix = grid_sum(rows, owner_codes, value, shape)
+        else:
+            matrix = grid_sum(rows[mask], owner_codes[mask], value[mask], shape)
+        return pd.DataFrame(matrix, index=month_index, columns=owner_index)
 
-    def calculate_market_value(row):
-        month = row['月份']
-        code = row['Yahoo代碼']
-        shares = row['累計股數']
-        fx = fx_rate.get(month, 30) if row['幣別'] == 'USD' else 1
-        price = stock_price_df.at[month, code] if (month in stock_price_df.index and code in stock_price_df.columns) else 0
-        return shares * fx * price
+    summary_stock_df = sum_by_owner()
 
-    grouped['市值'] = grouped.apply(calculate_market_value, axis=1)
-
-    summary_stock_df = grouped.groupby(['月份', '出資者'])['市值'].sum().unstack(fill_value=0)
-
-    tw = grouped[grouped['股票代號'].map(market_map) == '台股'].groupby(['月份', '出資者'])['市值'].sum().unstack(fill_value=0)
-    us = grouped[grouped['股票代號'].map(market_map) == '美股'].groupby(['月份', '出資者'])['市值'].sum().unstack(fill_value=0)
+    market = tickers.map(market_map).to_numpy(dtype=object)
+    market = np.append(market, None)[ticker_codes]
+    tw = sum_by_owner(market == '台股')
+    us = sum_by_owner(market == '美股')
 
     for owner in all_owners:
-        summary_stock_df[f'{owner}_TW_STOCK'] = tw.get(owner, 0)
-        summary_stock_df[f'{owner}_US_STOCK'] = us.get(owner, 0)
-
-    grouped['股票ID'] = grouped['出資者'] + '_' + grouped['股票代號']
-    stock_value_df = grouped.pivot_table(
-        index='月份',
-        columns='股票ID',
-        values='市值',
-        aggfunc='sum'
-    ).fillna(0)
-    stock_value_df.columns.name = None
-
-    if filepath_cash:
-        summary_cash_df = parse_cash_balances(filepath=filepath_cash)
-    else:
-        summary_cash_df = pd.DataFrame(index=all_months)
+        summary_stock_df[f'{owner}_TW_STOCK'] = tw[owner]
+        summary_stock_df[f'{owner}_US_STOCK'] = us[owner]
+
+    # 每檔股票的市值：(出資者, 股票) 組合先編成代碼，欄名只對出現過的組合組一次字串
+    all_owner_codes, all_owner_labels = encode(grouped['出資者'])
+    valid = (all_owner_codes >= 0) & (ticker_codes >= 0)
+    pair = np.where(valid, all_owner_codes.astype('int64') * len(tickers) + ticker_codes, -1)
+    pair_codes, pairs = encode(pair[valid])
+    stock_ids = (
+        all_owner_labels.to_numpy(dtype=object)[pairs.to_numpy() // len(tickers)] + '_'
+        + tickers.to_numpy(dtype=object)[pairs.to_numpy() % len(tickers)]
+    )
+    order = np.argsort(stock_ids, kind='stable')
+    column_of_pair = np.empty(len(pairs), dtype='int64')
+    column_of_pair[order] = np.arange(len(pairs))
+    stock_value_df = pd.DataFrame(
+        grid_sum(rows[valid], column_of_pair[pair_codes], value[valid], (len(month_index), len(pairs))),
+        index=month_index,
+        columns=pd.Index(stock_ids[order], dtype=object),
+    )
 
     summary_df = summary_stock_df.add(summary_cash_df, fill_value=0)
 
@@ -100,6 +132,241 @@ def calculate_monthly_asset_value(filepath_transaction, filepath_cash=None) -> A
 
     summary_df['Total'] = summary_df[all_owners].sum(axis=1)
 
+    return summary_df, summary_stock_df, stock_value_df
+
+def calculate_daily_asset_curve(transactions: pd.DataFrame, daily_prices: pd.DataFrame, fx_df: pd.DataFrame,
+                                summary_cash_df: pd.DataFrame, all_owners, end_date) -> pd.DataFrame:
+    """
+    以 as-of join 計算每位出資者每日的資產曲線（index 為日期，欄位為出資者 + Total）。
+    transactions 需包含「交易日期」「股票代號」「出資者」「股數」「Yahoo代碼」「幣別」欄位。
+    - 持股：每個 (股票, 出資者) 截至當日的累計股數
+    - 股價：當日或之前最近一個交易日的收盤價（假日沿用前一個交易日）
+    - 匯率：當日所屬月份、該幣別的月匯率（缺月時沿用之前最近的月份）
+    - 現金：當月的現金餘額（與月資料相同）
+    每月最後一天的數值即等於月資料的結果，月資料可視為日資料的縮減。
+    """
+    keys = ['股票代號', '出資者']
+    flows = (
+        transactions.assign(日期=transactions['交易日期'].dt.normalize())
+        .groupby(keys + ['Yahoo代碼', '幣別', '日期'], as_index=False)['股數'].sum()
+        .sort_values(keys + ['日期'])
+    )
+    flows['累計股數'] = flows.groupby(keys)['股數'].cumsum()
+
+    days = pd.date_range(flows['日期'].min(), pd.Timestamp(end_date).normalize(), freq='D', name='日期')
+    grid = (
+        flows[keys + ['Yahoo代碼', '幣別']].drop_duplicates(keys)
+        .merge(pd.DataFrame({'日期': days}), how='cross')
+        .sort_values('日期', kind='stable')
+    )
+
+    # 持股：截至當日最後一筆交易後的累計股數
+    grid = pd.merge_asof(grid, flows.sort_values('日期')[keys + ['日期', '累計股數']], on='日期', by=keys)
+    grid = grid[grid['累計股數'].fillna(0) != 0]
+
+    # 股價：當日或之前最近的收盤價
+    prices = daily_prices[['date', 'ticker', 'close']].rename(columns={'date': '日期', 'ticker': 'Yahoo代碼'})
+    grid = pd.merge_asof(grid, prices.sort_values('日期'), on='日期', by='Yahoo代碼')
+
+    # 匯率：以月初為鍵的月份 × 幣別匯率表，as-of 後依每列幣別取出對應欄位
+    matrix = fx_rate_matrix(fx_df)
+    fx_table = pd.DataFrame(matrix.to_numpy(), columns=[f'匯率_{currency}' for currency in matrix.columns])
+    fx_table.insert(0, '日期', matrix.index.to_timestamp())
+    grid = pd.merge_asof(grid, fx_table, on='日期')
+    currency_codes, _ = encode(grid['幣別'], matrix.columns)
+    rates = grid[fx_table.columns[1:]].to_numpy(dtype='float64')
+    fx = np.where(currency_codes >= 0, rates[np.arange(len(grid)), np.maximum(currency_codes, 0)], np.nan)
+    fx = fill_missing_rates(fx, grid['日期'], grid['幣別'])
+
+    # merge_asof 沒對到價格時 close 可能是 object 欄，先轉數值再補 0
+    close = pd.to_numeric(grid['close'], errors='coerce').fillna(0).to_numpy(dtype='float64')
+    grid['市值'] = grid['累計股數'].to_numpy(dtype='float64') * fx * close
+
+    owner_index = pd.Index(all_owners, name='出資者')
+    daily_df = (
+        grid.groupby(['日期', '出資者'])['市值'].sum()
+        .unstack(fill_value=0)
+        .reindex(index=days, columns=owner_index, fill_value=0)
+    )
+
+    # 現金：依日期所屬月份對應月現金餘額
+    if not summary_cash_df.empty:
+        day_months = days.to_period('M')
+        for owner in all_owners:
+            cash_cols = [col for col in summary_cash_df.columns if col.startswith(f'{owner}_')]
+            cash = summary_cash_df[cash_cols].sum(axis=1).reindex(day_months).fillna(0).to_numpy()
+            daily_df[owner] = daily_df[owner].to_numpy() + cash
+
+    daily_df['Total'] = daily_df[all_owners].sum(axis=1)
+    daily_df.columns.name = None
+    return daily_df
+
+def _splice_months(previous: pd.DataFrame, recomputed: pd.DataFrame, start_month: pd.Period, sort_columns=False) -> pd.DataFrame:
+    """沿用快取中 start_month 之前的月份，接上重算後的月份"""
+    kept = previous[previous.index < start_month]
+    columns = recomputed.columns.union(kept.columns, sort=False)
+    if sort_columns:
+        columns = columns.sort_values()
+    spliced = pd.concat([kept, recomputed]).reindex(columns=columns).fillna(0)
+    spliced.index.name = recomputed.index.name
+    spliced.columns.name = recomputed.columns.name
+    return spliced
+
+def yahoo_ticker_map(df: pd.DataFrame) -> dict:
+    if 'Yahoo代碼' in df.columns:
+        return df.drop_duplicates('股票代號').set_index('股票代號')['Yahoo代碼'].to_dict()
+    return {code: code for code in df['股票代號'].dropna().unique()}
+
+@traced("asset_value")
+def calculate_monthly_asset_value(filepath_transaction, filepath_cash=None, daily=False, filepath_dividend=None) -> AssetValueResult:
+    """
+    計算每月資產價值。
+    - daily: 同時計算每日資產曲線（AssetValueResult.daily_df），會先補齊日收盤價
+    - filepath_dividend: 股利紀錄，依持股比例分配到各出資者（dividend_df、summary_dividend_df）；
+      股利入帳後已反映在現金餘額，因此不另外加進 summary_df
+    """
+    today_month = get_today_period()
+
+    def months_of(raw_transactions):
+        return pd.period_range(raw_transactions['月份'].min(), today_month, freq='M')
+
+    def codes_of(raw_transactions):
+        return sorted(raw_transactions['股票代號'].map(yahoo_ticker_map(raw_transactions)).dropna().unique())
+
+    def fetch_prices(raw_transactions):
+        # 月收盤價由日收盤價縮減而來；日模式下排在日資料補齊之後（after），這裡就不會再下載
+        return fetch_monthly_prices_batch(codes_of(raw_transactions), months_of(raw_transactions))
+
+    def parse_dividends():
+        # 股利同樣依賴匯率快照換算（排在匯率補抓之後）
+        if filepath_dividend:
+            return load_dividends(filepath_dividend)
+        return None
+
+    def parse_cash():
+        # 現金換算依賴匯率快照，因此排在匯率補抓之後
+        if filepath_cash:
+            return parse_cash_balances(filepath=filepath_cash)
+        return None
+
+    # --- 資料載入管線：彼此獨立的階段（股價補抓、現金解析）並行執行，匯率只抓一次 ---
+    stage_list = [
+        Stage('raw_transactions', lambda: load_transactions(filepath_transaction, filepath_transaction)),
+        Stage('fx', lambda raw_transactions: fetch_monthly_fx(months_of(raw_transactions)), inputs=('raw_transactions',)),
+        Stage('prices', fetch_prices, inputs=('raw_transactions',), after=('daily_prices',) if daily else ()),
+        Stage('cash', parse_cash, after=('fx',)),
+        Stage('dividends', parse_dividends, after=('fx',)),
+        Stage('transactions', lambda raw_transactions, fx: convert_transaction_cost(raw_transactions, fx), inputs=('raw_transactions', 'fx')),
+    ]
+    if daily:
+        stage_list.append(Stage(
+            'daily_prices',
+            lambda raw_transactions: fetch_daily_prices(codes_of(raw_transactions), months_of(raw_transactions)),
+            inputs=('raw_transactions',)
+        ))
+    stages = run_stages(stage_list, max_workers=PIPELINE_MAX_WORKERS)
+
+    df = to_period_index(stages['transactions'], column='月份')
+    fx_df = stages['fx']
+    stock_price_df = stages['prices']
+
+    all_months = months_of(df)
+    all_owners = sorted(df['出資者'].unique())
+
+    market_map = df.drop_duplicates('股票代號').set_index('股票代號')['台股/美股'].to_dict()
+    currency_map = df.drop_duplicates('股票代號').set_index('股票代號')['幣別'].to_dict()
+    ticker_map = yahoo_ticker_map(df)
+    needed_codes = sorted(df['股票代號'].map(ticker_map).dropna().unique())
+
+    summary_cash_df = stages['cash'] if stages['cash'] is not None else pd.DataFrame(index=all_months)
+
+    # --- 增量重算：找出最早受影響的月份，之前的月份直接沿用快取 ---
+    month_index = pd.PeriodIndex(all_months, name='月份')
+    # 累計狀態的讀取 ➔ 計算 ➔ 儲存必須串行（背景更新與頁面可能同時計算），否則指紋與結果可能來自不同次計算
+    with state_lock:
+        with span("asset_value.fingerprints"):
+            fingerprints = compute_month_fingerprints(
+                month_index.union(summary_cash_df.index), df, stock_price_df.reindex(columns=needed_codes), fx_df, summary_cash_df
+            )
+            layout_key = hashlib.sha1(json.dumps(
+                [str(all_months[0]), all_owners, market_map, currency_map, ticker_map], ensure_ascii=False, sort_keys=True, default=str
+            ).encode('utf-8')).hexdigest()
+
+            state = load_asset_state()
+            start_month = find_first_changed_month(state, fingerprints, layout_key)
+
+        if start_month is None:
+            count("cache.asset_state.hit")
+            grouped = state.holdings_df
+            summary_df = state.summary_df
+            summary_stock_df = state.summary_stock_df
+            stock_value_df = state.stock_value_df
+        else:
+            count("cache.asset_state.miss")
+            incremental = state is not None and start_month > fingerprints.index[0]
+            opening = state.opening_positions(start_month) if incremental else None
+            recompute_from = max(start_month, all_months[0])
+            with span("asset_value.holdings", start_month=str(start_month), incremental=incremental) as current:
+                recomputed = build_sparse_holdings(
+                    df, end_month=today_month,
+                    start_month=recompute_from if incremental else None,
+                    opening=opening
+                )
+                current.set(rows=len(recomputed))
+
+            with span("asset_value.valuation", rows=len(recomputed)):
+                recomputed['Yahoo代碼'] = recomputed['股票代號'].map(ticker_map)
+                recomputed['幣別'] = recomputed['股票代號'].map(currency_map).fillna('TWD')
+                recomputed['市值'] = calculate_market_value(recomputed, stock_price_df, fx_df)
+
+            with span("asset_value.pivots"):
+                summaries = summarize_holdings(
+                    recomputed,
+                    month_index[month_index >= start_month],
+                    all_owners,
+                    market_map,
+                    summary_cash_df[summary_cash_df.index >= start_month]
+                )
+
+            if incremental:
+                grouped = pd.concat(
+                    [state.holdings_df[state.holdings_df['月份'] < start_month], recomputed], ignore_index=True
+                )
+                summary_df = _splice_months(state.summary_df, summaries[0], start_month)
+                summary_stock_df = _splice_months(state.summary_stock_df, summaries[1], start_month)
+                stock_value_df = _splice_months(state.stock_value_df, summaries[2], start_month, sort_columns=True)
+            else:
+                grouped = recomputed
+                summary_df, summary_stock_df, stock_value_df = summaries
+
+            logging.info("🔁 資產重算月份：%s ~ %s（%s）", start_month, today_month, "增量" if incremental else "全部")
+            with span("asset_value.save_state"):
+                save_asset_state(AssetState(
+                    holdings_df=grouped,
+                    summary_df=summary_df,
+                    summary_stock_df=summary_stock_df,
+                    stock_value_df=stock_value_df,
+                    fingerprints=fingerprints,
+                    layout_key=layout_key
+                ))
+
+    dividend_df = summary_dividend_df = None
+    if stages['dividends'] is not None:
+        dividend_df = allocate_dividends(stages['dividends'], grouped)
+        summary_dividend_df = summarize_dividends(dividend_df, all_months, all_owners)
+
+    daily_df = None
+    if daily:
+        with span("asset_value.daily_curve", rows=len(stages['daily_prices'])):
+            daily_df = calculate_daily_asset_curve(
+                df.assign(
+                    Yahoo代碼=df['股票代號'].map(ticker_map),
+                    幣別=df['股票代號'].map(currency_map).fillna('TWD')
+                ),
+                stages['daily_prices'], fx_df, summary_cash_df, all_owners,
+                end_date=min(pd.Timestamp.today(), today_month.end_time)
+            )
+
     return AssetValueResult(
         summary_df=summary_df,
         summary_stock_df=summary_stock_df,
@@ -108,5 +375,9 @@ def calculate_monthly_asset_value(filepath_transaction, filepath_cash=None) -> A
         stock_price_df=stock_price_df,
         stock_value_df=stock_value_df,
         fx_df=fx_df,
-        all_months=all_months
+        all_months=all_months,
+        holdings_df=grouped,
+        daily_df=daily_df,
+        dividend_df=dividend_df,
+        summary_dividend_df=summary_dividend_df
     )
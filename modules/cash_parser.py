@@ -1,60 +1,87 @@
+import os
+import threading
 import pandas as pd
 from modules.time_utils import to_period_index, get_today_period
-from modules.fx_fetcher import load_fx_rates
+from modules.encoding import encode, month_keys, decode_months, month_positions, grid_sum
+from modules.fx_fetcher import load_fx_matrix, lookup_rates, require_rates
+from modules.workbook_cache import load_sheet
+from modules.instrumentation import traced, count
 from config import CASH_ACCOUNT_FILE, CASH_ACCOUNT_SHEET, FX_SNAPSHOT_PATH
 
+# 換算後的現金帳快取：(絕對路徑, 工作表) ➔ (檔案指紋, 匯率快照指紋, DataFrame)
+_ledger_cache = {}
+_ledger_lock = threading.Lock()
 
-def parse_cash_balances(filepath=CASH_ACCOUNT_FILE, sheet_name=CASH_ACCOUNT_SHEET):
-    df = pd.read_excel(filepath, sheet_name=sheet_name)
-    df["月份"] = to_period_index(df["日期"])
-    fx = load_fx_rates()
 
-    def convert(row):
-        month, currency, amount = row["月份"], row["幣別"], row["金額"]
-        if currency == "TWD":
-            return amount
-        try:
-            return amount * fx.loc[(month, currency)]
-        except KeyError:
-            raise ValueError(f"❌ 找不到 {month} 的 {currency} 匯率")
+def file_signature(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
 
-    df["TWD金額"] = df.apply(convert, axis=1)
 
-    df = df[df["出資比例"].notnull()]
-    df["金額分攤"] = df["TWD金額"] * df["出資比例"]
+def convert_to_twd(df, amount_column="金額"):
+    """
+    以 (月份, 幣別) 從匯率快照的月份 × 幣別矩陣一次取出整欄匯率，將 amount_column 換算為 TWD 金額。
+    找不到匯率時（含幣別空白）一次列出所有缺少的 (月份, 幣別) 後報錯，不使用預設匯率。
+    """
+    rates = lookup_rates(load_fx_matrix(), df["月份"], df["幣別"])
+    rates = require_rates(rates, df["月份"], df["幣別"])
+    return df[amount_column] * rates
 
-    grouped = df.groupby(["月份", "擁有者", "幣別"])["金額分攤"].sum().reset_index()
-    grouped = grouped.pivot_table(index="月份", columns=["擁有者", "幣別"], values="金額分攤", aggfunc="sum").fillna(0)
-    grouped.columns = [f"{owner}_{currency}_CASH" for owner, currency in grouped.columns]
 
-    # 補齊到當月
-    today_month = get_today_period()
-    all_months = pd.period_range(grouped.index.min(), today_month, freq="M")
-    grouped = grouped.reindex(all_months, fill_value=0)
-    grouped.index.name = "月份"
+def load_cash_ledger(filepath=CASH_ACCOUNT_FILE, sheet_name=CASH_ACCOUNT_SHEET):
+    """
+    讀取現金帳並一次換算為 TWD，作為所有現金報表的共用資料來源。
+    只保留有出資比例的列，並加上：月份、帳戶全名、TWD金額、金額分攤。
+    Excel 與匯率快照都未變動時直接回傳快取結果（副本）。
+    """
+    key = (os.path.abspath(filepath), sheet_name)
+    signature = (file_signature(filepath), file_signature(FX_SNAPSHOT_PATH))
 
-    return grouped
+    with _ledger_lock:
+        cached = _ledger_cache.get(key)
+        if cached and cached[0] == signature:
+            count("cache.cash_ledger.hit")
+            return cached[1].copy()
 
+        count("cache.cash_ledger.miss")
+        df = load_sheet(filepath, sheet_name)
+        df["月份"] = to_period_index(df["日期"])
+        df = df[df["出資比例"].notnull()].copy()
+        df["帳戶全名"] = df["銀行"] + "_" + df["帳戶"]
+        df["TWD金額"] = convert_to_twd(df)
+        df["金額分攤"] = df["TWD金額"] * df["出資比例"]
 
-def parse_cash_detail(filepath=CASH_ACCOUNT_FILE, sheet_name=CASH_ACCOUNT_SHEET):
-    df = pd.read_excel(filepath, sheet_name=sheet_name)
-    df["月份"] = to_period_index(df["日期"])
-    df["帳戶全名"] = df["銀行"] + "_" + df["帳戶"]
-    fx = load_fx_rates()
+        _ledger_cache[key] = (signature, df)
+        return df.copy()
+
+
+@traced("cash.balances")
+def parse_cash_balances(filepath=CASH_ACCOUNT_FILE, sheet_name=CASH_ACCOUNT_SHEET):
+    df = load_cash_ledger(filepath, sheet_name)
+
+    # 以 int32 代碼彙總：(擁有者, 幣別) 組合編成欄代碼、月份鍵對齊到補齊至當月的月份
+    months = month_keys(df["月份"])
+    owner_codes, owners = encode(df["擁有者"])
+    currency_codes, currencies = encode(df["幣別"])
+    valid = (owner_codes >= 0) & (currency_codes >= 0)
+    pair_codes, pairs = encode(owner_codes[valid].astype("int64") * len(currencies) + currency_codes[valid])
 
-    def convert(row):
-        month, currency, amount = row["月份"], row["幣別"], row["金額"]
-        if currency == "TWD":
-            return amount
-        try:
-            return amount * fx.loc[(month, currency)]
-        except KeyError:
-            raise ValueError(f"❌ 找不到 {month} 的 {currency} 匯率")
+    today_month = get_today_period()
+    all_months = pd.period_range(decode_months(months[valid]).min(), today_month, freq="M", name="月份")
+    rows = month_positions(months[valid], all_months)
+    matrix = grid_sum(rows, pair_codes, df["金額分攤"].to_numpy(dtype="float64")[valid], (len(all_months), len(pairs)))
+
+    columns = [
+        f"{owners[pair // len(currencies)]}_{currencies[pair % len(currencies)]}_CASH" for pair in pairs
+    ]
+    return pd.DataFrame(matrix, index=all_months, columns=columns)
 
-    df["TWD金額"] = df.apply(convert, axis=1)
 
-    df = df[df["出資比例"].notnull()]
-    df["金額分攤"] = df["TWD金額"] * df["出資比例"]
+@traced("cash.detail")
+def parse_cash_detail(filepath=CASH_ACCOUNT_FILE, sheet_name=CASH_ACCOUNT_SHEET):
+    df = load_cash_ledger(filepath, sheet_name)
 
     detail = df.groupby(["月份", "擁有者", "帳戶全名"])["金額分攤"].sum()
     detail.name = "TWD金額"
@@ -62,35 +89,18 @@ def parse_cash_detail(filepath=CASH_ACCOUNT_FILE, sheet_name=CASH_ACCOUNT_SHEET)
     return detail
 
 
+@traced("cash.latest_detail")
 def get_latest_cash_detail(filepath=CASH_ACCOUNT_FILE, sheet_name=CASH_ACCOUNT_SHEET):
-    df = pd.read_excel(filepath, sheet_name=sheet_name)
-    df["月份"] = to_period_index(df["日期"])
-    df = df[df["出資比例"].notnull()].copy()
-    df["帳戶全名"] = df["銀行"] + "_" + df["帳戶"]
+    df = load_cash_ledger(filepath, sheet_name)
 
     latest_month = df["月份"].max()
     df = df[df["月份"] == latest_month].copy()
-
-    fx = load_fx_rates()
-
-    def convert(row):
-        month, currency, amount = row["月份"], row["幣別"], row["金額"]
-        if currency == "TWD":
-            return amount
-        try:
-            return amount * fx.loc[(month, currency)]
-        except KeyError:
-            raise ValueError(f"❌ 找不到 {month} 的 {currency} 匯率")
-
-    df["TWD金額"] = df.apply(convert, axis=1)
-    df["金額分攤"] = df["TWD金額"] * df["出資比例"]
     df["分類"] = df["帳戶類型"]
 
-
     result = df.groupby(["月份", "擁有者", "銀行", "帳戶", "分類", "幣別"], as_index=False).agg({
         "金額": "sum",
         "TWD金額": "sum",
         "金額分攤": "sum"
     })
 
-    return result
\ No newline at end of file
+    return result
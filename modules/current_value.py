@@ -1,9 +1,11 @@
 # modules/current_value.py
 import pandas as pd
-import yfinance as yf
 from modules.transaction_parser import parse_transaction
 from modules.cash_parser import parse_cash_detail
+from modules.quote_cache import get_quote_cache
+from modules.instrumentation import traced
 
+@traced("current_value.assets")
 def calculate_current_asset_value(filepath_transaction, fx_rate=32.0):
     df = parse_transaction(filepath_main=filepath_transaction, filepath_ownership=filepath_transaction)
 
@@ -18,14 +20,7 @@ def calculate_current_asset_value(filepath_transaction, fx_rate=32.0):
     df = df[df['股數'] > 0]
 
     tickers = df['Yahoo代碼'].dropna().unique().tolist()
-    if tickers:
-        raw = yf.download(tickers=tickers, period="1d", interval="1d", progress=False)
-        if isinstance(raw.columns, pd.MultiIndex) and 'Close' in raw.columns.levels[0]:
-            prices = raw['Close'].iloc[-1]
-        else:
-            prices = pd.Series(index=tickers, data=[0]*len(tickers))
-    else:
-        prices = pd.Series(dtype=float)
+    prices = get_quote_cache().prices(tickers) if tickers else pd.Series(dtype=float)
 
     df['股價'] = df['Yahoo代碼'].map(prices.to_dict()).fillna(0)
     df['原幣市值'] = df['股數'] * df['股價']
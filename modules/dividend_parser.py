@@ -0,0 +1,106 @@
+#dividend_parser.py
+import os
+import threading
+import pandas as pd
+from modules.cash_parser import convert_to_twd, file_signature
+from modules.time_utils import to_period_index
+from modules.workbook_cache import load_sheet
+from modules.instrumentation import traced, count
+from config import DIVIDEND_FILE, DIVIDEND_SHEET, FX_SNAPSHOT_PATH
+
+# 分配持股時，股利月份沒有持股則往前找的月數（除息日通常早於發放日）
+HOLDING_LOOKBACK_MONTHS = 2
+
+DIVIDEND_COLUMNS = ['月份', '出資者', '股票代號', '股利_TWD']
+
+# 換算後的股利紀錄快取：(絕對路徑, 工作表) ➔ (檔案指紋, 匯率快照指紋, DataFrame)
+_dividend_cache = {}
+_dividend_lock = threading.Lock()
+
+
+def _normalize_code(code):
+    """Excel 中的代號可能是數字、帶引號的文字（'0050'）或 2330.0，統一為大寫文字"""
+    text = str(code).strip().strip("'").strip().upper()
+    return text[:-2] if text.endswith('.0') else text
+
+
+@traced("dividends.load")
+def load_dividends(filepath=DIVIDEND_FILE, sheet_name=DIVIDEND_SHEET) -> pd.DataFrame:
+    """
+    讀取股利紀錄並一次換算為 TWD（走 workbook 快取，不會重新解析 Excel）。
+    回傳欄位：日期、月份、股票代號、幣別、現金股利、股利_TWD。
+    Excel 與匯率快照都未變動時直接回傳快取結果（副本）。
+    """
+    key = (os.path.abspath(filepath), sheet_name)
+    signature = (file_signature(filepath), file_signature(FX_SNAPSHOT_PATH))
+
+    with _dividend_lock:
+        cached = _dividend_cache.get(key)
+        if cached and cached[0] == signature:
+            count("cache.dividends.hit")
+            return cached[1].copy()
+
+        count("cache.dividends.miss")
+        df = load_sheet(filepath, sheet_name)
+        df = df[df['現金股利'].notna()].copy()
+        df['日期'] = pd.to_datetime(df['交易日期'].astype(str), format='mixed')
+        df['月份'] = to_period_index(df['日期'])
+        df['股票代號'] = df['股票代號'].map(_normalize_code)
+        df['股利_TWD'] = convert_to_twd(df, amount_column='現金股利')
+        df = df[['日期', '月份', '股票代號', '幣別', '現金股利', '股利_TWD']].reset_index(drop=True)
+
+        _dividend_cache[key] = (signature, df)
+        return df.copy()
+
+
+@traced("dividends.allocate")
+def allocate_dividends(dividends: pd.DataFrame, holdings_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    股利紀錄沒有出資者，依發放當月各出資者的累計股數比例分配；
+    當月已無持股時往前 HOLDING_LOOKBACK_MONTHS 個月找最近有持股的月份。
+    股利的代號（2330、0050）會對應到交易紀錄的代號（2330.TW、0050.TW）。
+    回傳 long format：月份、出資者、股票代號、股利_TWD；找不到持股的股利會一起列在錯誤訊息中。
+    """
+    if dividends.empty:
+        return pd.DataFrame(columns=DIVIDEND_COLUMNS)
+
+    codes = pd.Series(holdings_df['股票代號'].unique())
+    base_code = dict(zip(codes.str.split('.').str[0].str.upper(), codes))
+    dividends = dividends.assign(
+        股票代號=dividends['股票代號'].map(base_code).fillna(dividends['股票代號']),
+        股利編號=range(len(dividends))
+    )
+
+    positions = holdings_df.loc[holdings_df['累計股數'] > 0, ['月份', '股票代號', '出資者', '累計股數']]
+    candidates = pd.concat([
+        dividends.assign(回溯=lag, 持股月份=dividends['月份'] - lag)
+        for lag in range(HOLDING_LOOKBACK_MONTHS + 1)
+    ], ignore_index=True).merge(
+        positions.rename(columns={'月份': '持股月份'}), on=['持股月份', '股票代號'], how='inner'
+    )
+
+    # 每筆股利只採用最近一個有持股的月份
+    chosen = candidates['回溯'] == candidates.groupby('股利編號')['回溯'].transform('min')
+    allocated = candidates[chosen]
+
+    missing = dividends[~dividends['股利編號'].isin(allocated['股利編號'])]
+    if not missing.empty:
+        listed = '、'.join(f"{month} {code}" for month, code in zip(missing['月份'].astype(str), missing['股票代號']))
+        raise ValueError(f"❌ 以下股利找不到對應的持股：{listed}")
+
+    ratio = allocated['累計股數'] / allocated.groupby('股利編號')['累計股數'].transform('sum')
+    return (
+        allocated.assign(股利_TWD=allocated['股利_TWD'] * ratio)
+        .groupby(['月份', '出資者', '股票代號'], as_index=False)['股利_TWD'].sum()
+    )[DIVIDEND_COLUMNS]
+
+
+def summarize_dividends(allocated: pd.DataFrame, months, all_owners) -> pd.DataFrame:
+    """每位出資者每月的股利收入（index 為月份，欄位為出資者）"""
+    summary = (
+        allocated.groupby(['月份', '出資者'])['股利_TWD'].sum()
+        .unstack(fill_value=0)
+        .reindex(index=pd.PeriodIndex(months, name='月份'), columns=list(all_owners), fill_value=0)
+    )
+    summary.columns.name = None
+    return summary
@@ -0,0 +1,63 @@
+#encoding.py
+import numpy as np
+import pandas as pd
+from modules.time_utils import to_period_index, periods_from_ordinals
+
+# 管線內部的精簡表示法：
+# - 實體（出資者、股票代號、幣別、市場）➔ int32 代碼 + 排序後的標籤表（代碼順序即字串排序）
+# - 月份 ➔ int32 月份鍵（1970-01 起算的月數，與 Period('M').ordinal 相同）
+# groupby、對齊與彙總都在整數上進行，只有輸出結果（頁面、AssetValueResult）才解碼回字串與 Period。
+
+
+def encode(values, labels=None):
+    """
+    將一欄實體編碼為 (int32 代碼, 標籤 Index)。
+    - labels=None：依排序後的唯一值編碼（與字串 groupby 的排序一致）
+    - 指定 labels：依給定的標籤表編碼，不在表中的值代碼為 -1
+    空值的代碼為 -1。
+    """
+    if labels is None:
+        codes, uniques = pd.factorize(np.asarray(values), sort=True)
+        return codes.astype("int32"), pd.Index(uniques)
+    labels = pd.Index(labels)
+    return labels.get_indexer(values).astype("int32"), labels
+
+
+def month_keys(months) -> np.ndarray:
+    """月份（Period、datetime、字串皆可；整數視為已編碼的月份鍵）➔ int32 月份鍵"""
+    if isinstance(months, pd.Period):
+        return np.int32(months.ordinal)
+    dtype = getattr(months, "dtype", None)
+    if dtype is not None and pd.api.types.is_integer_dtype(dtype):
+        # 已經是月份鍵
+        return np.asarray(months, dtype="int32")
+    if isinstance(dtype, pd.PeriodDtype):
+        return pd.PeriodIndex(months).asi8.astype("int32")
+    if dtype is not None and pd.api.types.is_datetime64_any_dtype(dtype):
+        values = pd.DatetimeIndex(months).tz_localize(None).to_numpy().astype("datetime64[M]")
+        return values.astype("int64").astype("int32")
+    return to_period_index(pd.Index(months)).asi8.astype("int32")
+
+
+def decode_months(keys, name="月份") -> pd.PeriodIndex:
+    """int32 月份鍵 ➔ PeriodIndex（只在輸出時使用）"""
+    return periods_from_ordinals(np.asarray(keys, dtype="int64")).rename(name)
+
+
+def month_positions(keys, months) -> np.ndarray:
+    """每個 int32 月份鍵在月份 index（PeriodIndex 等，可未排序）中的位置，不存在則為 -1；取代 get_indexer 的雜湊查表"""
+    index_keys = month_keys(months)
+    if len(index_keys) == 0:
+        return np.full(len(keys), -1, dtype="int64")
+    order = np.argsort(index_keys, kind="stable")
+    sorted_keys = index_keys[order]
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return np.where(sorted_keys[pos] == keys, order[pos], -1)
+
+
+def grid_sum(rows, cols, values, shape) -> np.ndarray:
+    """以 (列代碼, 欄代碼) 加總 values 成 shape 的矩陣；代碼為 -1 或值為 NaN 的列略過（等同 groupby 的 sum）"""
+    values = np.asarray(values, dtype="float64")
+    valid = (rows >= 0) & (cols >= 0) & ~np.isnan(values)
+    flat = rows[valid].astype("int64") * shape[1] + cols[valid]
+    return np.bincount(flat, weights=values[valid], minlength=shape[0] * shape[1]).reshape(shape)
@@ -0,0 +1,98 @@
+#fetch_executor.py
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from modules.instrumentation import span, bind
+from config import FETCH_MAX_WORKERS, FETCH_RATE_PER_SEC, FETCH_BURST, FETCH_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    權杖桶限速器：每秒補充 rate 個權杖，最多累積 capacity 個。
+    每次對外請求前呼叫 acquire()，沒有權杖時等待，避免短時間內大量打 API。
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+class FetchExecutor:
+    """
+    有上限的執行緒池 + 限速器，用來並行執行價格 / 匯率下載。
+    - run(tasks)：tasks 為 {key: callable}，callable 會收到 timeout 參數（秒），
+      應轉交給實際的網路請求（例如 yf.download(timeout=...)）
+    - 回傳 {key: 結果}；失敗或逾時的 key 不會出現在結果中（已記錄 log）
+    結果由呼叫端在主執行緒合併回快照，避免多執行緒同時修改 DataFrame。
+    """
+
+    def __init__(self, max_workers=FETCH_MAX_WORKERS, rate=FETCH_RATE_PER_SEC, burst=FETCH_BURST, timeout=FETCH_TIMEOUT):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+
+    def _call(self, key, func):
+        with span("fetch.request", key=str(key)) as current:
+            waited = time.perf_counter()
+            self.bucket.acquire()
+            current.set(throttle_ms=round((time.perf_counter() - waited) * 1000, 3))
+            result = func(timeout=self.timeout)
+            if hasattr(result, "shape"):
+                current.set(rows=int(result.shape[0]))
+            return result
+
+    def run(self, tasks: dict) -> dict:
+        if not tasks:
+            return {}
+
+        futures = {self._pool.submit(bind(self._call), key, func): key for key, func in tasks.items()}
+
+        # 整批的等待上限：每一輪 worker 最多 timeout 秒，再加上限速造成的排隊時間
+        rounds = math.ceil(len(tasks) / self.max_workers)
+        deadline = self.timeout * (rounds + 1) + len(tasks) / self.bucket.rate
+        done, not_done = wait(futures, timeout=deadline)
+
+        results = {}
+        for future in done:
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                logger.error("❌ 下載失敗 %s：%s", key, e)
+        for future in not_done:
+            future.cancel()
+            logger.error("⏱️ 下載逾時 %s", futures[future])
+        return results
+
+
+_default_executor = None
+_default_lock = threading.Lock()
+
+
+def get_fetch_executor() -> FetchExecutor:
+    """取得全域共用的 FetchExecutor（同一個限速器，跨模組、跨 session 共用）"""
+    global _default_executor
+    with _default_lock:
+        if _default_executor is None:
+            _default_executor = FetchExecutor()
+        return _default_executor
@@ -1,70 +1,115 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import logging
 import os
-import yfinance as yf
-from modules.time_utils import to_period_index
+from modules.time_utils import to_period_index, group_contiguous_months
+from modules.encoding import encode, month_keys, month_positions, decode_months
+from modules.fetch_executor import get_fetch_executor
+from modules.market_data import get_market_data
+from modules.instrumentation import traced
+from modules.snapshot_store import SnapshotStore, read_derived, read_period_snapshot
 from datetime import datetime
+from config import FX_PAIRS
 
 # --- 設定快照檔案路徑與預設匯率 ---
 FX_SNAPSHOT_PATH = "data/monthly_fx_history.parquet"
-DEFAULT_RATE = 30.0
-
-# --- 主功能：搶取每月 USD/TWD 匯率（中位數） ---
-def fetch_monthly_fx(months):
+DEFAULT_RATE = 30.0  # USD 下載失敗時的預設匯率
+BASE_CURRENCY = "TWD"
+
+# --- 主功能：搶取每月各幣別兌台幣匯率（中位數） ---
+@traced("fx.monthly")
+def fetch_monthly_fx(months, overwrite=False):
+    """
+    取得指定月份各幣別（FX_PAIRS）兌台幣的匯率（每月中位數），快照中缺少的月份才會下載。
+    - overwrite=True：強制重新下載指定月份（例如刷新當月匯率），也會重試先前查無資料的幣別
+    來源查無資料的非 USD 幣別記在「無資料幣別」欄，之後不再重複下載該月份。
+    所有幣別的匯率代碼合併成同一次多代碼下載；快照只有在實際補入新資料時才會寫回。
+    """
     months = to_period_index(months)
     unique_months = sorted(set(months))
+    currencies = list(FX_PAIRS)
 
     # 讀取已存在快照
-    if os.path.exists(FX_SNAPSHOT_PATH):
-        fx_df = pd.read_parquet(FX_SNAPSHOT_PATH)
-    else:
-        fx_df = pd.DataFrame()
-
-    fx_df = fx_df.copy()
-    if "資料日期" not in fx_df.columns:
-        fx_df["資料日期"] = pd.NaT
-    if "USD" not in fx_df.columns:
-        fx_df["USD"] = pd.NA
-    if "來源" not in fx_df.columns:
-        fx_df["來源"] = pd.NA
-
-    today = pd.Timestamp.today().normalize()
-
-    for month in unique_months:
-        if month in fx_df.index and pd.notna(fx_df.at[month, "USD"]):
-            continue
-
-        try:
-            start_date = month.to_timestamp(how="start")
-            end_date = month.to_timestamp(how="end") + pd.Timedelta(days=1)
-
-            data = yf.download("TWD=X", start=start_date, end=end_date, progress=False)
-            close = data["Close"].dropna()
-            if not close.empty:
-                median_rate = round(float(close.median()), 4)
-                fx_df.at[month, "USD"] = median_rate
-                fx_df.at[month, "來源"] = "Yahoo Finance"
-                fx_df.at[month, "資料日期"] = today
-                logging.info(f"✅ 匯率 @ {month} ➔ {median_rate}")
+    store = SnapshotStore(FX_SNAPSHOT_PATH)
+    # 讀取 ➔ 補抓 ➔ 寫回期間持有快照鎖（背景更新的 overwrite 與頁面補抓可能同時進行）
+    with store.lock:
+        fx_df = store.load()
+
+        fx_df = fx_df.copy()
+        if "資料日期" not in fx_df.columns:
+            fx_df["資料日期"] = pd.NaT
+        for column in currencies + ["來源", "無資料幣別"]:
+            if column not in fx_df.columns:
+                fx_df[column] = pd.NA
+
+        today = pd.Timestamp.today().normalize()
+
+        # 任一幣別缺值的月份都要補抓（新增幣別時，既有月份也會一起補齊）；
+        # 已嘗試過但來源查無資料的幣別（無資料幣別）視為已完成，避免每次呼叫都重新下載
+        known = fx_df.reindex(unique_months)
+        unavailable = "," + known["無資料幣別"].fillna("").astype(str) + ","
+        complete = np.ones(len(unique_months), dtype=bool)
+        for currency in currencies:
+            attempted = unavailable.str.contains(f",{currency},", regex=False)
+            complete &= (known[currency].notna() | attempted).to_numpy()
+        missing_months = [month for month, ok in zip(unique_months, complete) if overwrite or not ok]
+        if missing_months or not store.exists():
+            store.mark_dirty()
+
+        provider = get_market_data()
+        tickers = list(FX_PAIRS.values())
+
+        def download_task(first_month, last_month):
+            def task(timeout):
+                start_date = first_month.to_timestamp(how="start")
+                end_date = last_month.to_timestamp(how="end").normalize() + pd.Timedelta(days=1)
+                return provider.daily_closes(tickers, start=start_date, end=end_date, timeout=timeout)
+            return task
+
+        # 缺漏月份合併為連續區段，每段只下載一次（所有幣別一起），各區段並行
+        spans = group_contiguous_months(missing_months)
+        downloads = get_fetch_executor().run({span: download_task(*span) for span in spans})
+
+        # 一次 groupby 算出每月 × 幣別的中位數
+        medians = []
+        for span in spans:
+            data = downloads.get(span)
+            if data is None or data.empty:
+                logging.warning(f"❌ 無法下載 {span[0]} ~ {span[1]} 匯率")
                 continue
-        except Exception as e:
-            logging.warning(f"❌ 無法下載 {month} 匯率：{e}")
-
-        fx_df.at[month, "USD"] = DEFAULT_RATE
-        fx_df.at[month, "來源"] = "預設值"
-        fx_df.at[month, "資料日期"] = today
-        logging.warning(f"⚠️ {month} 匯率設為預設值 {DEFAULT_RATE}")
-
-    fx_df["TWD"] = 1.0
-    fx_df["USD"] = pd.to_numeric(fx_df["USD"], errors="coerce")
-    fx_df["資料日期"] = pd.to_datetime(fx_df["資料日期"], errors="coerce")
-    fx_df = fx_df.convert_dtypes()
-    fx_df = fx_df.sort_index()
-
-    os.makedirs(os.path.dirname(FX_SNAPSHOT_PATH), exist_ok=True)
-    fx_df.to_parquet(FX_SNAPSHOT_PATH)
-    logging.info(f"📂 匯率快照已儲存至：{FX_SNAPSHOT_PATH}")
+            data = data.reindex(columns=tickers)
+            medians.append(data.groupby(data.index.to_period("M")).median().round(4))
+        medians = pd.concat(medians) if medians else pd.DataFrame(columns=tickers, dtype="float64")
+        medians.columns = currencies
+
+        for month in missing_months:
+            downloaded = medians.loc[month] if month in medians.index else pd.Series(dtype="float64")
+            for currency in currencies:
+                rate = downloaded.get(currency)
+                if pd.notna(rate):
+                    fx_df.at[month, currency] = rate
+                elif currency == "USD":
+                    fx_df.at[month, currency] = DEFAULT_RATE
+                    logging.warning(f"⚠️ {month} 匯率設為預設值 {DEFAULT_RATE}")
+                elif pd.isna(fx_df.at[month, currency]):
+                    logging.warning(f"⚠️ {month} 無法取得 {currency} 匯率")
+            failed = [currency for currency in currencies if pd.isna(fx_df.at[month, currency])]
+            fx_df.at[month, "無資料幣別"] = ",".join(failed) if failed else pd.NA
+            has_data = downloaded.notna().any()
+            fx_df.at[month, "來源"] = provider.source if has_data else "預設值"
+            fx_df.at[month, "資料日期"] = today
+            if has_data:
+                logging.info(f"✅ 匯率 @ {month} ➔ {downloaded.dropna().to_dict()}")
+
+        fx_df[BASE_CURRENCY] = 1.0
+        for currency in currencies:
+            fx_df[currency] = pd.to_numeric(fx_df[currency], errors="coerce")
+        fx_df["資料日期"] = pd.to_datetime(fx_df["資料日期"], errors="coerce")
+        fx_df = fx_df.convert_dtypes()
+        fx_df = fx_df.sort_index()
+
+        store.save(fx_df)
 
     return fx_df.loc[unique_months]
 
@@ -77,9 +122,9 @@ def get_fx_rate_for(month_str, fallback=DEFAULT_RATE):
 # --- 擴充功能：直接取得快照中最新匯率（不重抓） ---
 def get_latest_fx_rate():
     if os.path.exists(FX_SNAPSHOT_PATH):
-        fx_df = pd.read_parquet(FX_SNAPSHOT_PATH).sort_index()
+        fx_df = read_period_snapshot(FX_SNAPSHOT_PATH).sort_index()
         latest = fx_df.iloc[-1]
-        return latest["USD"], latest["資料日期"].strftime("%Y-%m-%d")
+        return latest["USD"], latest["資料日期"].strftime("%Y-%m-%d") if pd.notna(latest["資料日期"]) else "未知"
     return DEFAULT_RATE, "未知"
 
 # --- 擴充功能：輸入特定日期（yyyy-mm-dd），自動取當月匯率 ---
@@ -91,12 +136,65 @@ def get_fx_rate():
     """簡化主程式用法：直接取得今天的匯率與日期"""
     return get_fx_rate_on_date(datetime.today().strftime("%Y-%m-%d"))
 
-# 將 snapshot 中的匯率資料轉為 long format（方便依月份與幣別查詢）
-# 回傳值為 Series，index 為 (月份, 幣別)，value 為匯率
-# 用於金額轉換時能直接用 fx.loc[(month, currency)] 查出匯率
-def load_fx_rates():
-    fx_df = pd.read_parquet(FX_SNAPSHOT_PATH)
-    fx_df.index = to_period_index(fx_df.index)
-    fx_long = fx_df.stack().reset_index()
-    fx_long.columns = ["Month", "Currency", "Rate"]
-    return fx_long.set_index(["Month", "Currency"])["Rate"]
\ No newline at end of file
+# --- 匯率矩陣：月份 × 幣別，換算時以 (月份, 幣別) 一次 gather 整欄匯率 ---
+def fx_rate_matrix(fx_df) -> pd.DataFrame:
+    """匯率快照 ➔ 月份 × 幣別（FX_PAIRS + 台幣）的 float64 矩陣，台幣固定為 1，index 為 PeriodIndex"""
+    index = to_period_index(fx_df.index)
+    matrix = pd.DataFrame({
+        currency: pd.to_numeric(fx_df[currency], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+        if currency in fx_df.columns else np.nan
+        for currency in FX_PAIRS
+    }, index=index)
+    matrix[BASE_CURRENCY] = 1.0
+    return matrix.sort_index()
+
+
+def load_fx_matrix() -> pd.DataFrame:
+    """讀取匯率快照的月份 × 幣別矩陣（與快照一起快取，快照變動時自動失效）"""
+    return read_derived(FX_SNAPSHOT_PATH, "fx_matrix", fx_rate_matrix)
+
+
+def lookup_rates(matrix: pd.DataFrame, months, currencies) -> np.ndarray:
+    """
+    以 (月份, 幣別) 從匯率矩陣一次取出整欄匯率：月份鍵 ➔ 列位置、幣別代碼 ➔ 欄位置。
+    矩陣中沒有的月份或幣別為 NaN，由 fill_missing_rates / require_rates 補值或報錯。
+    """
+    rows = month_positions(month_keys(months), matrix.index)
+    cols, _ = encode(currencies, matrix.columns)
+    values = matrix.to_numpy(dtype="float64", na_value=np.nan)
+    found = (rows >= 0) & (cols >= 0)
+    rates = np.full(len(rows), np.nan)
+    rates[found] = values[rows[found], cols[found]]
+    return rates
+
+
+def require_rates(rates, months, currencies) -> np.ndarray:
+    """
+    不補預設值的嚴格規則（現金帳使用）：台幣 ➔ 1，其他幣別（含幣別空白）缺匯率時
+    一次列出所有缺少的 (月份, 幣別) 後報錯。
+    """
+    currencies = pd.Series(np.asarray(currencies, dtype=object))
+    rates = np.where((currencies == BASE_CURRENCY).to_numpy(), 1.0, np.asarray(rates, dtype="float64"))
+
+    missing = np.isnan(rates)
+    if missing.any():
+        labels = decode_months(month_keys(months)[missing]).astype(str)
+        names = currencies[missing].map(lambda currency: "（幣別空白）" if pd.isna(currency) else str(currency))
+        pairs = sorted(set(zip(labels, names)))
+        listed = "、".join(f"{month} {currency}" for month, currency in pairs)
+        raise ValueError(f"❌ 找不到以下月份的匯率：{listed}")
+    return rates
+
+
+def fill_missing_rates(rates, months, currencies) -> np.ndarray:
+    """
+    估值與交易成本換算的缺匯率規則（lookup_rates 之後呼叫）：
+    - 台幣（或幣別空白）➔ 1
+    - USD 缺值 ➔ DEFAULT_RATE
+    - 其他幣別缺值 ➔ 同 require_rates，一次列出所有缺少的 (月份, 幣別) 後報錯
+    """
+    currencies = pd.Series(np.asarray(currencies, dtype=object))
+    rates = np.asarray(rates, dtype="float64")
+    rates = np.where(currencies.isna().to_numpy(), 1.0, rates)
+    rates = np.where((currencies == "USD").to_numpy() & np.isnan(rates), DEFAULT_RATE, rates)
+    return require_rates(rates, months, currencies)
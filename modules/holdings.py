@@ -0,0 +1,81 @@
+#holdings.py
+import numpy as np
+import pandas as pd
+from modules.encoding import encode, month_keys, decode_months
+
+HOLDING_KEYS = ['股票代號', '出資者']
+
+
+def build_sparse_holdings(df: pd.DataFrame, end_month: pd.Period, start_month: pd.Period = None, opening: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    以稀疏方式建立每月持股：只保留「曾經有交易」的 (股票代號, 出資者)，
+    且只展開累計股數不為 0 的月份區段（向前填補到下一次交易或 end_month）。
+    回傳 long format 欄位：月份、股票代號、出資者、股數、成本、累計股數、累計成本。
+    股數、成本為當月淨變動（非交易月份為 0）。
+    增量重算時傳入 start_month 與 opening（start_month 前一個月的累計股數、累計成本），
+    只會處理 start_month 之後的交易並只回傳 start_month 之後的月份。
+    分組與展開都以 int32 代碼與月份鍵進行，最後才解碼回股票代號、出資者與 Period。
+    """
+    columns = ['月份'] + HOLDING_KEYS + ['股數', '成本', '累計股數', '累計成本']
+    months = month_keys(df['月份'])
+    keep = months <= end_month.ordinal
+    if start_month is not None:
+        keep &= months >= start_month.ordinal
+
+    tickers = df['股票代號'].to_numpy(dtype=object)[keep]
+    owners = df['出資者'].to_numpy(dtype=object)[keep]
+    months = months[keep]
+    shares = df['股數'].to_numpy(dtype='float64')[keep]
+    cost = df['成本'].to_numpy(dtype='float64')[keep]
+    if start_month is not None and opening is not None and not opening.empty:
+        # 期初部位視為前一個月的一筆交易，後續 cumsum 就會從期初值往下累計
+        tickers = np.concatenate([opening['股票代號'].to_numpy(dtype=object), tickers])
+        owners = np.concatenate([opening['出資者'].to_numpy(dtype=object), owners])
+        months = np.concatenate([np.full(len(opening), start_month.ordinal - 1, dtype='int32'), months])
+        shares = np.concatenate([opening['累計股數'].to_numpy(dtype='float64'), shares])
+        cost = np.concatenate([opening['累計成本'].to_numpy(dtype='float64'), cost])
+
+    ticker_codes, ticker_labels = encode(tickers)
+    owner_codes, owner_labels = encode(owners)
+    coded = pd.DataFrame({'股票': ticker_codes, '出資者': owner_codes, '月份': months, '股數': shares, '成本': cost})
+    # 代碼為 -1 表示空值，與字串 groupby 一樣略過
+    coded = coded[(ticker_codes >= 0) & (owner_codes >= 0)]
+    if coded.empty:
+        return pd.DataFrame(columns=columns)
+
+    # 代碼依字串排序編成，groupby 的排序結果與依股票代號、出資者、月份排序相同
+    flows = coded.groupby(['股票', '出資者', '月份'], sort=True).sum().reset_index()
+    pair = flows['股票'].to_numpy(dtype='int64') * len(owner_labels) + flows['出資者'].to_numpy()
+    cum_shares = flows.groupby(pair)['股數'].cumsum().to_numpy()
+    cum_cost = flows.groupby(pair)['成本'].cumsum().to_numpy()
+
+    # 每筆交易月份的累計值，一直有效到同組下一筆交易的前一個月（最後一筆到 end_month）
+    ordinal = flows['月份'].to_numpy(dtype='int64')
+    next_ordinal = np.append(ordinal[1:], 0)
+    last_in_group = np.ones(len(flows), dtype=bool)
+    last_in_group[:-1] = pair[:-1] != pair[1:]
+    next_ordinal[last_in_group] = end_month.ordinal + 1
+    span = next_ordinal - ordinal
+
+    # 只展開仍有持股的區段；交易當月即使清倉也保留一列，以記錄當月的變動
+    held = ~np.isclose(cum_shares, 0)
+    span = np.where(held, span, 1)
+
+    row_idx = np.repeat(np.arange(len(flows)), span)
+    offset = np.arange(len(row_idx)) - np.repeat(np.cumsum(span) - span, span)
+    sparse_months = ordinal[row_idx] + offset
+    is_flow_month = offset == 0
+
+    if start_month is not None:
+        visible = sparse_months >= start_month.ordinal
+        row_idx, sparse_months, is_flow_month = row_idx[visible], sparse_months[visible], is_flow_month[visible]
+
+    return pd.DataFrame({
+        '月份': decode_months(sparse_months),
+        '股票代號': ticker_labels.to_numpy(dtype=object)[flows['股票'].to_numpy()[row_idx]],
+        '出資者': owner_labels.to_numpy(dtype=object)[flows['出資者'].to_numpy()[row_idx]],
+        '股數': np.where(is_flow_month, flows['股數'].to_numpy()[row_idx], 0.0),
+        '成本': np.where(is_flow_month, flows['成本'].to_numpy()[row_idx], 0.0),
+        '累計股數': cum_shares[row_idx],
+        '累計成本': cum_cost[row_idx],
+    })[columns]
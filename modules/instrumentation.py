@@ -0,0 +1,226 @@
+#instrumentation.py
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from config import INSTRUMENTATION_ENABLED, INSTRUMENTATION_LOG_PATH, INSTRUMENTATION_LOG_MAX_BYTES, INSTRUMENTATION_HISTORY
+
+logger = logging.getLogger(__name__)
+
+# 效能追蹤：以 span 包住各階段，記錄耗時、列數與計數器（網路請求、快取命中 / 未命中）。
+# - 最外層的 span 即為一次追蹤（例如一次頁面渲染），結束時輸出一行 JSON log，並保留在 recent_traces()
+# - 停用時 span() 回傳共用的空物件、count() 直接返回，額外負擔只有一次布林判斷
+# - 執行緒池中的工作需以 bind() 包裝，才能掛在提交端的 span 底下
+# - 開關以 contextvar 覆寫 config 預設值：除錯頁面勾選只影響該次頁面執行，不會改變其他 session 或背景執行緒
+
+_enabled = contextvars.ContextVar("instrumentation_enabled", default=INSTRUMENTATION_ENABLED)
+_current_span = contextvars.ContextVar("current_span", default=None)
+_ids = itertools.count(1)
+_history = deque(maxlen=INSTRUMENTATION_HISTORY)
+_history_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return _enabled.get()
+
+
+def set_enabled(enabled: bool):
+    """
+    在目前的 context 開關追蹤（例如在除錯頁面勾選）。
+    只影響目前的頁面執行（與以 bind() 帶到執行緒池的工作），其他 session 仍使用 config 預設值。
+    """
+    _enabled.set(bool(enabled))
+
+
+class _Trace:
+    """一次追蹤：收集底下所有 span（可能來自不同執行緒）與計數器總和"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def add(self, record, counters):
+        with self.lock:
+            self.spans.append(record)
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_record(self, duration):
+        return {
+            "trace": self.name,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "duration_ms": round(duration * 1000, 3),
+            "counters": dict(self.counters),
+            "cache_hit_ratio": cache_hit_ratios(self.counters),
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }
+
+
+class Span:
+    """
+    計時區段；以 with 使用。
+    - set(**attrs)：附加屬性（例如 rows=len(df)），會出現在 JSON log 中
+    - count(name, n)：累加計數器，同時計入所屬追蹤的總和
+    """
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.counters = {}
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.id = next(_ids)
+        self.parent_id = parent.id if parent is not None else None
+        self.trace = parent.trace if parent is not None else _Trace(self.name)
+        self._token = _current_span.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        self.trace.add({
+            "id": self.id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "thread": threading.current_thread().name,
+            "start_ms": round((self._start - self.trace.origin) * 1000, 3),
+            "duration_ms": round((end - self._start) * 1000, 3),
+            "attrs": self.attrs,
+            "counters": self.counters,
+        }, self.counters)
+        if self.parent_id is None:
+            _finish(self.trace.to_record(end - self._start))
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+class _NoopSpan:
+    """停用時的共用空物件"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        return self
+
+    def count(self, name, n=1):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, **attrs):
+    """建立計時區段；停用時回傳共用的空物件"""
+    if not _enabled.get():
+        return _NOOP
+    return Span(name, attrs)
+
+
+def traced(name=None):
+    """
+    裝飾器：整個函式包成一個 span，回傳 DataFrame / Series 時一併記錄列數。
+    停用時直接呼叫原函式。
+    """
+    def decorate(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled.get():
+                return func(*args, **kwargs)
+            with Span(label, {}) as current:
+                result = func(*args, **kwargs)
+                if hasattr(result, "shape"):
+                    current.set(rows=int(result.shape[0]))
+                return result
+        return wrapper
+    return decorate
+
+
+def count(name, n=1):
+    """累加目前 span 的計數器（例如 network.requests、cache.workbook.hit）；不在 span 中則忽略"""
+    if not _enabled.get():
+        return
+    current = _current_span.get()
+    if current is not None:
+        current.count(name, n)
+
+
+def bind(func):
+    """
+    讓 func 在其他執行緒執行時仍掛在目前的 span 底下。
+    必須在提交端呼叫（每個工作各自複製一份 context，同一份 context 不能同時在兩個執行緒進入）。
+    """
+    if not _enabled.get() or _current_span.get() is None:
+        return func
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+def cache_hit_ratios(counters) -> dict:
+    """由 cache.<名稱>.hit / cache.<名稱>.miss 計數器算出各快取的命中率"""
+    names = {key[len("cache."):].rsplit(".", 1)[0] for key in counters if key.startswith("cache.")}
+    ratios = {}
+    for name in sorted(names):
+        hit = counters.get(f"cache.{name}.hit", 0)
+        total = hit + counters.get(f"cache.{name}.miss", 0)
+        if total:
+            ratios[name] = round(hit / total, 4)
+    return ratios
+
+
+def _rotate_log(incoming):
+    """寫入後會超過 INSTRUMENTATION_LOG_MAX_BYTES 時，把目前的 log 改名為 .1（覆蓋更舊的一份）"""
+    if not INSTRUMENTATION_LOG_MAX_BYTES:
+        return
+    try:
+        size = os.path.getsize(INSTRUMENTATION_LOG_PATH)
+    except OSError:
+        return
+    if size and size + incoming > INSTRUMENTATION_LOG_MAX_BYTES:
+        os.replace(INSTRUMENTATION_LOG_PATH, INSTRUMENTATION_LOG_PATH + ".1")
+
+
+def _finish(record):
+    with _history_lock:
+        _history.append(record)
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    logger.info(line)
+    if INSTRUMENTATION_LOG_PATH:
+        try:
+            os.makedirs(os.path.dirname(INSTRUMENTATION_LOG_PATH) or ".", exist_ok=True)
+            with _history_lock:
+                _rotate_log(len(line.encode("utf-8")) + 1)
+                with open(INSTRUMENTATION_LOG_PATH, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        except OSError as e:
+            logger.warning("⚠️ 無法寫入效能追蹤 log：%s", e)
+
+
+def recent_traces() -> list:
+    """最近完成的追蹤（新到舊），供除錯頁面顯示"""
+    with _history_lock:
+        return list(reversed(_history))
@@ -0,0 +1,109 @@
+#lot_matching.py
+import numpy as np
+
+# 小於此股數的配對視為浮點誤差，不輸出
+EPS = 1e-9
+# 移動平均成本的累乘比例低於 e^-460（約 1e-200）時重新起算，避免 cumprod 下溢
+RENORMALIZE_LOG = 460.0
+
+
+def effective_sell_intervals(is_buy: np.ndarray, qty: np.ndarray):
+    """
+    單一群組（同一出資者、同一股票，已依時間排序）的累計股數軸：
+    - 買入列 k 佔據 [C_k - q_k, C_k)，C 為累計買入股數
+    - 賣出列 j 佔據 [M_{j-1}, M_j)，M_j = S_j + min(0, cummin(C_k - S_k))，
+      S 為累計賣出股數；超過當時庫存的賣出股數被截掉（與逐筆 FIFO 的行為相同）
+    回傳 (lo, hi, buy_lo, buy_hi)：lo / hi 為賣出區間，買入列的長度為 0。
+    """
+    buys = np.where(is_buy, qty, 0.0)
+    sells = np.where(is_buy, 0.0, qty)
+    bought = np.cumsum(buys)
+    sold = np.cumsum(sells)
+    matched = sold + np.minimum(0.0, np.minimum.accumulate(bought - sold))
+    lo = np.concatenate([[0.0], matched[:-1]])
+    return lo, matched, bought - buys, bought
+
+
+def fifo_match(is_buy: np.ndarray, qty: np.ndarray):
+    """
+    以區間重疊做 FIFO 配對：每筆賣出區間與哪些買入區間重疊，由 searchsorted 一次求出。
+    回傳 (賣出列位置, 買入列位置, 配對股數) 三個等長陣列，依賣出順序、買入順序排列。
+    """
+    lo, hi, buy_lo, buy_hi = effective_sell_intervals(is_buy, qty)
+
+    buy_pos = np.flatnonzero(is_buy & (qty > 0))
+    sell_pos = np.flatnonzero(~is_buy & (hi - lo > EPS))
+    if len(buy_pos) == 0 or len(sell_pos) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0, dtype="float64")
+
+    b_lo, b_hi = buy_lo[buy_pos], buy_hi[buy_pos]
+    s_lo, s_hi = lo[sell_pos], hi[sell_pos]
+
+    # 與賣出區間重疊的買入：b_hi > s_lo 且 b_lo < s_hi（兩者皆為遞增序列）
+    first = np.searchsorted(b_hi, s_lo, side="right")
+    last = np.searchsorted(b_lo, s_hi, side="left")
+    counts = np.maximum(last - first, 0)
+
+    sell_idx = np.repeat(np.arange(len(sell_pos)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    buy_idx = np.repeat(first, counts) + offsets
+
+    shares = np.minimum(b_hi[buy_idx], s_hi[sell_idx]) - np.maximum(b_lo[buy_idx], s_lo[sell_idx])
+    keep = shares > EPS
+    return sell_pos[sell_idx[keep]], buy_pos[buy_idx[keep]], shares[keep]
+
+
+def average_cost_match(is_buy: np.ndarray, qty: np.ndarray, price: np.ndarray):
+    """
+    移動平均成本法：賣出時以當下庫存的平均單價計算成本，賣出不改變平均單價，
+    庫存歸零後重新起算。
+    成本池 V 滿足 V_t = a_t · V_{t-1} + b_t（買入 a=1、b=股數×單價；賣出 a=剩餘比例、b=0），
+    以 cumprod / cumsum 一次求出，不需逐筆迴圈；長區段的累乘比例過小時切成數段，
+    每段以前一段結尾的成本池為起點（見 _renormalized_bounds）。
+    回傳 (賣出列位置, 配對股數, 每股平均成本)。
+    """
+    lo, hi, buy_lo, buy_hi = effective_sell_intervals(is_buy, qty)
+    remaining = buy_hi - hi  # 每列處理後的庫存股數
+    previous = np.concatenate([[0.0], remaining[:-1]])
+
+    ratio = np.ones(len(qty))
+    selling = ~is_buy & (previous > EPS)
+    ratio[selling] = remaining[selling] / previous[selling]
+    inflow = np.where(is_buy, qty * price, 0.0)
+
+    # 庫存歸零（ratio = 0）的下一列開始新的區段，區段內 ratio > 0 才能安全相除
+    flat = remaining <= EPS
+    segment = np.concatenate([[0], np.cumsum(flat[:-1])])
+    ratio = np.where(flat, 1.0, ratio)
+    log_ratio = np.log(ratio)
+    pool = np.empty(len(qty))
+    for start, end in _segment_bounds(segment):
+        carry = 0.0
+        for lo_row, hi_row in _renormalized_bounds(log_ratio[start:end], start):
+            growth = np.cumprod(ratio[lo_row:hi_row])
+            pool[lo_row:hi_row] = growth * (carry + np.cumsum(inflow[lo_row:hi_row] / growth))
+            carry = pool[hi_row - 1]
+    pool[flat] = 0.0
+
+    pool_before = np.concatenate([[0.0], pool[:-1]])
+    sell_pos = np.flatnonzero(~is_buy & (hi - lo > EPS))
+    avg_cost = pool_before[sell_pos] / previous[sell_pos]
+    return sell_pos, (hi - lo)[sell_pos], avg_cost
+
+
+def _segment_bounds(segment: np.ndarray):
+    """遞增的區段編號 ➔ [(起點, 終點), ...]"""
+    breaks = np.flatnonzero(np.diff(segment)) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(segment)]])
+    return zip(starts, ends)
+
+
+def _renormalized_bounds(log_ratio: np.ndarray, offset: int):
+    """
+    區段內依累乘比例（log 空間）每下降 RENORMALIZE_LOG 切一段 ➔ [(起點, 終點), ...]（加上 offset）。
+    每段內的 cumprod 至少約 1e-200，inflow / growth 不會溢位。
+    """
+    chunk = np.floor(-np.cumsum(log_ratio) / RENORMALIZE_LOG).astype(np.int64)
+    return [(start + offset, end + offset) for start, end in _segment_bounds(chunk)]
@@ -0,0 +1,203 @@
+#market_data.py
+import logging
+import os
+import threading
+import zlib
+import numpy as np
+import pandas as pd
+from modules.snapshot_store import write_parquet_atomic
+from modules.instrumentation import count
+from config import MARKET_DATA_PROVIDER, MARKET_DATA_CACHE_DIR, MARKET_DATA_SEED
+
+logger = logging.getLogger(__name__)
+
+# 行情來源介面：所有下載都透過 get_market_data() 取得的物件，方法與回傳格式統一為
+# - daily_closes(tickers, start, end, timeout)：日收盤價，index 為日期、欄位為代碼（大寫）；end 不含
+# - monthly_closes(tickers, start, end, timeout)：月收盤價，index 為每月第一天、欄位為代碼
+# - latest_quotes(tickers, timeout)：最新成交價 Series，index 為代碼
+# 取不到的代碼不會出現在欄位 / index 中，由呼叫端決定如何處理；source 為寫入存放區時的資料來源名稱
+PROVIDERS = ("yahoo", "record", "replay", "synthetic")
+
+
+def extract_close_frame(data: pd.DataFrame, codes) -> pd.DataFrame:
+    """
+    從 yf.download 的結果取出收盤價，統一成「欄位 = 代碼」的 DataFrame。
+    相容單一代碼（一般欄位）與多代碼（MultiIndex 欄位）兩種格式。
+    """
+    if data is None or data.empty or "Close" not in data.columns.get_level_values(0):
+        return pd.DataFrame()
+    close = data["Close"]
+    if isinstance(close, pd.Series):
+        close = close.to_frame(name=codes[0])
+    close.columns = [str(col).upper() for col in close.columns]
+    return close
+
+
+def _month_start_index(index) -> pd.DatetimeIndex:
+    return pd.DatetimeIndex(index).to_period("M").to_timestamp()
+
+
+class YahooProvider:
+    """直接呼叫 yfinance（延遲載入，離線的 replay / synthetic 模式不需要安裝 yfinance）"""
+
+    name = "yahoo"
+    source = "Yahoo Finance"
+
+    @staticmethod
+    def _download(tickers, **kwargs):
+        import yfinance as yf
+        count("network.requests")
+        return extract_close_frame(yf.download(tickers=list(tickers), progress=False, **kwargs), list(tickers))
+
+    def daily_closes(self, tickers, start, end, timeout=None) -> pd.DataFrame:
+        return self._download(tickers, start=start, end=end, interval="1d", auto_adjust=True, timeout=timeout)
+
+    def monthly_closes(self, tickers, start, end, timeout=None) -> pd.DataFrame:
+        closes = self._download(tickers, start=start, end=end, interval="1mo", auto_adjust=True, timeout=timeout)
+        closes.index = _month_start_index(closes.index)
+        return closes
+
+    def latest_quotes(self, tickers, timeout=None) -> pd.Series:
+        closes = self._download(tickers, period="1d", interval="1d", timeout=timeout)
+        return closes.ffill().iloc[-1].dropna() if not closes.empty else pd.Series(dtype="float64")
+
+
+class ReplayProvider:
+    """
+    以本機資料夾重播行情：每個（種類, 代碼）存成一個 parquet（index 為日期、欄位 close）。
+    - upstream=None：純重播，資料夾中沒有的代碼 / 日期視為無資料，不會連網
+    - upstream 為其他 provider：錄製模式，每次都向 upstream 取資料並合併寫入資料夾，
+      之後就能在沒有網路的機器上以純重播取得同樣的結果
+    """
+
+    def __init__(self, cache_dir=MARKET_DATA_CACHE_DIR, upstream=None):
+        self.cache_dir = cache_dir
+        self.upstream = upstream
+        self.name = "record" if upstream is not None else "replay"
+        self.source = upstream.source if upstream is not None else "本機重播"
+        self._lock = threading.Lock()
+
+    def _path(self, kind, ticker):
+        return os.path.join(self.cache_dir, kind, f"{ticker.replace('/', '_')}.parquet")
+
+    def _load(self, kind, ticker) -> pd.Series:
+        path = self._path(kind, ticker)
+        if not os.path.exists(path):
+            count("cache.replay.miss")
+            return pd.Series(dtype="float64", index=pd.DatetimeIndex([]))
+        count("cache.replay.hit")
+        return pd.read_parquet(path)["close"]
+
+    def _record(self, kind, frame: pd.DataFrame):
+        with self._lock:
+            for ticker in frame.columns:
+                new = frame[ticker].dropna()
+                if new.empty:
+                    continue
+                merged = new.combine_first(self._load(kind, ticker)).sort_index()
+                write_parquet_atomic(merged.rename("close").to_frame(), self._path(kind, ticker))
+
+    def _replay(self, kind, tickers, start=None, end=None) -> pd.DataFrame:
+        series = {}
+        for ticker in tickers:
+            close = self._load(kind, ticker)
+            if start is not None:
+                close = close[(close.index >= pd.Timestamp(start)) & (close.index < pd.Timestamp(end))]
+            if not close.empty:
+                series[ticker] = close
+        return pd.DataFrame(series)
+
+    def daily_closes(self, tickers, start, end, timeout=None) -> pd.DataFrame:
+        if self.upstream is not None:
+            self._record("daily", self.upstream.daily_closes(tickers, start, end, timeout=timeout))
+        return self._replay("daily", tickers, start, end)
+
+    def monthly_closes(self, tickers, start, end, timeout=None) -> pd.DataFrame:
+        if self.upstream is not None:
+            self._record("monthly", self.upstream.monthly_closes(tickers, start, end, timeout=timeout))
+        return self._replay("monthly", tickers, _month_start_index([start])[0], end)
+
+    def latest_quotes(self, tickers, timeout=None) -> pd.Series:
+        if self.upstream is not None:
+            quotes = self.upstream.latest_quotes(tickers, timeout=timeout)
+            self._record("quote", pd.DataFrame([quotes], index=[pd.Timestamp.now().normalize()]))
+        closes = self._replay("quote", tickers)
+        return closes.ffill().iloc[-1].dropna() if not closes.empty else pd.Series(dtype="float64")
+
+
+class SyntheticProvider:
+    """
+    可重現的合成行情：每個代碼以 (seed, 代碼) 決定一條固定的幾何隨機漫步，
+    不論查詢哪一段日期，同一天的價格都相同；與真實行情一樣不會有今天之後的日期。
+    匯率代碼（=X 結尾）在 30 附近小幅波動。
+    """
+
+    name = "synthetic"
+    source = "合成行情"
+    ORIGIN = pd.Timestamp("2000-01-03")
+
+    def __init__(self, seed=MARKET_DATA_SEED):
+        self.seed = seed
+
+    def _path(self, ticker, end) -> pd.Series:
+        # 與真實行情一樣只到今天為止，不產生未來日期的價格
+        end = min(pd.Timestamp(end), pd.Timestamp.today().normalize() + pd.Timedelta(days=1))
+        days = pd.bdate_range(self.ORIGIN, end - pd.Timedelta(days=1))
+        rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode("utf-8"))])
+        if ticker.endswith("=X"):
+            base, drift, volatility = 30.0, 0.0, 0.003
+        else:
+            base, drift, volatility = rng.uniform(20, 600), 0.0002, 0.018
+        steps = rng.normal(drift, volatility, len(days))
+        return pd.Series(np.round(base * np.exp(np.cumsum(steps)), 4), index=days)
+
+    def daily_closes(self, tickers, start, end, timeout=None) -> pd.DataFrame:
+        closes = {}
+        for ticker in tickers:
+            close = self._path(ticker, end)
+            closes[ticker] = close[close.index >= pd.Timestamp(start)]
+        return pd.DataFrame(closes)
+
+    def monthly_closes(self, tickers, start, end, timeout=None) -> pd.DataFrame:
+        closes = self.daily_closes(tickers, _month_start_index([start])[0], end)
+        monthly = closes.groupby(closes.index.to_period("M")).last()
+        monthly.index = monthly.index.to_timestamp()
+        return monthly
+
+    def latest_quotes(self, tickers, timeout=None) -> pd.Series:
+        end = pd.Timestamp.today().normalize() + pd.Timedelta(days=1)
+        return pd.Series({ticker: self._path(ticker, end).iloc[-1] for ticker in tickers}, dtype="float64")
+
+
+def create_provider(name, cache_dir=MARKET_DATA_CACHE_DIR, seed=MARKET_DATA_SEED):
+    """依名稱建立行情來源（yahoo / record / replay / synthetic）"""
+    if name == "yahoo":
+        return YahooProvider()
+    if name == "record":
+        return ReplayProvider(cache_dir, upstream=YahooProvider())
+    if name == "replay":
+        return ReplayProvider(cache_dir)
+    if name == "synthetic":
+        return SyntheticProvider(seed)
+    raise ValueError(f"❌ 未知的行情來源：{name}（可用：{', '.join(PROVIDERS)}）")
+
+
+_default_provider = None
+_default_lock = threading.Lock()
+
+
+def get_market_data():
+    """取得全域共用的行情來源（依 config.MARKET_DATA_PROVIDER 建立）"""
+    global _default_provider
+    with _default_lock:
+        if _default_provider is None:
+            _default_provider = create_provider(MARKET_DATA_PROVIDER)
+            logger.info("📡 行情來源：%s", _default_provider.name)
+        return _default_provider
+
+
+def set_market_data(provider):
+    """替換全域行情來源（壓力測試、冷啟動測試用），傳入 None 則恢復為設定值"""
+    global _default_provider
+    with _default_lock:
+        _default_provider = provider
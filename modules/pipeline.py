@@ -0,0 +1,75 @@
+#pipeline.py
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Callable
+from modules.instrumentation import span, bind
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    """
+    資料管線中的一個階段。
+    - name: 階段名稱，同時也是輸出結果的鍵
+    - func: 執行函式，會以 inputs 中各階段的結果作為關鍵字參數呼叫
+    - inputs: 相依的上游階段名稱（結果會傳給 func）
+    - after: 只需排在其後、不使用其結果的上游階段（例如先寫入快照再讀取）
+    """
+    name: str
+    func: Callable
+    inputs: tuple = field(default_factory=tuple)
+    after: tuple = field(default_factory=tuple)
+
+    @property
+    def upstream(self) -> tuple:
+        return tuple(self.inputs) + tuple(self.after)
+
+
+def _run_stage(stage, kwargs):
+    with span(f"stage.{stage.name}") as current:
+        result = stage.func(**kwargs)
+        if hasattr(result, "shape"):
+            current.set(rows=int(result.shape[0]))
+        return result
+
+
+def run_stages(stages, max_workers=4) -> dict:
+    """
+    依宣告的相依關係執行各階段：上游都完成的階段立即丟進執行緒池，
+    彼此獨立的階段並行執行，總耗時趨近最長的一條相依路徑。
+    回傳 {階段名稱: 結果}；任一階段失敗時，等待執行中的階段結束後拋出該例外。
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        unknown = [name for name in stage.upstream if name not in by_name]
+        if unknown:
+            raise ValueError(f"❌ 階段 {stage.name} 的相依階段不存在：{unknown}")
+
+    results = {}
+    pending = dict(by_name)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage") as pool:
+        while pending or running:
+            ready = [stage for stage in pending.values() if all(name in results for name in stage.upstream)]
+            for stage in ready:
+                del pending[stage.name]
+                kwargs = {name: results[name] for name in stage.inputs}
+                running[pool.submit(bind(_run_stage), stage, kwargs)] = stage.name
+
+            if not running:
+                raise ValueError(f"❌ 階段相依關係有循環：{sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    logger.error("❌ 階段 %s 失敗：%s", name, error)
+                    wait(running)
+                    raise error
+                results[name] = future.result()
+
+    return results
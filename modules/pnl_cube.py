@@ -0,0 +1,266 @@
+#pnl_cube.py
+import logging
+import numpy as np
+import pandas as pd
+from config import PNL_CUBE_DIR, FX_PAIRS
+from modules.fx_fetcher import DEFAULT_RATE, fx_rate_matrix
+from modules.encoding import encode
+from modules.profit_analyzer import calculate_realized_profit
+from modules.snapshot_store import save_frame_set, load_frame_set
+from modules.asset_state import state_lock
+from modules.instrumentation import traced
+
+logger = logging.getLogger(__name__)
+
+# 損益 cube 的格式版本；計算邏輯變更時遞增，讓舊快取自動失效
+CUBE_VERSION = 2
+
+CUBE_KEYS = ['年度', '出資者', '股票代號']
+CUBE_MEASURES = ['年末市值', '年末成本', '已實現損益', '股利收入', '匯率影響', '未實現損益', '總損益']
+FINGERPRINT_COLUMNS = ['交易', '估值', '股利']
+
+ACTION_CATEGORY = {'買進': '買入', '賣出': '賣出'}
+
+
+def to_fifo_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    將 parse_transaction 的欄位轉成 calculate_realized_profit 需要的格式：
+    賣出的股數取絕對值，收入為扣除手續費與稅金後的淨額（即 -成本）。
+    """
+    category = transactions['動作'].map(ACTION_CATEGORY)
+    is_sell = category == '賣出'
+    return pd.DataFrame({
+        '出資者': transactions['出資者'],
+        '股票代號': transactions['股票代號'],
+        '交易編號': transactions['交易編號'],
+        '日期': pd.to_datetime(transactions['交易日期']),
+        '類別': category,
+        '股數': transactions['股數'].abs(),
+        '單價': transactions['價格'],
+        '幣別': transactions['幣別'],
+        '收入': np.where(is_sell, -transactions['成本'], 0.0),
+        '手續費': transactions['手續費'],
+        '證交稅': transactions['稅金'],
+    })[category.notna()]
+
+
+def _rate_matrix(fx_df: pd.DataFrame, months=None) -> pd.DataFrame:
+    """月份 × 幣別匯率矩陣（可指定月份）；USD 缺值以 DEFAULT_RATE 補上"""
+    matrix = fx_rate_matrix(fx_df)
+    if months is not None:
+        matrix = matrix.reindex(months)
+    if 'USD' in matrix.columns:
+        matrix['USD'] = matrix['USD'].fillna(DEFAULT_RATE)
+    return matrix
+
+
+def _fx_by_currency(fx_df: pd.DataFrame) -> pd.Series:
+    """月匯率 ➔ 以 (月份, 幣別) 為索引的 Series，TWD 固定為 1"""
+    return _rate_matrix(fx_df).stack().sort_index()
+
+
+def _year_end_months(all_months: pd.PeriodIndex) -> pd.Series:
+    """每個年度的最後一個月份（當年度則為目前月份）"""
+    months = pd.Series(all_months, index=all_months.year)
+    return months.groupby(level=0).max()
+
+
+def compute_year_fingerprints(transactions: pd.DataFrame, holdings_df: pd.DataFrame, fx_df: pd.DataFrame, all_months,
+                              dividends: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    每個年度的輸入指紋：
+    - 交易：當年度的交易內容（影響當年度之後的已實現損益與成本）
+    - 估值：年末月份的持股市值與匯率
+    - 股利：當年度分配後的股利
+    """
+    year_ends = _year_end_months(pd.PeriodIndex(all_months))
+    tx_cols = ['交易日期', '股票代號', '出資者', '股數', '價格', '成本', '成本_等值台幣', '幣別', '動作']
+    tx_hash = pd.util.hash_pandas_object(transactions[tx_cols], index=False)
+    tx_fp = tx_hash.groupby(pd.to_datetime(transactions['交易日期']).dt.year.to_numpy()).sum()
+
+    at_year_end = holdings_df[holdings_df['月份'].isin(year_ends)]
+    value_hash = pd.util.hash_pandas_object(at_year_end[['月份', '股票代號', '出資者', '累計股數', '市值']], index=False)
+    value_fp = value_hash.groupby(at_year_end['月份'].dt.year.to_numpy()).sum()
+    fx_hash = sum(
+        pd.util.hash_pandas_object(pd.to_numeric(fx_df[currency], errors='coerce').reindex(year_ends).reset_index(drop=True), index=False)
+        for currency in FX_PAIRS if currency in fx_df.columns
+    )
+    fx_hash = pd.Series(np.asarray(fx_hash, dtype='uint64'), index=year_ends.index)
+
+    dividends = _dividends_or_empty(dividends)
+    dividend_fp = pd.util.hash_pandas_object(dividends, index=False).groupby(dividends['月份'].dt.year.to_numpy()).sum()
+
+    years = pd.Index(year_ends.index, name='年度')
+    return pd.DataFrame({
+        '交易': tx_fp.reindex(years, fill_value=0).astype('uint64'),
+        '估值': (value_fp.reindex(years, fill_value=0) + fx_hash.reindex(years, fill_value=0)).astype('uint64'),
+        '股利': dividend_fp.reindex(years, fill_value=0).astype('uint64'),
+    }, index=years)
+
+
+def _dividends_or_empty(dividends):
+    if dividends is None:
+        return pd.DataFrame({
+            '月份': pd.PeriodIndex([], freq='M'), '出資者': pd.Series(dtype=object),
+            '股票代號': pd.Series(dtype=object), '股利_TWD': pd.Series(dtype='float64')
+        })
+    return dividends
+
+
+def dividends_by_year(dividends: pd.DataFrame) -> pd.Series:
+    """每個 (年度, 出資者, 股票代號) 的股利收入（台幣）"""
+    dividends = _dividends_or_empty(dividends)
+    year = dividends['月份'].dt.year.rename('年度')
+    return dividends.groupby([year, dividends['出資者'], dividends['股票代號']])['股利_TWD'].sum()
+
+
+def realized_by_year(transactions: pd.DataFrame, fx_df: pd.DataFrame) -> pd.Series:
+    """以 FIFO 配對計算每個 (年度, 出資者, 股票代號) 的已實現損益（台幣，以賣出月份匯率換算）"""
+    realized = calculate_realized_profit(to_fifo_transactions(transactions), _fx_by_currency(fx_df))
+    if realized.empty:
+        return pd.Series(dtype='float64', index=pd.MultiIndex.from_arrays([[], [], []], names=CUBE_KEYS))
+    year = pd.to_datetime(realized['賣出日期']).dt.year.rename('年度')
+    return realized.groupby([year, realized['出資者'], realized['股票代號']])['報酬_TWD'].sum()
+
+
+def valuation_by_year(transactions: pd.DataFrame, holdings_df: pd.DataFrame, fx_df: pd.DataFrame, all_months) -> pd.DataFrame:
+    """
+    每個 (年度, 出資者, 股票代號) 的年末市值、年末成本與匯率影響。
+    - 年末市值：年末月份持股的台幣市值
+    - 年末成本：截至年末的累計成本（各筆交易以交易月份匯率換算的台幣成本）
+    - 匯率影響：期初（去年年末）外幣市值因匯率變動產生的台幣差額
+    """
+    year_ends = _year_end_months(pd.PeriodIndex(all_months))
+    rates = _rate_matrix(fx_df, year_ends)
+    rates.index = year_ends.index
+
+    at_year_end = holdings_df[holdings_df['月份'].isin(year_ends)]
+    market_value = at_year_end.groupby([at_year_end['月份'].dt.year.rename('年度'), '出資者', '股票代號'])['市值'].sum()
+
+    tx_year = pd.to_datetime(transactions['交易日期']).dt.year.rename('年度')
+    flows = transactions.groupby(['出資者', '股票代號', tx_year])['成本_等值台幣'].sum()
+    currency = transactions.drop_duplicates('股票代號').set_index('股票代號')['幣別']
+
+    pairs = flows.index.droplevel('年度').unique()
+    cube = pd.DataFrame(index=pd.MultiIndex.from_tuples(
+        [(year, owner, code) for year in year_ends.index for owner, code in pairs], names=CUBE_KEYS
+    ))
+    cube['年末市值'] = market_value.reindex(cube.index, fill_value=0.0)
+    cost = flows.reorder_levels(CUBE_KEYS).reindex(cube.index, fill_value=0.0)
+    cube['年末成本'] = cost.groupby(level=['出資者', '股票代號']).cumsum()
+
+    # 期初外幣市值 × 匯率變動：依 (年度, 幣別) 一次取出當年與前一年年末匯率（台幣匯率不變，影響為 0）
+    currency_codes, _ = encode(cube.index.get_level_values('股票代號').map(currency), rates.columns)
+    is_foreign = currency_codes >= 0
+    year_pos = rates.index.get_indexer(cube.index.get_level_values('年度'))
+    col = np.maximum(currency_codes, 0)
+    rate = rates.to_numpy(dtype='float64')[year_pos, col]
+    previous_rate = rates.shift(1).to_numpy(dtype='float64')[year_pos, col]
+    previous_value = cube['年末市值'].groupby(level=['出資者', '股票代號']).shift(1).fillna(0.0).to_numpy()
+    previous_cost = cube['年末成本'].groupby(level=['出資者', '股票代號']).shift(1).fillna(0.0).to_numpy()
+    fx_effect = np.where(is_foreign & ~np.isnan(previous_rate), previous_value / previous_rate * (rate - previous_rate), 0.0)
+    cube['匯率影響'] = np.nan_to_num(fx_effect)
+
+    cube['總損益'] = (cube['年末市值'] - cube['年末成本']) - (previous_value - previous_cost)
+    return cube
+
+
+def find_first_changed_years(stored, fingerprints: pd.DataFrame):
+    """
+    比對新舊指紋，回傳 (需重建的年度, 需重跑 FIFO 的起始年度)。
+    交易改變會影響該年度之後的所有年度；估值改變會影響當年度與下一年度（期初值）；
+    股利只影響當年度。
+    """
+    years = fingerprints.index
+    if stored is None:
+        return years, years[0]
+
+    missing = ~years.isin(stored[1].index)
+    previous = stored[1].reindex(years, fill_value=0)
+    tx_changed = missing | (previous['交易'] != fingerprints['交易']).to_numpy()
+    value_changed = missing | (previous['估值'] != fingerprints['估值']).to_numpy()
+    dividend_changed = (previous['股利'] != fingerprints['股利']).to_numpy()
+
+    first_tx_year = years[tx_changed][0] if tx_changed.any() else None
+    rebuild = value_changed | np.concatenate([[False], value_changed[:-1]]) | dividend_changed
+    if first_tx_year is not None:
+        rebuild |= (years >= first_tx_year)
+    return years[rebuild], first_tx_year
+
+
+@traced("pnl_cube.build")
+def build_pnl_cube(result, cube_dir=PNL_CUBE_DIR) -> pd.DataFrame:
+    """
+    由 calculate_monthly_asset_value 的結果建立「年度 × 出資者 × 股票代號」的損益 cube：
+    - 已實現損益：FIFO 配對
+    - 股利收入：依持股比例分配後的現金股利
+    - 匯率影響：期初外幣部位的匯差
+    - 總損益：年末市值 − 年末成本的變動，加上股利收入
+    - 未實現損益：總損益扣除已實現、股利與匯率影響
+    只重建輸入有變動的年度；交易沒有變動時不會重跑 FIFO。
+    """
+    with state_lock:
+        return _build_pnl_cube(result, cube_dir)
+
+
+def _build_pnl_cube(result, cube_dir):
+    """build_pnl_cube 的本體：讀取 ➔ 重建 ➔ 儲存，呼叫端需持有 state_lock"""
+    transactions = result.raw_df
+    dividends = getattr(result, 'dividend_df', None)
+    fingerprints = compute_year_fingerprints(transactions, result.holdings_df, result.fx_df, result.all_months, dividends)
+    stored = load_pnl_cube(cube_dir)
+    rebuild_years, first_tx_year = find_first_changed_years(stored, fingerprints)
+
+    if len(rebuild_years) == 0:
+        return stored[0]
+
+    valuation = valuation_by_year(transactions, result.holdings_df, result.fx_df, result.all_months)
+    rebuilt = valuation[valuation.index.get_level_values('年度').isin(rebuild_years)]
+
+    if first_tx_year is not None:
+        realized = realized_by_year(transactions, result.fx_df)
+    else:
+        realized = stored[0].set_index(CUBE_KEYS)['已實現損益']
+    dividend = dividends_by_year(dividends)
+    # 已實現或股利有值、但年末已無任何紀錄的組合也一併保留
+    rebuilt_index = rebuilt.index
+    for extra in (realized, dividend):
+        rebuilt_index = rebuilt_index.union(extra.index[extra.index.get_level_values('年度').isin(rebuild_years)])
+    rebuilt = rebuilt.reindex(rebuilt_index, fill_value=0.0)
+    rebuilt['已實現損益'] = realized.reindex(rebuilt.index, fill_value=0.0)
+    rebuilt['股利收入'] = dividend.reindex(rebuilt.index, fill_value=0.0)
+    rebuilt['總損益'] = rebuilt['總損益'] + rebuilt['股利收入']
+    rebuilt['未實現損益'] = rebuilt['總損益'] - rebuilt['已實現損益'] - rebuilt['股利收入'] - rebuilt['匯率影響']
+    rebuilt = rebuilt.reset_index()[CUBE_KEYS + CUBE_MEASURES]
+
+    if stored is not None:
+        kept = stored[0][stored[0]['年度'].isin(fingerprints.index.difference(rebuild_years))]
+        cube = pd.concat([kept, rebuilt], ignore_index=True)
+    else:
+        cube = rebuilt
+    cube = cube.sort_values(CUBE_KEYS).reset_index(drop=True)
+
+    logger.info("🔁 年度損益重建：%s（FIFO：%s）", list(rebuild_years), "重跑" if first_tx_year is not None else "沿用")
+    save_pnl_cube(cube, fingerprints, cube_dir)
+    return cube
+
+
+def load_pnl_cube(cube_dir=PNL_CUBE_DIR):
+    """讀取已儲存的 (cube, fingerprints)；沒有或版本不符時回傳 None"""
+    try:
+        loaded = load_frame_set(cube_dir, ['cube', 'fingerprints'])
+        if loaded is None:
+            return None
+        meta, frames = loaded
+        if meta.get('version') != CUBE_VERSION:
+            return None
+    except Exception as e:
+        logger.warning("⚠️ 無法讀取年度損益 cube，將全部重建：%s", e)
+        return None
+    return frames['cube'], frames['fingerprints']
+
+
+def save_pnl_cube(cube: pd.DataFrame, fingerprints: pd.DataFrame, cube_dir=PNL_CUBE_DIR):
+    """cube 與 fingerprints 以同一世代提交（見 save_frame_set）"""
+    save_frame_set(cube_dir, {'cube': cube, 'fingerprints': fingerprints}, {'version': CUBE_VERSION})
+    logger.info("📀 年度損益 cube 已儲存至：%s", cube_dir)
@@ -1,84 +1,164 @@
 import pandas as pd
-import yfinance as yf
 import logging
-import os
+from collections import defaultdict
 from datetime import datetime
-from config import PRICE_SNAPSHOT_PATH
-from modules.time_utils import to_period_index, ensure_period_index
+from modules.time_utils import to_period_index, group_contiguous_months
+from modules.fetch_executor import get_fetch_executor
+from modules.price_store import get_price_store, get_daily_price_store, to_wide_prices
+from modules.market_data import get_market_data
+from modules.instrumentation import traced, span
 
 # 設定 logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def month_end_closes(close: pd.Series) -> pd.DataFrame:
+    """
+    將日收盤價縮減成每月最後一個交易日的收盤價。
+    回傳 index 為月份（PeriodIndex），欄位為 close、price_date。
+    """
+    close = close.dropna().sort_index()
+    if close.empty:
+        return pd.DataFrame(columns=["close", "price_date"])
+    months = close.index.to_period("M")
+    last = ~months.duplicated(keep="last")
+    return pd.DataFrame(
+        {"close": close.to_numpy(dtype="float64")[last], "price_date": close.index[last].normalize()},
+        index=months[last]
+    )
+
+def record_daily_closes(closes: pd.DataFrame, source, fetched_at=None):
+    """
+    將下載到的日收盤價（index 為日期、欄位為代碼）寫入日價格存放區，
+    並把每月最後一個交易日縮減成月收盤價寫入月價格存放區：月資料只是日資料的縮減結果，
+    兩者共用同一次下載。回傳寫入的代碼清單。
+    """
+    fetched_at = pd.Timestamp.now() if fetched_at is None else fetched_at
+    daily_records, monthly_records = [], []
+    for code in closes.columns:
+        close = closes[code].dropna().sort_index()
+        if close.empty:
+            continue
+        daily_records.append(pd.DataFrame({
+            "date": close.index.normalize(),
+            "ticker": code,
+            "close": close.to_numpy(dtype="float64"),
+            "source": source,
+            "fetched_at": fetched_at,
+        }))
+        monthly = month_end_closes(close)
+        monthly_records.append(pd.DataFrame({
+            "month": monthly.index,
+            "ticker": code,
+            "close": monthly["close"].to_numpy(),
+            "price_date": monthly["price_date"].to_numpy(),
+            "source": source,
+            "fetched_at": fetched_at,
+        }))
+
+    if daily_records:
+        get_daily_price_store().append(pd.concat(daily_records, ignore_index=True))
+        get_price_store().append(pd.concat(monthly_records, ignore_index=True))
+    return [records["ticker"].iloc[0] for records in daily_records]
+
+def _plan_ranges(codes, needed_months, existing, overwrite):
+    """依缺漏月份的連續區段分組：同一區段的代碼合併成一次多檔下載"""
+    range_codes = defaultdict(list)
+    for code in codes:
+        if overwrite:
+            code_target_months = needed_months
+        else:
+            code_target_months = needed_months - existing.get(code, set())
+
+        for month_range in group_contiguous_months(code_target_months):
+            range_codes[month_range].append(code)
+    return range_codes
+
+def _backfill(range_codes):
+    """各區段並行下載日收盤價，結果回到主執行緒後寫入日 / 月價格存放區"""
+    provider = get_market_data()
+
+    def download_task(first_month, last_month, range_code_list):
+        def task(timeout):
+            logger.info("📱 從 %s 補抓 %s @ %s ~ %s", provider.name, ",".join(range_code_list), first_month, last_month)
+            return provider.daily_closes(
+                range_code_list,
+                start=pd.Timestamp(first_month.start_time.date()),
+                end=pd.Timestamp(last_month.end_time.date()) + pd.Timedelta(days=1),
+                timeout=timeout
+            )
+        return task
+
+    downloads = get_fetch_executor().run({
+        month_range: download_task(*month_range, range_code_list)
+        for month_range, range_code_list in range_codes.items()
+    })
+
+    fetched_at = pd.Timestamp.now()
+    frames = []
+    for (first_month, last_month), range_code_list in range_codes.items():
+        if (first_month, last_month) not in downloads:
+            continue
+        closes = downloads[(first_month, last_month)]
+        for code in range_code_list:
+            if code not in closes.columns or closes[code].dropna().empty:
+                logger.warning("⚠️ 無資料：%s (%s ~ %s)", code, first_month, last_month)
+        if not closes.empty:
+            frames.append(closes)
+
+    if not frames:
+        return False
+
+    written = []
+    with span("prices.record", ranges=len(frames)):
+        for closes in frames:
+            written += record_daily_closes(closes, provider.source, fetched_at)
+    if written:
+        logger.info("✅ 已補抓 %d 檔代碼的日收盤價", len(set(written)))
+    return bool(written)
+
+def _clean_codes(codes):
+    return sorted(set(str(code).strip().upper() for code in codes if code))
+
+@traced("prices.monthly")
 def fetch_monthly_prices_batch(codes, months, overwrite=False):
+    """
+    取得指定代碼、月份的月底收盤價，price_store 中缺漏的月份才會下載日收盤價並縮減寫入。
+    回傳與舊版快照相容的寬表（index 為月份，欄位為代碼 + 資料日期）。
+    """
     # 清理輸入資料
-    codes = sorted(set(str(code).strip().upper() for code in codes if code))
+    codes = _clean_codes(codes)
     months = to_period_index(months)  # ✅ 統一轉為 PeriodIndex
 
-    # 讀取或建立價格快照資料表
-    if os.path.exists(PRICE_SNAPSHOT_PATH):
-        stock_price_df = pd.read_parquet(PRICE_SNAPSHOT_PATH)
-        stock_price_df = ensure_period_index(stock_price_df)  # ✅ 防止添入 timestamp index
-    else:
-        stock_price_df = pd.DataFrame()
+    # 只讀取需要的代碼（分區下推）
+    store = get_price_store()
+    long_df = store.read(tickers=codes)
+    existing = long_df.dropna(subset=["close"]).groupby("ticker")["month"].agg(set).to_dict()
 
-    stock_price_df = stock_price_df.copy()
-    needed_months = set(months)
+    if _backfill(_plan_ranges(codes, set(months), existing, overwrite)):
+        long_df = store.read(tickers=codes)
 
-    for code in codes:
-        if code not in stock_price_df.columns:
-            stock_price_df[code] = pd.NA
+    return to_wide_prices(long_df, codes)
 
-        date_col = "資料日期"
-        if date_col not in stock_price_df.columns:
-            stock_price_df[date_col] = pd.NaT
+@traced("prices.daily")
+def fetch_daily_prices(codes, months, overwrite=False) -> pd.DataFrame:
+    """
+    取得指定代碼在 months 期間的日收盤價長表（date, ticker, close），
+    日價格存放區中完全沒有資料的月份才會下載。
+    """
+    codes = _clean_codes(codes)
+    months = to_period_index(months)
+    start, end = months.min().start_time, months.max().end_time.normalize()
 
-        existing_months = set(stock_price_df[code].dropna().index.to_list())
-        if overwrite:
-            code_target_months = sorted(needed_months)
-        else:
-            code_target_months = sorted(needed_months - existing_months)
-
-        for month in code_target_months:
-            logger.info("📱 從 Yahoo 補抓 %s @ %s", code, month)
-            start_date = pd.Timestamp(month.start_time.date())
-            end_date = pd.Timestamp(month.end_time.date()) + pd.Timedelta(days=1)
-            try:
-                data = yf.download(
-                    tickers=code,
-                    start=start_date,
-                    end=end_date,
-                    interval="1d",
-                    auto_adjust=True,
-                    progress=False
-                )
-                if data.empty:
-                    logger.warning("⚠️ 無資料：%s (%s ~ %s)", code, start_date, end_date)
-                    continue
-                close = data["Close"].dropna()
-                if not close.empty:
-                    price = float(close.iloc[-1])
-                    price_date = close.index[-1].date()
-                    if month not in stock_price_df.index:
-                        stock_price_df.loc[month] = pd.Series(dtype='float64')
-                    stock_price_df.at[month, code] = price
-                    stock_price_df.at[month, date_col] = pd.Timestamp(price_date)
-                    logger.info("✅ %s @ %s ➔ %.2f (%s)", code, month, price, price_date)
-            except Exception as e:
-                logger.error("❌ 無法取得 %s 的價格：%s", code, e)
-
-    stock_price_df = stock_price_df.sort_index()
-
-    # 【修正】只轉換數值欄（排除 '資料日期'）
-    value_cols = [col for col in stock_price_df.columns if col != "資料日期"]
-    stock_price_df[value_cols] = stock_price_df[value_cols].apply(pd.to_numeric, errors='coerce')
-
-    if "資料日期" in stock_price_df.columns:
-        stock_price_df["資料日期"] = pd.to_datetime(stock_price_df["資料日期"], errors='coerce')
-
-    if not stock_price_df.empty:
-        os.makedirs(os.path.dirname(PRICE_SNAPSHOT_PATH), exist_ok=True)
-        stock_price_df.to_parquet(PRICE_SNAPSHOT_PATH)
-        logger.info("📀 價格快照已儲存至：%s", PRICE_SNAPSHOT_PATH)
-
-    return stock_price_df
+    store = get_daily_price_store()
+    long_df = store.read(tickers=codes, start=start, end=end, columns=["close"])
+    existing = (
+        long_df.dropna(subset=["close"])
+        .assign(month=lambda frame: frame["date"].dt.to_period("M"))
+        .groupby("ticker")["month"].agg(set).to_dict()
+    )
+
+    if _backfill(_plan_ranges(codes, set(months), existing, overwrite)):
+        long_df = store.read(tickers=codes, start=start, end=end, columns=["close"])
+
+    return long_df.dropna(subset=["close"]).reset_index(drop=True)
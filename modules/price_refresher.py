@@ -1,19 +1,20 @@
 import pandas as pd
-import yfinance as yf
-import os
 import logging
 from datetime import datetime
-from config import PRICE_SNAPSHOT_PATH, FX_SNAPSHOT_PATH
-from modules.time_utils import ensure_period_index
 from modules.fx_fetcher import fetch_monthly_fx  # ✅ 加入匯率更新模組
+from modules.fetch_executor import get_fetch_executor
+from modules.price_fetcher import record_daily_closes
+from modules.market_data import get_market_data
+from modules.instrumentation import traced
 
 # --- 設定 logging ---
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@traced("prices.refresh_current_month")
 def refresh_current_month_prices(codes):
     """
-    重新抓取「當月」的股價與匯率（以今天為基準），並更新到快照檔中。
+    重新抓取「當月」的股價與匯率（以今天為基準），並追加到價格存放區與匯率快照。
     """
     if not codes:
         logger.warning("❗ 未提供任何股票代碼，略過刷新。")
@@ -23,77 +24,32 @@ def refresh_current_month_prices(codes):
     today = pd.Timestamp.today()
     current_month = today.to_period("M")
 
-    # 嘗試讀取股價快照檔
-    if os.path.exists(PRICE_SNAPSHOT_PATH):
-        stock_price_df = pd.read_parquet(PRICE_SNAPSHOT_PATH)
-        stock_price_df = ensure_period_index(stock_price_df)
-    else:
-        stock_price_df = pd.DataFrame()
+    # 一次多檔下載當月至今的日線：當月每個交易日的收盤都會保留在日價格存放區，
+    # 月價格存放區的當月資料則由最後一個交易日縮減而來
+    codes = sorted(set(str(code).strip().upper() for code in codes))
+    month_start = current_month.start_time
+    provider = get_market_data()
 
-    stock_price_df = stock_price_df.copy()
+    def task(timeout):
+        logger.info("📥 抓取 %s 的當月價格 (%s ~ %s)", ",".join(codes), month_start.date(), today.date())
+        return provider.daily_closes(codes, start=month_start, end=today.normalize() + pd.Timedelta(days=1), timeout=timeout)
 
-    # 刪除當月股價資料
-    if current_month in stock_price_df.index:
-        logger.info("🧹 移除舊的當月股價資料 (%s)", current_month)
-        stock_price_df.drop(index=current_month, inplace=True)
-
-    # 確保欄位都有
-    for code in codes:
-        if code not in stock_price_df.columns:
-            stock_price_df[code] = pd.NA
-
-    # 抓取今天的價格
+    closes = get_fetch_executor().run({"current_month": task}).get("current_month", pd.DataFrame())
     for code in codes:
-        logger.info("📥 抓取 %s 的今日價格 (%s)", code, today.date())
-        try:
-            data = yf.download(
-                tickers=code,
-                start=today,
-                end=today + pd.Timedelta(days=1),
-                interval="1d",
-                auto_adjust=True,
-                progress=False
-            )
-            if data.empty or "Close" not in data:
-                logger.warning("⚠️ 無法取得 %s 的資料", code)
-                continue
-            close = data["Close"].dropna()
-            if close.empty:
-                logger.warning("⚠️ %s 沒有可用收盤價", code)
-                continue
-            price = float(close.iloc[-1])
-            if current_month not in stock_price_df.index:
-                stock_price_df.loc[current_month] = pd.Series(dtype='float64')
-            stock_price_df.at[current_month, code] = price
-            logger.info("✅ %s 當月價格為 %.2f", code, price)
-        except Exception as e:
-            logger.error("❌ 抓取 %s 價格時出錯：%s", code, e)
-
-    # 儲存 parquet
-    if not stock_price_df.empty:
-        os.makedirs(os.path.dirname(PRICE_SNAPSHOT_PATH), exist_ok=True)
-        stock_price_df.at[current_month, "資料日期"] = pd.Timestamp.today()#補上資料日期
-        stock_price_df.to_parquet(PRICE_SNAPSHOT_PATH)
-        logger.info("📀 已更新價格快照至：%s", PRICE_SNAPSHOT_PATH)
-
-    # --- 刪除當月匯率資料 ---
-    if os.path.exists(FX_SNAPSHOT_PATH):
-        fx_df = pd.read_parquet(FX_SNAPSHOT_PATH)
-        fx_df = fx_df.copy()
-        if current_month in fx_df.index:
-            logger.info("🧹 移除舊的匯率資料 (%s)", current_month)
-            fx_df.drop(index=current_month, inplace=True)
-        fx_df.to_parquet(FX_SNAPSHOT_PATH)  # ✅ 確保有寫回檔案
-
-    # 補抓當月匯率並寫入快照
+        close = closes[code].dropna() if code in closes.columns else pd.Series(dtype="float64")
+        if close.empty:
+            logger.warning("⚠️ 無法取得 %s 的資料", code)
+            continue
+        logger.info("✅ %s 當月價格為 %.2f (%s)", code, close.iloc[-1], close.index[-1].date())
+
+    # 追加到價格存放區：較新的 fetched_at 會蓋過同一天 / 同月份的舊資料，其他日期維持不變
+    written = record_daily_closes(closes, f"{provider.source}（即時）") if not closes.empty else []
+    if written:
+        logger.info("📀 已更新當月價格：%d 檔", len(written))
+
+    # 強制重抓當月匯率並寫入快照（不先刪除，讀取端不會看到缺月的快照）
     try:
-        new_fx_df = fetch_monthly_fx([current_month])
-        if os.path.exists(FX_SNAPSHOT_PATH):
-            fx_df = pd.read_parquet(FX_SNAPSHOT_PATH)
-            fx_df = fx_df.combine_first(new_fx_df)
-        else:
-            fx_df = new_fx_df
-        fx_df.to_parquet(FX_SNAPSHOT_PATH)
+        fetch_monthly_fx([current_month], overwrite=True)
         logger.info("💱 當月匯率也已成功更新")
     except Exception as e:
         logger.error("❌ 更新匯率失敗：%s", e)
@@ -0,0 +1,369 @@
+#price_store.py
+from abc import ABC, abstractmethod
+import glob
+import logging
+import os
+import threading
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from config import PRICE_STORE_DIR, DAILY_PRICE_STORE_DIR, PRICE_STORE_COMPACT_THRESHOLD, PRICE_SNAPSHOT_PATH
+from modules.snapshot_store import write_parquet_atomic
+from modules.instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+PRICE_COLUMNS = ["month", "ticker", "close", "price_date", "source", "fetched_at"]
+DAILY_PRICE_COLUMNS = ["date", "ticker", "close", "source", "fetched_at"]
+
+
+# 同一個存放區目錄共用一把鎖：compact 刪除 delta 與讀取列出 delta 必須互斥
+_root_locks = {}
+_root_locks_guard = threading.Lock()
+
+
+def _lock_for(root):
+    with _root_locks_guard:
+        return _root_locks.setdefault(os.path.abspath(root), threading.Lock())
+
+
+def _all_of(expressions):
+    """把多個篩選條件以 AND 串起來；沒有條件時回傳 None"""
+    combined = None
+    for expression in expressions:
+        combined = expression if combined is None else combined & expression
+    return combined
+
+
+class _PartitionedStore(ABC):
+    """
+    長表存放區的共用實作（子類別決定欄位、唯一鍵與分區方式）：
+    - base/<分區欄>=<值>/data.parquet：依分區存放，讀取時只會讀到篩選條件涵蓋的分區
+    - delta/*.parquet：新抓到的資料只以追加方式寫入，不改動既有檔案
+    - compact()：把 delta 併回 base（只重寫有變動的分區）
+    同一唯一鍵有多筆時，以 fetched_at 最新者為準。
+    """
+
+    COLUMNS = []
+    KEYS = []
+    PARTITION = None
+    PARTITION_TYPE = pa.string()
+
+    def __init__(self, root, compact_threshold=PRICE_STORE_COMPACT_THRESHOLD):
+        self.root = root
+        self.base_dir = os.path.join(root, "base")
+        self.delta_dir = os.path.join(root, "delta")
+        self.compact_threshold = compact_threshold
+        self._partitioning = ds.partitioning(pa.schema([(self.PARTITION, self.PARTITION_TYPE)]), flavor="hive")
+        self._lock = _lock_for(root)
+        self._memo = {}
+
+    # --- 子類別實作 ---
+    @staticmethod
+    @abstractmethod
+    def _normalize(records: pd.DataFrame) -> pd.DataFrame:
+        """統一欄位與型別（寫入前、壓縮前都會呼叫）"""
+
+    @staticmethod
+    @abstractmethod
+    def _partition_of(records: pd.DataFrame) -> pd.Series:
+        """每一列所屬的分區值（records 已 normalize）"""
+
+    def _finalize(self, long_df: pd.DataFrame) -> pd.DataFrame:
+        """讀取後的型別轉換（例如 month 轉為 Period）"""
+        return long_df
+
+    # --- 讀取 ---
+    def _delta_files(self):
+        return sorted(glob.glob(os.path.join(self.delta_dir, "*.parquet")))
+
+    def _partition_path(self, value):
+        return os.path.join(self.base_dir, f"{self.PARTITION}={value}", "data.parquet")
+
+    def _read_base(self, filter_expr, columns):
+        if not os.path.isdir(self.base_dir):
+            return None
+        dataset = ds.dataset(self.base_dir, format="parquet", partitioning=self._partitioning, exclude_invalid_files=True)
+        return dataset.to_table(columns=columns, filter=filter_expr).to_pandas()
+
+    def _read_delta(self, filter_expr, columns):
+        files = self._delta_files()
+        if not files:
+            return None
+        dataset = ds.dataset(files, format="parquet")
+        return dataset.to_table(columns=columns, filter=filter_expr).to_pandas()
+
+    def _signature(self, partitions=None):
+        """相關檔案的 (路徑, 大小, mtime)；用來判斷行程內快取是否仍有效（只 stat 不讀檔）"""
+        if partitions is None:
+            paths = glob.glob(os.path.join(self.base_dir, f"{self.PARTITION}=*", "data.parquet"))
+        else:
+            paths = [self._partition_path(value) for value in partitions]
+        paths = sorted(p for p in paths if os.path.exists(p)) + self._delta_files()
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def _read(self, key, base_filter, delta_filter, columns, partitions=None) -> pd.DataFrame:
+        """以 key 為鍵快取讀取結果；相關檔案未變動時直接回傳行程內快取的副本"""
+        signature = self._signature(partitions)
+        with self._lock:
+            cached = self._memo.get(key)
+        if cached and cached[0] == signature:
+            count("cache.price_store.hit")
+            return cached[1].copy()
+
+        count("cache.price_store.miss")
+        long_df = self._read_uncached(base_filter, delta_filter, columns)
+        with self._lock:
+            self._memo[key] = (signature, long_df)
+        return long_df.copy()
+
+    def _read_uncached(self, base_filter, delta_filter, columns):
+        read_columns = None
+        if columns is not None:
+            read_columns = list(dict.fromkeys(self.KEYS + ["fetched_at"] + list(columns)))
+
+        # 從列出 delta 到讀完為止都持有鎖，避免 compact 在中途刪除 delta 檔
+        with self._lock:
+            parts = [
+                part for part in (self._read_base(base_filter, read_columns), self._read_delta(delta_filter, read_columns))
+                if part is not None
+            ]
+        if not parts:
+            return self._finalize(pd.DataFrame(columns=read_columns or self.COLUMNS))
+
+        long_df = pd.concat(parts, ignore_index=True)
+        long_df["ticker"] = long_df["ticker"].astype(str)
+        long_df = self._finalize(self._dedupe(long_df))
+        if columns is not None:
+            return long_df[list(dict.fromkeys(self.KEYS + list(columns)))]
+        return long_df[self.COLUMNS]
+
+    def _dedupe(self, long_df):
+        order = [key for key in ("ticker",) if key in self.KEYS] + [key for key in self.KEYS if key != "ticker"]
+        return (
+            long_df.sort_values("fetched_at", kind="stable")
+            .drop_duplicates(self.KEYS, keep="last")
+            .sort_values(order)
+            .reset_index(drop=True)
+        )
+
+    # --- 寫入 ---
+    def _write_partition(self, value, rows):
+        write_parquet_atomic(rows.drop(columns=[self.PARTITION], errors="ignore"), self._partition_path(value))
+
+    def append(self, records: pd.DataFrame):
+        """以新的 delta 檔追加資料；delta 數量達到門檻時自動壓縮"""
+        if records.empty:
+            return
+        records = self._normalize(records)
+        name = f"delta-{pd.Timestamp.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}.parquet"
+        write_parquet_atomic(records, os.path.join(self.delta_dir, name))
+        logger.info("📀 價格資料追加 %d 筆至：%s", len(records), self.delta_dir)
+
+        if len(self._delta_files()) >= self.compact_threshold:
+            self.compact()
+
+    def compact(self):
+        """把目前所有 delta 併入對應的 base 分區，完成後刪除已併入的 delta"""
+        with self._lock:
+            files = self._delta_files()
+            if not files:
+                return
+            delta = self._normalize(ds.dataset(files, format="parquet").to_table().to_pandas())
+            for value, rows in delta.groupby(self._partition_of(delta)):
+                path = self._partition_path(value)
+                if os.path.exists(path):
+                    existing = pd.read_parquet(path)
+                    if self.PARTITION in self.COLUMNS:
+                        existing[self.PARTITION] = value
+                    rows = pd.concat([existing, rows], ignore_index=True)
+                self._write_partition(value, self._normalize(self._dedupe(rows)))
+            for path in files:
+                os.remove(path)
+            logger.info("🗜️ 已壓縮 %d 個 delta 檔（%d 個分區）", len(files), self._partition_of(delta).nunique())
+
+
+class PriceStore(_PartitionedStore):
+    """
+    長表格式的月收盤價存放區：每列為 (month, ticker, close, price_date, source, fetched_at)，
+    依代碼分區（base/ticker=<代碼>/data.parquet）。
+    月收盤價由日收盤價縮減而來（見 price_fetcher），這裡只是每月最後一筆的實體化結果。
+    """
+
+    COLUMNS = PRICE_COLUMNS
+    KEYS = ["month", "ticker"]
+    PARTITION = "ticker"
+
+    def __init__(self, root=PRICE_STORE_DIR, compact_threshold=PRICE_STORE_COMPACT_THRESHOLD):
+        super().__init__(root, compact_threshold)
+
+    def read(self, tickers=None, months=None, columns=None) -> pd.DataFrame:
+        """
+        讀取價格長表（已去除重複，month 為 Period）。
+        tickers / months 會下推為分區與列篩選條件，columns 只讀取需要的欄位。
+        相關檔案未變動時直接回傳行程內快取的副本。
+        """
+        self._ensure_migrated()
+        tickers = None if tickers is None else sorted({str(t) for t in tickers})
+        key = (
+            None if tickers is None else tuple(tickers),
+            None if months is None else tuple(str(m) for m in sorted(set(months))),
+            None if columns is None else tuple(columns),
+        )
+
+        filter_expr = None
+        if tickers is not None:
+            filter_expr = ds.field("ticker").isin(tickers)
+        if months is not None:
+            month_starts = pd.PeriodIndex(months, freq="M").to_timestamp()
+            month_filter = ds.field("month").isin(pa.array(month_starts, type=pa.timestamp("ms")))
+            filter_expr = month_filter if filter_expr is None else filter_expr & month_filter
+
+        return self._read(key, filter_expr, filter_expr, columns, partitions=tickers)
+
+    def _finalize(self, long_df):
+        long_df["month"] = pd.to_datetime(long_df["month"]).dt.to_period("M")
+        return long_df
+
+    @staticmethod
+    def _partition_of(records):
+        return records["ticker"]
+
+    @staticmethod
+    def _normalize(records: pd.DataFrame) -> pd.DataFrame:
+        records = records.copy()
+        month = records["month"]
+        if isinstance(month.dtype, pd.PeriodDtype):
+            month = month.dt.to_timestamp()
+        records["month"] = pd.to_datetime(month).astype("datetime64[ms]")
+        records["ticker"] = records["ticker"].astype(str)
+        records["close"] = pd.to_numeric(records["close"], errors="coerce").astype("float64")
+        records["price_date"] = pd.to_datetime(records["price_date"]).astype("datetime64[ms]")
+        records["source"] = records["source"].astype(str)
+        records["fetched_at"] = pd.to_datetime(records["fetched_at"]).astype("datetime64[ms]")
+        return records[PRICE_COLUMNS].reset_index(drop=True)
+
+    # --- 舊版寬表快照轉換 ---
+    def _ensure_migrated(self):
+        """第一次使用時，若 store 為空而舊的寬表快照存在，轉換成長表格式"""
+        if os.path.isdir(self.base_dir) or self._delta_files() or not os.path.exists(PRICE_SNAPSHOT_PATH):
+            return
+        with self._lock:
+            if os.path.isdir(self.base_dir):
+                return
+            wide = pd.read_parquet(PRICE_SNAPSHOT_PATH)
+            wide.index = pd.PeriodIndex(wide.index, freq="M")
+            dates = pd.to_datetime(wide.pop("資料日期")) if "資料日期" in wide.columns else pd.Series(pd.NaT, index=wide.index)
+            long_df = wide.rename_axis("month").reset_index().melt(id_vars="month", var_name="ticker", value_name="close").dropna(subset=["close"])
+            long_df["price_date"] = long_df["month"].map(dates).fillna(long_df["month"].dt.end_time.dt.normalize())
+            long_df["source"] = "legacy snapshot"
+            long_df["fetched_at"] = long_df["price_date"]
+            long_df = self._normalize(long_df)
+            for ticker, rows in long_df.groupby("ticker"):
+                self._write_partition(ticker, rows)
+            logger.info("📦 已將舊版價格快照轉換為長表格式：%d 檔代碼", long_df["ticker"].nunique())
+
+
+class DailyPriceStore(_PartitionedStore):
+    """
+    日收盤價存放區：每列為 (date, ticker, close, source, fetched_at)，
+    依年份分區（base/year=<年>/data.parquet，檔內依代碼、日期排序），
+    讀取一段日期區間時只會讀到涵蓋的年份，代碼條件則靠 parquet 的欄位統計篩掉。
+    """
+
+    COLUMNS = DAILY_PRICE_COLUMNS
+    KEYS = ["date", "ticker"]
+    PARTITION = "year"
+    PARTITION_TYPE = pa.int32()
+
+    def __init__(self, root=DAILY_PRICE_STORE_DIR, compact_threshold=PRICE_STORE_COMPACT_THRESHOLD):
+        super().__init__(root, compact_threshold)
+
+    def read(self, tickers=None, start=None, end=None, columns=None) -> pd.DataFrame:
+        """
+        讀取日收盤價長表（已去除重複，依代碼、日期排序）。
+        - tickers：代碼清單，None 代表全部
+        - start / end：日期區間（含頭尾），年份會下推為分區篩選
+        """
+        tickers = None if tickers is None else sorted({str(t) for t in tickers})
+        start = None if start is None else pd.Timestamp(start).normalize()
+        end = None if end is None else pd.Timestamp(end).normalize()
+        key = (None if tickers is None else tuple(tickers), start, end, None if columns is None else tuple(columns))
+
+        row_filters = [] if tickers is None else [ds.field("ticker").isin(tickers)]
+        partition_filters = []
+        if start is not None:
+            row_filters.append(ds.field("date") >= pa.scalar(start, type=pa.timestamp("ms")))
+            partition_filters.append(ds.field("year") >= start.year)
+        if end is not None:
+            row_filters.append(ds.field("date") <= pa.scalar(end, type=pa.timestamp("ms")))
+            partition_filters.append(ds.field("year") <= end.year)
+        row_filter = _all_of(row_filters)
+        base_filter = _all_of(partition_filters + row_filters)
+
+        partitions = None
+        if start is not None and end is not None:
+            partitions = range(start.year, end.year + 1)
+        return self._read(key, base_filter, row_filter, columns, partitions=partitions)
+
+    def _finalize(self, long_df):
+        long_df["date"] = pd.to_datetime(long_df["date"]).astype("datetime64[ns]")
+        return long_df
+
+    @staticmethod
+    def _partition_of(records):
+        return pd.to_datetime(records["date"]).dt.year.rename("year")
+
+    @staticmethod
+    def _normalize(records: pd.DataFrame) -> pd.DataFrame:
+        records = records.copy()
+        records["date"] = pd.to_datetime(records["date"]).dt.normalize().astype("datetime64[ms]")
+        records["ticker"] = records["ticker"].astype(str)
+        records["close"] = pd.to_numeric(records["close"], errors="coerce").astype("float64")
+        records["source"] = records["source"].astype(str)
+        records["fetched_at"] = pd.to_datetime(records["fetched_at"]).astype("datetime64[ms]")
+        return records[DAILY_PRICE_COLUMNS].reset_index(drop=True)
+
+
+def to_wide_prices(long_df: pd.DataFrame, codes=None) -> pd.DataFrame:
+    """
+    轉成與舊版快照相容的寬表：index 為月份，欄位為代碼，另有「資料日期」欄
+    （該月份所有代碼中最晚的價格日期）。
+    """
+    if long_df.empty:
+        wide = pd.DataFrame(index=pd.PeriodIndex([], freq="M"), columns=list(codes or []), dtype="float64")
+        wide["資料日期"] = pd.Series(dtype="datetime64[ns]")
+        return wide
+    wide = long_df.pivot(index="month", columns="ticker", values="close")
+    if codes is not None:
+        wide = wide.reindex(columns=list(codes))
+    wide["資料日期"] = long_df.groupby("month")["price_date"].max().astype("datetime64[ns]")
+    wide.index.name = None
+    wide.columns.name = None
+    return wide.sort_index()
+
+
+_default_store = None
+_default_daily_store = None
+
+
+def get_price_store() -> PriceStore:
+    global _default_store
+    if _default_store is None:
+        _default_store = PriceStore()
+    return _default_store
+
+
+def get_daily_price_store() -> DailyPriceStore:
+    global _default_daily_store
+    if _default_daily_store is None:
+        _default_daily_store = DailyPriceStore()
+    return _default_daily_store
@@ -1,93 +1,126 @@
+import numpy as np
 import pandas as pd
-from collections import deque
+from modules.lot_matching import fifo_match, average_cost_match
+
+# 查不到賣出月份匯率時的預設匯率
+FALLBACK_FX_RATE = 30.0
+
+# 已實現損益的成本計算方式；指定批次時，賣出列以此欄位指定對應買入的交易編號
+REALIZED_METHODS = ('fifo', 'average', 'specific')
+LOT_ID_COLUMN = '指定買入編號'
+# Joint 交易展開時依出資比例分攤的欄位
+JOINT_SPLIT_COLUMNS = ['股數', '手續費', '證交稅', '金額', '收入', '成本']
+REALIZED_COLUMNS = ['出資者', '股票代號', '賣出日期', '股數', '收入_TWD', '成本_TWD', '報酬_TWD']
 
 def expand_joint_transactions_by_ownership(transactions_df: pd.DataFrame, ownership_df: pd.DataFrame) -> pd.DataFrame:
     """
     將交易資料中出資者為 Joint 的紀錄，根據 ownership_df 的出資比例展開，
     分配給實際擁有者（Sean、Lo 等）。
+    以交易編號一次 merge 後整欄乘上比例；找不到出資比例的交易編號會一起列在錯誤訊息中。
     """
-    joint_df = transactions_df[transactions_df['出資者'] == 'Joint']
-    non_joint_df = transactions_df[transactions_df['出資者'] != 'Joint']
-
-    expanded_rows = []
+    is_joint = transactions_df['出資者'] == 'Joint'
+    joint_df = transactions_df[is_joint]
+    non_joint_df = transactions_df[~is_joint]
 
-    for _, txn in joint_df.iterrows():
-        txn_id = txn['交易編號']
-        matching_ownerships = ownership_df[ownership_df['交易編號'] == txn_id]
+    ratios = ownership_df[['交易編號', '擁有者', '出資比例']].rename(columns={'擁有者': '_擁有者', '出資比例': '_出資比例'})
+    expanded_df = joint_df.merge(ratios, on='交易編號', how='left')
 
-        if matching_ownerships.empty:
-            raise ValueError(f"❌ 找不到交易編號 {txn_id} 的出資比例設定！")
+    missing = expanded_df.loc[expanded_df['_擁有者'].isna(), '交易編號']
+    if not missing.empty:
+        raise ValueError(f"❌ 找不到以下交易編號的出資比例設定：{list(dict.fromkeys(missing))}")
 
-        for _, row in matching_ownerships.iterrows():
-            owner = row['擁有者']
-            ratio = row['出資比例']
+    expanded_df['出資者'] = expanded_df['_擁有者']
 
-            split_txn = txn.copy()
-            split_txn['出資者'] = owner
+    # 需要按比例分攤的欄位
+    split_cols = [col for col in JOINT_SPLIT_COLUMNS if col in expanded_df.columns]
+    expanded_df[split_cols] = expanded_df[split_cols].mul(expanded_df['_出資比例'], axis=0)
 
-            # 需要按比例分攤的欄位
-            for col in ['股數', '手續費', '證交稅', '金額', '收入', '成本']:
-                if col in split_txn:
-                    split_txn[col] = split_txn[col] * ratio
-
-            expanded_rows.append(split_txn)
-
-    expanded_df = pd.DataFrame(expanded_rows)
+    expanded_df = expanded_df.drop(columns=['_擁有者', '_出資比例'])
     final_df = pd.concat([non_joint_df, expanded_df], ignore_index=True)
     return final_df
 
-def calculate_realized_profit(transactions_df: pd.DataFrame, fx_df: pd.DataFrame) -> pd.DataFrame:
+def _sell_fx_rates(sells: pd.DataFrame, fx_df) -> np.ndarray:
+    """以 (賣出月份, 幣別) 一次查出匯率，查不到時使用 FALLBACK_FX_RATE"""
+    if isinstance(fx_df, pd.DataFrame):
+        fx_df = fx_df.squeeze(axis=1)
+    keys = pd.MultiIndex.from_arrays([sells['日期'].dt.to_period('M'), sells['幣別']])
+    position = fx_df.index.get_indexer(keys)
+    rates = np.full(len(position), FALLBACK_FX_RATE, dtype='float64')
+    found = position >= 0
+    rates[found] = fx_df.to_numpy()[position[found]]
+    return rates
+
+def calculate_realized_profit(transactions_df: pd.DataFrame, fx_df: pd.DataFrame, method='fifo') -> pd.DataFrame:
     """
-    使用 FIFO 計算已實現損益。
+    計算已實現損益，每列為一筆賣出與其對應成本的配對結果。
     資料需包含：出資者、股票代號、交易編號、日期、類別、股數、單價、幣別、收入、手續費、證交稅。
+    - method='fifo'：先進先出（預設）
+    - method='average'：移動平均成本，每筆賣出輸出一列
+    - method='specific'：指定批次，賣出列需在 LOT_ID_COLUMN 填入對應買入的交易編號
+    收入與成本皆以賣出月份的匯率換算為台幣；超過當時庫存的賣出股數不列入。
     """
+    if method not in REALIZED_METHODS:
+        raise ValueError(f"❌ 不支援的成本計算方式：{method}（可用：{REALIZED_METHODS}）")
+
     transactions_df = transactions_df.sort_values(by=['出資者', '股票代號', '日期'])
-    results = []
-
-    for (owner, stock), group in transactions_df.groupby(['出資者', '股票代號']):
-        buy_queue = deque()
-
-        for _, row in group.iterrows():
-            if row['類別'] == '買入':
-                buy_queue.append({
-                    '股數': row['股數'],
-                    '單價': row['單價'],
-                    '幣別': row['幣別'],
-                    '日期': row['日期'],
-                    '手續費': row.get('手續費', 0),
-                    '證交稅': row.get('證交稅', 0)
-                })
-
-            elif row['類別'] == '賣出':
-                remain = row['股數']
-                proceeds = row['收入']
-                sell_date = row['日期']
-                fx_rate = fx_df.loc[(sell_date.to_period('M'), row['幣別'])] if (sell_date.to_period('M'), row['幣別']) in fx_df.index else 30.0
-                total_cost = 0
-                realized_rows = []
-
-                while remain > 0 and buy_queue:
-                    buy_lot = buy_queue[0]
-                    use_shares = min(remain, buy_lot['股數'])
-
-                    cost = use_shares * buy_lot['單價']
-                    total_cost += cost
-
-                    realized_rows.append({
-                        '出資者': owner,
-                        '股票代號': stock,
-                        '賣出日期': sell_date,
-                        '股數': use_shares,
-                        '收入_TWD': proceeds * fx_rate * (use_shares / row['股數']),
-                        '成本_TWD': cost * fx_rate,
-                        '報酬_TWD': (proceeds * fx_rate * (use_shares / row['股數'])) - (cost * fx_rate)
-                    })
-
-                    remain -= use_shares
-                    buy_lot['股數'] -= use_shares
-                    if buy_lot['股數'] == 0:
-                        buy_queue.popleft()
-
-                results.extend(realized_rows)
-
-    return pd.DataFrame(results)
+    transactions_df = transactions_df[transactions_df['類別'].isin(['買入', '賣出'])].reset_index(drop=True)
+
+    group_keys = ['出資者', '股票代號']
+    if method == 'specific':
+        is_sell = transactions_df['類別'] == '賣出'
+        lot_ids = transactions_df[LOT_ID_COLUMN] if LOT_ID_COLUMN in transactions_df.columns else pd.Series(np.nan, index=transactions_df.index)
+        missing = transactions_df.loc[is_sell & lot_ids.isna(), '交易編號']
+        if not missing.empty:
+            raise ValueError(f"❌ 以下賣出交易未指定買入批次（{LOT_ID_COLUMN}）：{sorted(missing.astype(str).unique())}")
+        transactions_df['_批次'] = lot_ids.where(is_sell, transactions_df['交易編號']).astype(str)
+        group_keys = group_keys + ['_批次']
+        # 依出資者、股票、批次分組後仍維持時間順序
+        transactions_df = transactions_df.sort_values(group_keys + ['日期'], kind='stable').reset_index(drop=True)
+
+    is_buy = (transactions_df['類別'] == '買入').to_numpy()
+    qty = transactions_df['股數'].to_numpy(dtype='float64')
+    price = transactions_df['單價'].to_numpy(dtype='float64')
+    group_id = transactions_df.groupby(group_keys, sort=False).ngroup().to_numpy()
+    bounds = np.flatnonzero(np.diff(group_id)) + 1
+
+    # 各群組以陣列配對，只收集 (賣出列, 買入列 / 平均成本, 股數) 的位置陣列
+    sell_rows, shares, unit_cost = [], [], []
+    for start, end in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(group_id)]])):
+        if method == 'average':
+            sell_pos, matched, avg_cost = average_cost_match(is_buy[start:end], qty[start:end], price[start:end])
+        else:
+            sell_pos, buy_pos, matched = fifo_match(is_buy[start:end], qty[start:end])
+            avg_cost = price[start:end][buy_pos]
+        sell_rows.append(sell_pos + start)
+        shares.append(matched)
+        unit_cost.append(avg_cost)
+
+    if not sell_rows or sum(len(rows) for rows in sell_rows) == 0:
+        return pd.DataFrame(columns=REALIZED_COLUMNS)
+
+    # 一次展開所有配對結果
+    sell_rows = np.concatenate(sell_rows)
+    shares = np.concatenate(shares)
+    unit_cost = np.concatenate(unit_cost)
+    if method == 'specific':
+        # 回到出資者、股票、時間順序
+        order = np.lexsort((sell_rows, transactions_df['日期'].to_numpy()[sell_rows],
+                            transactions_df['股票代號'].to_numpy()[sell_rows], transactions_df['出資者'].to_numpy()[sell_rows]))
+        sell_rows, shares, unit_cost = sell_rows[order], shares[order], unit_cost[order]
+
+    sells = transactions_df.iloc[sell_rows]
+    fx_rate = _sell_fx_rates(sells, fx_df)
+    proceeds = sells['收入'].to_numpy(dtype='float64')
+    sell_qty = sells['股數'].to_numpy(dtype='float64')
+
+    income = proceeds * fx_rate * (shares / sell_qty)
+    cost = shares * unit_cost * fx_rate
+    return pd.DataFrame({
+        '出資者': sells['出資者'].to_numpy(),
+        '股票代號': sells['股票代號'].to_numpy(),
+        '賣出日期': sells['日期'].to_numpy(),
+        '股數': shares,
+        '收入_TWD': income,
+        '成本_TWD': cost,
+        '報酬_TWD': income - cost,
+    })
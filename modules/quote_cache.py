@@ -0,0 +1,142 @@
+#quote_cache.py
+import logging
+import threading
+import time
+import numpy as np
+import pandas as pd
+from modules.fetch_executor import get_fetch_executor
+from modules.market_data import get_market_data
+from modules.instrumentation import count, bind
+from config import QUOTE_TTL_SECONDS, QUOTE_MAX_STALE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    """一次進行中的批次報價請求；同一批的呼叫者都等待同一個 event"""
+
+    def __init__(self, tickers):
+        self.tickers = set(tickers)
+        self.done = threading.Event()
+
+
+class QuoteCache:
+    """
+    跨 session 共用的最新報價快取。
+    - 新鮮（未超過 ttl）：直接回傳
+    - 過期但未超過 max_stale：先回傳舊值，背景重新抓取（stale-while-revalidate）
+    - 沒有資料或超過 max_stale：等待抓取完成
+    同一時間要抓的代碼合併成一次批次請求，已在請求中的代碼不會重複送出，
+    呼叫者等待同一個批次（request coalescing）。取不到的代碼也會記下時間，ttl 內不重試。
+    """
+
+    def __init__(self, ttl=QUOTE_TTL_SECONDS, max_stale=QUOTE_MAX_STALE_SECONDS):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._quotes = {}      # 代碼 ➔ (價格或 NaN, 價格的抓取時間, 最近一次嘗試時間)；時間皆為 time.time()
+        self._inflight = {}    # 代碼 ➔ _Batch
+        self._lock = threading.Lock()
+
+    def get(self, tickers) -> pd.DataFrame:
+        """
+        回傳 index 為代碼、欄位為 price、fetched_at 的 DataFrame；
+        取不到報價的代碼 price 為 NaN，由呼叫端決定如何補值。
+        """
+        tickers = sorted(set(str(ticker).strip().upper() for ticker in tickers if ticker))
+        now = time.time()
+        wait_for, revalidate, to_fetch = set(), [], []
+
+        with self._lock:
+            for ticker in tickers:
+                cached = self._quotes.get(ticker)
+                age = now - cached[2] if cached else None
+                if age is not None and age < self.ttl:
+                    count("cache.quotes.hit")
+                    continue
+                if age is not None and age < self.max_stale:
+                    count("cache.quotes.stale")
+                    if ticker not in self._inflight:
+                        revalidate.append(ticker)
+                    continue
+                count("cache.quotes.miss")
+                batch = self._inflight.get(ticker)
+                if batch is None:
+                    to_fetch.append(ticker)
+                else:
+                    wait_for.add(batch)
+            # 需要等待的批次順便帶上過期的代碼，一次呼叫最多只送出一個批次請求
+            if to_fetch:
+                to_fetch, revalidate = to_fetch + revalidate, []
+            background = self._claim(revalidate)
+            foreground = self._claim(to_fetch)
+
+        if background is not None:
+            threading.Thread(target=bind(self._fetch), args=(background,), name="quote-revalidate", daemon=True).start()
+        if foreground is not None:
+            self._fetch(foreground)
+        for batch in wait_for:
+            batch.done.wait()
+
+        with self._lock:
+            rows = [self._quotes.get(ticker, (np.nan, np.nan, np.nan))[:2] for ticker in tickers]
+        frame = pd.DataFrame(rows, index=pd.Index(tickers, name="ticker"), columns=["price", "fetched_at"])
+        frame["fetched_at"] = pd.to_datetime([
+            pd.Timestamp.fromtimestamp(value) if pd.notna(value) else pd.NaT for value in frame["fetched_at"]
+        ])
+        return frame
+
+    def prices(self, tickers) -> pd.Series:
+        """只取價格（Series，index 為代碼）"""
+        return self.get(tickers)["price"]
+
+    def _claim(self, tickers):
+        """在持有鎖的情況下登記一個新的批次；沒有代碼則回傳 None"""
+        if not tickers:
+            return None
+        batch = _Batch(tickers)
+        for ticker in tickers:
+            self._inflight[ticker] = batch
+        return batch
+
+    def _fetch(self, batch: _Batch):
+        codes = sorted(batch.tickers)
+        try:
+            provider = get_market_data()
+            results = get_fetch_executor().run({
+                "quotes": lambda timeout: provider.latest_quotes(codes, timeout=timeout)
+            })
+            quotes = results.get("quotes", pd.Series(dtype="float64"))
+            fetched_at = time.time()
+            with self._lock:
+                for ticker in codes:
+                    price = quotes.get(ticker, np.nan)
+                    if pd.notna(price):
+                        self._quotes[ticker] = (float(price), fetched_at, fetched_at)
+                    else:
+                        # 抓取失敗時保留舊價格，只更新嘗試時間，避免 ttl 內重複重試
+                        old_price, old_time, _ = self._quotes.get(ticker, (np.nan, np.nan, np.nan))
+                        self._quotes[ticker] = (old_price, old_time, fetched_at)
+            logger.info("📡 已更新 %d 檔即時報價", int(quotes.notna().sum()) if len(quotes) else 0)
+        finally:
+            with self._lock:
+                for ticker in codes:
+                    if self._inflight.get(ticker) is batch:
+                        del self._inflight[ticker]
+            batch.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._quotes.clear()
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_quote_cache() -> QuoteCache:
+    """取得全域共用的報價快取（同一行程的所有 session 共用）"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = QuoteCache()
+        return _default_cache
@@ -0,0 +1,172 @@
+#refresh_worker.py
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import pandas as pd
+from modules.asset_value import calculate_monthly_asset_value, yahoo_ticker_map
+from modules.price_refresher import refresh_current_month_prices
+from modules.transaction_parser import load_transactions
+from modules.instrumentation import span
+from config import (
+    TRANSACTION_FILE, CASH_ACCOUNT_FILE, DIVIDEND_FILE,
+    REFRESH_INTERVAL_SECONDS, REFRESH_MARKET_HOURS
+)
+
+logger = logging.getLogger(__name__)
+
+# 背景執行緒檢查是否有市場需要刷新的間隔（秒）
+POLL_SECONDS = 30
+
+
+def market_of(ticker) -> str:
+    """依 Yahoo 代碼判斷所屬市場：.TW / .TWO 為台股，其餘視為美股"""
+    return "TW" if str(ticker).upper().endswith((".TW", ".TWO")) else "US"
+
+
+def current_holding_tickers(filepath_transaction=TRANSACTION_FILE) -> list:
+    """目前仍有持股（累計股數 > 0）的 Yahoo 代碼，不需要網路"""
+    df = load_transactions(filepath_transaction, filepath_transaction)
+    shares = df.groupby('股票代號')['股數'].sum()
+    held = shares[shares > 1e-9].index
+    ticker_map = yahoo_ticker_map(df)
+    return sorted({str(ticker_map.get(code, code)).strip().upper() for code in held})
+
+
+def _session(market, now: datetime):
+    """回傳 (是否開盤中, 最近一次已收盤的時間)，時間皆為 aware datetime"""
+    tz_name, open_at, close_at = REFRESH_MARKET_HOURS[market]
+    local = now.astimezone(ZoneInfo(tz_name))
+    open_time = datetime.strptime(open_at, "%H:%M").time()
+    close_time = datetime.strptime(close_at, "%H:%M").time()
+
+    is_open = local.weekday() < 5 and open_time <= local.time() < close_time
+
+    day = local.date()
+    if local.weekday() >= 5 or local.time() < close_time:
+        day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    last_close = datetime.combine(day, close_time, tzinfo=local.tzinfo)
+    return is_open, last_close
+
+
+class RefreshWorker:
+    """
+    背景更新：由目前持股推出代碼，依各市場的交易時間刷新當月股價與匯率。
+    - 開盤中：每 interval 秒刷新一次
+    - 收盤後：若上次刷新早於收盤時間，再補抓一次收盤價
+    - 剛啟動：全部市場刷新一次
+    刷新後會重算一次資產結果，讓頁面直接命中快取；價格與匯率都以原子性寫入發布，
+    頁面讀到的永遠是完整的最新快照，不需要等待網路。
+    """
+
+    def __init__(self, interval=REFRESH_INTERVAL_SECONDS, filepath_transaction=TRANSACTION_FILE):
+        self.interval = interval
+        self.filepath_transaction = filepath_transaction
+        self._last_refresh = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._force = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._status = {"last_run": None, "tickers": [], "duration": None, "error": None}
+
+    # --- 控制 ---
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._loop, name="refresh-worker", daemon=True)
+                self._thread.start()
+                logger.info("🔄 背景更新已啟動（每 %d 秒）", self.interval)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def request_refresh(self):
+        """要求立即刷新所有持股（不等待結果）"""
+        with self._lock:
+            self._force = True
+        self._wake.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            status = dict(self._status)
+        status["running"] = self._thread is not None and self._thread.is_alive()
+        return status
+
+    # --- 排程 ---
+    def due_markets(self, now: datetime, force=False) -> set:
+        due = set()
+        for market in REFRESH_MARKET_HOURS:
+            last = self._last_refresh.get(market)
+            if force or last is None:
+                due.add(market)
+                continue
+            is_open, last_close = _session(market, now)
+            if is_open and (now - last).total_seconds() >= self.interval:
+                due.add(market)
+            elif not is_open and last < last_close <= now:
+                due.add(market)
+        return due
+
+    def run_once(self, force=False):
+        """檢查一次並刷新到期的市場；回傳刷新的代碼清單"""
+        now = datetime.now().astimezone()
+        markets = self.due_markets(now, force)
+        if not markets:
+            return []
+
+        started = time.perf_counter()
+        tickers = [ticker for ticker in current_holding_tickers(self.filepath_transaction) if market_of(ticker) in markets]
+        with span("refresh_worker.run", markets=sorted(markets), tickers=len(tickers)):
+            if tickers:
+                refresh_current_month_prices(tickers)
+            # 預先重算資產結果（增量），頁面開啟時直接命中快取
+            calculate_monthly_asset_value(
+                filepath_transaction=self.filepath_transaction,
+                filepath_cash=CASH_ACCOUNT_FILE,
+                filepath_dividend=DIVIDEND_FILE
+            )
+
+        for market in markets:
+            self._last_refresh[market] = now
+        with self._lock:
+            self._status.update(
+                last_run=pd.Timestamp(now).tz_localize(None), tickers=tickers,
+                duration=time.perf_counter() - started, error=None
+            )
+        logger.info("✅ 背景更新完成：%s（%d 檔）", ",".join(sorted(markets)), len(tickers))
+        return tickers
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                force, self._force = self._force, False
+            try:
+                self.run_once(force)
+            except Exception as e:
+                logger.error("❌ 背景更新失敗：%s", e)
+                with self._lock:
+                    self._status["error"] = str(e)
+            self._wake.wait(timeout=min(POLL_SECONDS, self.interval))
+            self._wake.clear()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def start_refresh_worker():
+    """取得並啟動全域共用的背景更新（同一行程的所有 session 共用一個執行緒）；設定為停用時回傳 None"""
+    global _worker
+    if REFRESH_INTERVAL_SECONDS <= 0:
+        return None
+    with _worker_lock:
+        if _worker is None:
+            _worker = RefreshWorker()
+        return _worker.start()
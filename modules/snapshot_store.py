@@ -0,0 +1,198 @@
+#snapshot_store.py
+import glob
+import json
+import logging
+import os
+import uuid
+import tempfile
+import threading
+import pandas as pd
+from modules.time_utils import ensure_period_index
+from modules.instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+# 行程內的快照快取（跨 Streamlit session 共用）：
+# 絕對路徑 ➔ {"signature": (檔案大小, mtime_ns), "frame": DataFrame, "derived": {名稱: 衍生結果}}
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+_path_locks = {}
+
+
+def _path_lock(path):
+    """每個快照路徑一把可重入鎖（跨 SnapshotStore 實例共用）"""
+    with _cache_lock:
+        return _path_locks.setdefault(os.path.abspath(path), threading.RLock())
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _entry(path):
+    """取得快取項目；檔案大小或 mtime 改變時才重新讀檔"""
+    abs_path = os.path.abspath(path)
+    signature = _signature(abs_path)
+    with _cache_lock:
+        entry = _cache.get(abs_path)
+        if entry is None or entry["signature"] != signature:
+            count("cache.snapshot.miss")
+            entry = {"signature": signature, "frame": pd.read_parquet(abs_path), "derived": {}}
+            _cache[abs_path] = entry
+        else:
+            count("cache.snapshot.hit")
+        return entry
+
+
+def _remember(path, df):
+    """寫檔後直接更新快取，下一次讀取不必再讀檔"""
+    abs_path = os.path.abspath(path)
+    with _cache_lock:
+        _cache[abs_path] = {"signature": _signature(abs_path), "frame": df.copy(), "derived": {}}
+
+
+def read_snapshot(path) -> pd.DataFrame:
+    """
+    讀取 parquet 快照（走行程內快取）。
+    回傳淺層副本：可以新增欄位或重設 index，但不要原地修改數值，需要修改請先 .copy()。
+    """
+    return _entry(path)["frame"].copy(deep=False)
+
+
+def read_derived(path, name, build):
+    """
+    取得由快照衍生出的結果（例如轉換 index、轉成 long format），
+    以 name 為鍵與快照一起快取，快照變動時自動失效。
+    build 會收到快照 DataFrame 的副本。
+    """
+    entry = _entry(path)
+    with _cache_lock:
+        if name not in entry["derived"]:
+            entry["derived"][name] = build(entry["frame"].copy())
+        result = entry["derived"][name]
+    return result.copy(deep=False)
+
+
+def read_period_snapshot(path) -> pd.DataFrame:
+    """讀取快照並保證 index 為 PeriodIndex（轉換結果同樣被快取）"""
+    return read_derived(path, "period_index", ensure_period_index)
+
+
+def write_parquet_atomic(df: pd.DataFrame, path):
+    """
+    先寫入同資料夾的暫存檔，再以 os.replace 原子性地取代目標檔，
+    讓同時讀取的程式不會讀到寫到一半的 parquet。
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".parquet")
+    os.close(fd)
+    try:
+        df.to_parquet(tmp_path)
+        os.chmod(tmp_path, 0o644)  # mkstemp 預設只有擁有者可讀
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json_atomic(obj, path):
+    """以暫存檔 + os.replace 寫入 JSON，讀取端不會看到寫到一半的內容"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_frame_set(directory, frames: dict, meta: dict):
+    """
+    將一組彼此對應的 DataFrame 以同一個世代（generation）寫入：
+    1. 每個 frame 寫成 <名稱>-<世代>.parquet（新檔案，不覆蓋舊世代）
+    2. 最後以原子性方式寫入 meta.json（含世代）作為提交點
+    3. 刪除其他世代（以及舊版不含世代）的檔案
+    中途中斷或同時儲存時，meta.json 永遠只指向一組完整、同世代的檔案。
+    """
+    generation = f"{pd.Timestamp.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    for name, frame in frames.items():
+        write_parquet_atomic(frame, os.path.join(directory, f"{name}-{generation}.parquet"))
+    write_json_atomic({**meta, "generation": generation, "frames": list(frames)}, os.path.join(directory, "meta.json"))
+
+    for name in frames:
+        stale = glob.glob(os.path.join(directory, f"{name}-*.parquet")) + glob.glob(os.path.join(directory, f"{name}.parquet"))
+        for path in stale:
+            if not path.endswith(f"-{generation}.parquet"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+    return generation
+
+
+def load_frame_set(directory, names=None):
+    """
+    讀取 save_frame_set 寫入的一組 DataFrame，回傳 (meta, {名稱: DataFrame})；names=None 代表該世代的全部 frame。
+    沒有 meta.json 時回傳 None。meta 沒有世代或檔案不屬於該世代時會拋出例外，由呼叫端決定是否重算。
+    """
+    meta_path = os.path.join(directory, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    generation = meta.get("generation")
+    if not generation:
+        raise ValueError(f"❌ 快取缺少世代資訊（舊版格式）：{directory}")
+    if names is None:
+        names = meta.get("frames", [])
+    frames = {name: pd.read_parquet(os.path.join(directory, f"{name}-{generation}.parquet")) for name in names}
+    return meta, frames
+
+
+class SnapshotStore:
+    """
+    價格 / 匯率快照的讀寫介面：
+    - load()：讀取快照（不存在時回傳 empty；index 已轉為 PeriodIndex）
+    - mark_dirty()：有新增或修改資料時呼叫
+    - save(df)：只有被標記為 dirty 時才寫檔，並以原子性方式取代
+    - lock：同一路徑共用的可重入鎖，讀取 ➔ 修改 ➔ 寫回時以 with store.lock: 包住
+    純讀取的頁面瀏覽因此不會有任何寫入。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dirty = False
+        # 同一路徑共用的鎖：load ➔ 修改 ➔ save 期間持有，避免同時補資料時後寫入者蓋掉前者的月份
+        self.lock = _path_lock(path)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self, empty=None) -> pd.DataFrame:
+        """讀取快照的可修改副本（來源為行程內快取）"""
+        if self.exists():
+            return read_period_snapshot(self.path).copy()
+        return pd.DataFrame() if empty is None else empty
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def save(self, df: pd.DataFrame) -> bool:
+        if not self.dirty:
+            logger.debug("快照未變動，略過寫入：%s", self.path)
+            return False
+        write_parquet_atomic(df, self.path)
+        _remember(self.path, df)
+        self.dirty = False
+        logger.info("📀 快照已儲存至：%s", self.path)
+        return True
@@ -1,11 +1,11 @@
-import yfinance as yf
 import pandas as pd
 import matplotlib.pyplot as plt
 from datetime import datetime
+from modules.market_data import get_market_data
 
 def get_monthly_prices(symbol: str, start: str = "2019-01-01", end: str = None, plot=False) -> pd.DataFrame:
     """
-    從 Yahoo Finance 抓取某股票的每月收盤價。
+    從行情來源（預設為 Yahoo Finance）抓取某股票的每月收盤價。
     - symbol: 股票代碼，例如 '2330.TW'、'AAPL'
     - start: 起始日期（字串，格式為 'YYYY-MM-DD'）
     - end: 結束日期（預設為今天）
@@ -15,27 +15,12 @@ def get_monthly_prices(symbol: str, start: str = "2019-01-01", end: str = None,
     if end is None:
         end = datetime.today().strftime("%Y-%m-%d")
 
-    df = yf.download(
-        tickers=symbol,
-        start=start,
-        end=end,
-        interval="1mo",
-        group_by="ticker",
-        auto_adjust=True,
-        progress=False
-    )
-
-    if df.empty:
+    symbol = symbol.strip().upper()
+    closes = get_market_data().monthly_closes([symbol], start=start, end=end)
+    if symbol not in closes.columns or closes[symbol].dropna().empty:
         raise ValueError(f"找不到股票代碼 {symbol} 的月資料")
 
-    # 如果是多股票格式
-    if isinstance(df.columns, pd.MultiIndex):
-        df = df[symbol]["Close"]
-    else:
-        df = df["Close"]
-
-    df = df.dropna()
-    df.index = df.index.to_period("M").to_timestamp()
+    df = closes[symbol].dropna()
     df.name = symbol
 
     if plot:
@@ -1,4 +1,5 @@
 #time_utils.py
+import numpy as np
 import pandas as pd
 import logging
 
@@ -13,6 +14,11 @@ def to_period_index(obj, freq="M", column=None):
     if isinstance(obj, (pd.PeriodIndex, pd.arrays.PeriodArray)):
         return obj
     elif isinstance(obj, pd.Series):
+        # 已是 Period 或 datetime 的欄位直接轉換，不再經過 to_datetime 重新解析
+        if isinstance(obj.dtype, pd.PeriodDtype):
+            return pd.PeriodIndex(obj)
+        if pd.api.types.is_datetime64_any_dtype(obj.dtype):
+            return pd.DatetimeIndex(obj).to_period(freq)
         return pd.to_datetime(obj.values).to_period(freq)
     elif isinstance(obj, pd.DataFrame):
         if column and column in obj.columns:
@@ -26,6 +32,9 @@ def to_period_index(obj, freq="M", column=None):
         else:
             raise ValueError(f"❌ DataFrame 必須指定 column 欄位才可轉換為 Period: {column}")
     elif isinstance(obj, (pd.DatetimeIndex, list, pd.Index)):
+        # Period 物件組成的 list（例如 [當月]）無法經過 to_datetime，直接組成 PeriodIndex
+        if len(obj) and all(isinstance(value, pd.Period) for value in obj):
+            return pd.PeriodIndex(list(obj), freq=freq)
         return pd.to_datetime(obj).to_period(freq)
     else:
         raise TypeError(f"❌ 無法轉換為 PeriodIndex: {type(obj)}")
@@ -50,3 +59,28 @@ def get_today_period():
     if today.day == 1:
         return (today - pd.offsets.MonthBegin(1)).to_period("M")
     return today.to_period("M")
+
+
+def periods_from_ordinals(ordinals, freq="M") -> pd.PeriodIndex:
+    """
+    將整數 ordinal（例如 Period.ordinal 或 PeriodIndex.asi8）轉回 PeriodIndex。
+    用於以整數運算展開月份區間後再還原為 Period。
+    """
+    values = pd.arrays.PeriodArray(np.asarray(ordinals, dtype="int64"), dtype=pd.PeriodDtype(freq))
+    return pd.PeriodIndex(values)
+
+
+def group_contiguous_months(months):
+    """
+    將月份集合切成連續區段，回傳 [(起始月份, 結束月份), ...]（已排序）。
+    例如 2024-01、2024-02、2024-05 ➔ [(2024-01, 2024-02), (2024-05, 2024-05)]
+    用於把缺漏月份合併成少數幾次區間下載。
+    """
+    ordinals = np.unique(pd.PeriodIndex(list(months), freq="M").asi8)
+    if len(ordinals) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(ordinals) != 1)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(ordinals) - 1]])
+    periods = periods_from_ordinals(ordinals)
+    return [(periods[s], periods[e]) for s, e in zip(starts, ends)]
@@ -1,17 +1,24 @@
 #transaction_parser.py
 import pandas as pd
 from modules.time_utils import to_period_index
-from modules.fx_fetcher import fetch_monthly_fx
+from modules.fx_fetcher import fetch_monthly_fx, fx_rate_matrix, lookup_rates, fill_missing_rates
+from modules.workbook_cache import load_sheet
 
 
-def parse_transaction(filepath_main, filepath_ownership):
+TRANSACTION_COLUMNS = [
+    "交易編號", "交易日期", "月份", "股票代號", "出資者", "股數", "成本", "成本_等值台幣",
+    "幣別", "價格", "手續費", "稅金", "動作", "資產名稱", "台股/美股", "備註"
+]
+
+
+def load_transactions(filepath_main, filepath_ownership):
     """
-    將交易主表與出資比例表合併，回傳每位出資者的拆分交易紀錄。
+    讀取交易主表與出資比例表並依比例拆分，尚未做匯率換算（不需網路）。
     主表與比例表需存在 "交易編號" 欄位。
     """
-    # 讀取資料
-    main_df = pd.read_excel(filepath_main, sheet_name="交易主表")
-    ownership_df = pd.read_excel(filepath_ownership, sheet_name="出資比例")
+    # 讀取資料（同一本 workbook 只解析一次，之後走 parquet 快取）
+    main_df = load_sheet(filepath_main, "交易主表")
+    ownership_df = load_sheet(filepath_ownership, "出資比例")
 
     # 合併兩張表（多對一），每筆交易依出資比例拆為多人紀錄
     merged = main_df.merge(ownership_df, on="交易編號", how="left")
@@ -24,23 +31,38 @@ def parse_transaction(filepath_main, filepath_ownership):
     merged["交易日期"] = pd.to_datetime(merged["交易日期"])
     merged["月份"] = to_period_index(merged["交易日期"])
 
-    # 匯率轉換為 TWD：取得匯率快照，補值處理（補前補後）
-    months = merged["月份"].unique()
-    fx_df = fetch_monthly_fx(months=months)
-    fx_df = fx_df.ffill().bfill()
+    return merged
+
+
+def convert_transaction_cost(merged, fx_df):
+    """
+    以每月匯率把成本換算為「等值台幣成本」，缺值的月份以前後月份補值。
+    匯率以 (月份, 幣別) 從月份 × 幣別矩陣一次取出整欄；補值後仍缺的匯率依 fill_missing_rates 處理。
+    """
+    months = pd.PeriodIndex(merged["月份"].unique(), freq="M")
+    fx_df = fx_df.reindex(fx_df.index.union(months)).ffill().bfill()
 
-    # 合併匯率資料
-    merged = merged.merge(fx_df, left_on="月份", right_index=True, how="left")
+    matrix = fx_rate_matrix(fx_df)
+    rates = lookup_rates(matrix, merged["月份"], merged["幣別"])
+    rates = fill_missing_rates(rates, merged["月份"], merged["幣別"])
 
     # 換算為「等值台幣成本」
-    merged["成本_等值台幣"] = merged.apply(
-        lambda row: row["成本"] if row["幣別"] == "TWD" else row["成本"] * row.get(row["幣別"], 1),
-        axis=1
-    )
+    merged = merged.copy()
+    merged["成本_等值台幣"] = merged["成本"].to_numpy(dtype="float64") * rates
 
     # 重組欄位順序
-    cols = [
-        "交易編號", "交易日期", "月份", "股票代號", "出資者", "股數", "成本", "成本_等值台幣",
-        "幣別", "價格", "手續費", "稅金", "動作", "資產名稱", "台股/美股", "備註"
-    ]
-    return merged[cols]
+    return merged[TRANSACTION_COLUMNS]
+
+
+def parse_transaction(filepath_main, filepath_ownership, fx_df=None):
+    """
+    將交易主表與出資比例表合併，回傳每位出資者的拆分交易紀錄（含等值台幣成本）。
+    - fx_df: 已取得的每月匯率；未提供時依交易月份自行補抓
+    """
+    merged = load_transactions(filepath_main, filepath_ownership)
+
+    # 匯率轉換為 TWD：取得匯率快照，補值處理（補前補後）
+    if fx_df is None:
+        fx_df = fetch_monthly_fx(months=merged["月份"].unique())
+
+    return convert_transaction_cost(merged, fx_df)
@@ -0,0 +1,130 @@
+#workbook_cache.py
+import hashlib
+import logging
+import os
+import threading
+import pandas as pd
+from config import WORKBOOK_CACHE_DIR
+from modules.instrumentation import span, count
+from modules.snapshot_store import save_frame_set, load_frame_set
+
+logger = logging.getLogger(__name__)
+
+# 行程內快取：絕對路徑 ➔ (檔案大小, mtime_ns, {工作表名稱: DataFrame})
+_memo = {}
+_lock = threading.Lock()
+
+
+def _file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_dir_for(filepath):
+    abs_path = os.path.abspath(filepath)
+    name = os.path.splitext(os.path.basename(abs_path))[0]
+    key = hashlib.sha1(abs_path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(WORKBOOK_CACHE_DIR, f"{name}_{key}")
+
+
+def _to_parquet_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Excel 欄位常混雜數字、日期與文字（例如股票代號 0050 與 2330），
+    parquet 無法儲存混合型別的 object 欄，統一轉為文字（保留空值）。
+    """
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) not in ("string", "empty"):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+def _write_cache(cache_dir, sheets, size, mtime_ns, sha256):
+    """
+    各工作表存成 sheet_<i>.parquet，以同一世代與 manifest（meta.json）一起提交（見 save_frame_set）：
+    中途中斷或其他行程同時寫入時，不會留下寫到一半的 manifest 或工作表。
+    """
+    names = list(sheets)
+    frames = {f"sheet_{i}": sheets[name] for i, name in enumerate(names)}
+    save_frame_set(cache_dir, frames, {"size": size, "mtime_ns": mtime_ns, "sha256": sha256, "sheets": names})
+    # 舊版格式的 manifest（非原子寫入）已不再使用
+    legacy = os.path.join(cache_dir, "manifest.json")
+    if os.path.exists(legacy):
+        os.remove(legacy)
+
+
+def _read_cache(cache_dir):
+    """
+    讀取 parquet 快取，回傳 (manifest, {工作表名稱: DataFrame})；
+    快取不存在或無法讀取（寫到一半、舊版格式、檔案毀損）時回傳 None，視為未命中並重新解析 Excel。
+    """
+    try:
+        loaded = load_frame_set(cache_dir)
+        if loaded is None:
+            return None
+        manifest, frames = loaded
+        return manifest, {name: frames[f"sheet_{i}"] for i, name in enumerate(manifest["sheets"])}
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("⚠️ Excel 快取無法讀取，將重新解析：%s（%s）", cache_dir, e)
+        return None
+
+
+def _load_all_sheets(filepath):
+    stat = os.stat(filepath)
+    size, mtime_ns = stat.st_size, stat.st_mtime_ns
+    abs_path = os.path.abspath(filepath)
+
+    cached = _memo.get(abs_path)
+    if cached and cached[0] == size and cached[1] == mtime_ns:
+        count("cache.workbook.hit")
+        return cached[2]
+    count("cache.workbook.miss")
+
+    cache_dir = _cache_dir_for(filepath)
+    manifest, sheets = _read_cache(cache_dir) or (None, None)
+
+    if manifest and manifest["size"] == size and manifest["mtime_ns"] == mtime_ns:
+        count("cache.workbook_parquet.hit")
+    else:
+        sha256 = _file_sha256(filepath)
+        if manifest and manifest["sha256"] == sha256:
+            # 內容未變（例如只是被重新存檔），更新 mtime 後沿用快取
+            count("cache.workbook_parquet.hit")
+            _write_cache(cache_dir, sheets, size, mtime_ns, sha256)
+        else:
+            count("cache.workbook_parquet.miss")
+            logger.info("📖 解析 Excel：%s", filepath)
+            with span("excel.parse", file=os.path.basename(filepath)) as current:
+                sheets = {name: _to_parquet_safe(df) for name, df in pd.read_excel(filepath, sheet_name=None).items()}
+                current.set(rows=sum(len(df) for df in sheets.values()))
+            _write_cache(cache_dir, sheets, size, mtime_ns, sha256)
+            logger.info("📀 Excel 快取已儲存至：%s", cache_dir)
+
+    _memo[abs_path] = (size, mtime_ns, sheets)
+    return sheets
+
+
+def load_workbook(filepath, sheet_names=None) -> dict:
+    """
+    一次讀取整本 Excel 的所有工作表，並以（檔案大小、mtime、內容雜湊）為鍵，
+    將解析後的結果以 parquet 快取；檔案未變動時直接讀取快取，不再重新解析 Excel。
+    - sheet_names: 要取得的工作表清單，None 代表全部
+    回傳 {工作表名稱: DataFrame}，每次回傳的都是副本，呼叫端可自由修改。
+    """
+    with _lock:
+        sheets = _load_all_sheets(filepath)
+
+    if sheet_names is None:
+        sheet_names = list(sheets)
+    missing = [name for name in sheet_names if name not in sheets]
+    if missing:
+        raise ValueError(f"❌ {filepath} 找不到工作表：{missing}")
+    return {name: sheets[name].copy() for name in sheet_names}
+
+
+def load_sheet(filepath, sheet_name) -> pd.DataFrame:
+    """取得單一工作表（同樣走快取）"""
+    return load_workbook(filepath, [sheet_name])[sheet_name]
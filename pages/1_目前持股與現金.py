@@ -1,35 +1,37 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
-import yfinance as yf
 import plotly.express as px
-from modules.asset_value import calculate_monthly_asset_value
+from modules.asset_value import yahoo_ticker_map
+from modules.transaction_parser import load_transactions
 from modules.fx_fetcher import get_latest_fx_rate
-from config import TRANSACTION_FILE, PRICE_SNAPSHOT_PATH, CASH_ACCOUNT_FILE
+from modules.quote_cache import get_quote_cache
+from config import TRANSACTION_FILE, CASH_ACCOUNT_FILE
 from modules.cash_parser import get_latest_cash_detail, parse_cash_balances
+from modules.price_store import get_price_store
 
 # --- 頁面設定 ---
 st.set_page_config(page_title="目前持股與現金", layout="wide")
 
-# --- 載入資料（改為完整結果物件） ---
-result = calculate_monthly_asset_value(
-    filepath_transaction=TRANSACTION_FILE,
-    filepath_cash=CASH_ACCOUNT_FILE
-)
-raw_df = result.raw_df
-summary_df = result.summary_df
-summary_stock_df = result.summary_stock_df
-summary_cash_df = result.summary_cash_df
-stock_price_df = result.stock_price_df
-fx_df = result.fx_df
+# --- 載入資料：只需要目前持股，不必重算整段月資產歷史（交易表走 workbook 快取，不需網路） ---
+raw_df = load_transactions(TRANSACTION_FILE, TRANSACTION_FILE)
+holdings = raw_df.groupby(['出資者', '股票代號', '幣別'])['股數'].sum().reset_index()
+holdings['Yahoo代碼'] = holdings['股票代號'].map(yahoo_ticker_map(raw_df)).astype(str).str.upper()
+
+# --- 即時股價：共用報價快取，ttl 內不重複下載，多人同時開啟也只送出一次批次請求 ---
+held_codes = holdings.loc[holdings['股數'] > 0, 'Yahoo代碼'].unique()
+quotes = get_quote_cache().get(held_codes)
 
-# --- 從 snapshot 中抓取日期資訊 ---
-latest_month = stock_price_df.index.max()
-price_date_str = stock_price_df.loc[latest_month, '資料日期'].strftime('%Y-%m-%d')
+# 取不到報價的代碼改用價格存放區中最新的月收盤價
+stored = get_price_store().read(tickers=held_codes, columns=['close', 'price_date'])
+latest_stored = stored.dropna(subset=['close']).sort_values('month').groupby('ticker').last()
+prices = quotes['price'].fillna(latest_stored['close'])
+price_dates = quotes['fetched_at'].dt.strftime('%Y-%m-%d %H:%M').fillna(latest_stored['price_date'].dt.strftime('%Y-%m-%d'))
+price_date_str = price_dates.min() if price_dates.notna().any() else "未知"
 
-# --- 匯率資訊 ---
-fx_rate_value = fx_df.loc[latest_month, 'USD']
-fx_date_str = fx_df.loc[latest_month, '來源'] if '來源' in fx_df.columns else price_date_str
+# --- 匯率資訊（直接讀取已發布的匯率快照） ---
+fx_rate_value, fx_date_str = get_latest_fx_rate()
+fx_rate_value = float(fx_rate_value)
 
 # --- 現金資料 ---
 cash_df = parse_cash_balances()
@@ -38,7 +40,7 @@ latest_month_cash = cash_df.index.max()
 # --- 真正的資料來源時間 ---
 data_dates = {
     "💰 現金資料": latest_month_cash.strftime("%Y-%m"),
-    "📈 股價資料(美股)": price_date_str,
+    "📈 股價資料": price_date_str,
     "💱 匯率資料": fx_date_str
 }
 min_date = min(data_dates.values())
@@ -51,10 +53,8 @@ for label, dt in data_dates.items():
 
 # --- 顯示表格 ---
 st.subheader("📌 目前持股與即時股價")
-holdings = result.raw_df.groupby(['出資者', '股票代號', '幣別'])['股數'].sum().reset_index()
-latest_prices = stock_price_df.loc[latest_month].drop('資料日期')
-holdings['即時股價'] = holdings['股票代號'].map(latest_prices.to_dict()).fillna(0)
-holdings['股價日期'] = price_date_str
+holdings['即時股價'] = holdings['Yahoo代碼'].map(prices).fillna(0)
+holdings['股價日期'] = holdings['Yahoo代碼'].map(price_dates).fillna(price_date_str)
 holdings['市值（原幣）'] = holdings['股數'] * holdings['即時股價']
 holdings['匯率'] = holdings['幣別'].apply(lambda c: fx_rate_value if c == 'USD' else 1.0)
 holdings['市值（TWD）'] = holdings['市值（原幣）'] * holdings['匯率']
@@ -98,11 +98,22 @@ cash_df_summary = cash_detail.pivot_table(
     aggfunc='sum'
 ).fillna(0)
 
-summary['美金現金(USD)'] = summary['出資者'].map(lambda x: cash_df_summary.loc[x, ['美金活存', '美金投資帳戶']].sum() / fx_rate_value if x in cash_df_summary.index else 0)
+# 依帳戶分類一次加總成 (擁有者 × 現金類別)，再以出資者對齊，不逐列查表
+cash_groups = {
+    '美金現金': ['美金活存', '美金投資帳戶'],
+    '美金定存': ['美金定存'],
+    '台幣現金': ['台幣活存', '台幣投資帳戶'],
+}
+cash_by_group = pd.DataFrame({
+    group: cash_df_summary.reindex(columns=accounts, fill_value=0).sum(axis=1)
+    for group, accounts in cash_groups.items()
+}).reindex(summary['出資者']).fillna(0).to_numpy()
+
+summary['美金現金(USD)'] = cash_by_group[:, 0] / fx_rate_value
 summary['美金現金(TWD)'] = summary['美金現金(USD)'] * fx_rate_value
-summary['美金定存(USD)'] = summary['出資者'].map(lambda x: cash_df_summary.loc[x, ['美金定存']].sum() / fx_rate_value if x in cash_df_summary.index else 0)
+summary['美金定存(USD)'] = cash_by_group[:, 1] / fx_rate_value
 summary['美金定存(TWD)'] = summary['美金定存(USD)'] * fx_rate_value
-summary['台幣現金(TWD)'] = summary['出資者'].map(lambda x: cash_df_summary.loc[x, ['台幣活存', '台幣投資帳戶']].sum() if x in cash_df_summary.index else 0)
+summary['台幣現金(TWD)'] = cash_by_group[:, 2]
 
 # --- 加入總資產（TWD） ---
 summary['總資產(TWD)'] = (
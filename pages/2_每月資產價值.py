@@ -7,17 +7,29 @@ import matplotlib.font_manager as fm
 import pandas as pd
 from datetime import datetime
 from modules.asset_value import calculate_monthly_asset_value
-from config import TRANSACTION_FILE, CASH_ACCOUNT_FILE, FX_SNAPSHOT_PATH
+from config import TRANSACTION_FILE, CASH_ACCOUNT_FILE, DIVIDEND_FILE, FX_SNAPSHOT_PATH, FX_PAIRS
 from modules.price_refresher import refresh_current_month_prices
+from modules.refresh_worker import start_refresh_worker, current_holding_tickers
+from modules.snapshot_store import read_snapshot
 
 
 
 # --- Streamlit Page Setup ---
 st.set_page_config(page_title="每月資產價值", layout="wide")
 
-#更新最新股價
-if st.button("🔁 重新抓取當月股價（即時快照）"):
-    refresh_current_month_prices(['2330.TW', 'NVDA', 'AAPL'])  # ← 改成你常用的代碼
+# 更新最新股價：背景執行緒依目前持股定時刷新，頁面只讀取已發布的快照
+worker = start_refresh_worker()
+if worker is not None:
+    status = worker.status()
+    if status["last_run"] is not None:
+        st.caption(f"🕒 最近背景更新：{status['last_run']:%Y-%m-%d %H:%M}（{len(status['tickers'])} 檔）")
+    if status["error"]:
+        st.warning(f"⚠️ 背景更新失敗：{status['error']}")
+    if st.button("🔁 立即更新當月股價"):
+        worker.request_refresh()
+        st.info("⏳ 已排入背景更新，完成後重新整理頁面即可看到最新價格")
+elif st.button("🔁 重新抓取當月股價（即時快照）"):
+    refresh_current_month_prices(current_holding_tickers(TRANSACTION_FILE))
     st.success("✅ 已重新抓取當月股價並更新快照")
 
 # 設定中文字體（根據作業系統自動調整）
@@ -35,18 +47,11 @@ else:
     plt.rcParams['font.family'] = 'sans-serif'
 plt.rcParams['axes.unicode_minus'] = False
 
-# --- 小工具函式：安全取最後一筆資料 ---
-def safe_last(df, col_name):
-    try:
-        return df[col_name].iloc[-1]
-    except (KeyError, IndexError):
-        st.warning(f"⚠️ 找不到或無資料：{col_name}")
-        return 0
-
 # --- 資料計算：股票 + 現金 ---
 result = calculate_monthly_asset_value(
     filepath_transaction=TRANSACTION_FILE,
-    filepath_cash=CASH_ACCOUNT_FILE
+    filepath_cash=CASH_ACCOUNT_FILE,
+    filepath_dividend=DIVIDEND_FILE
 )
 summary_df = result.summary_df
 summary_stock_df = result.summary_stock_df
@@ -56,21 +61,20 @@ stock_price_df = result.stock_price_df
 stock_value_df = result.stock_value_df
 fx_df = result.fx_df
 all_months = result.all_months
+summary_dividend_df = result.summary_dividend_df
+cube = result.cube
 
 # --- 將 index 轉為字串格式以利顯示 ---
 summary_df.index = summary_df.index.astype(str)
 
-# --- 自動抓出資者名稱：只抓 base 欄位名（無底線） ---
-owners = [col for col in summary_df.columns if col not in ("Total") and "_" not in col]
+# --- 出資者直接取自 cube 的出資者軸 ---
+owners = list(cube.owners)
 
-# --- 顯示資產摘要 ---
+# --- 顯示資產摘要：最新月份各出資者 × 資產類別 ---
 st.title(f"\U0001F496 我想和你一起慢慢變富")
-latest = summary_df.iloc[-1]
+latest_by_class = cube.by_class(-1).reindex(columns=["TW_STOCK", "US_STOCK", "TWD_CASH", "USD_CASH"], fill_value=0)
 for owner in owners:
-    tw_stock = safe_last(summary_df, f"{owner}_TW_STOCK")
-    us_stock = safe_last(summary_df, f"{owner}_US_STOCK")
-    tw_cash = safe_last(summary_cash_df, f"{owner}_TWD_CASH")
-    us_cash = safe_last(summary_cash_df, f"{owner}_USD_CASH")
+    tw_stock, us_stock, tw_cash, us_cash = latest_by_class.loc[owner]
     total = tw_stock + us_stock + tw_cash + us_cash
     st.markdown(f"**{owner}**：TWD {total:,.0f}（台股 TWD {tw_stock:,.0f}／美股 TWD {us_stock:,.0f}／台幣現金 TWD {tw_cash:,.0f}／美金現金 TWD {us_cash:,.0f}）")
 
@@ -87,11 +91,8 @@ else:
 
 # --- 各類資產跑動詳細（含股票與現金） ---
 st.subheader("各類資產跑動詳細(含股票與現金)")
-total_asset_df = pd.concat([stock_value_df, summary_cash_df], axis=1).fillna(0)
-
 for owner in owners:
-    columns = [col for col in total_asset_df.columns if col.startswith(owner + "_")]
-    df = total_asset_df[columns].copy()
+    df = cube.owner(owner)
     if df.empty:
         st.warning(f"找不到 {owner} 的資料")
         continue
@@ -99,21 +100,26 @@ for owner in owners:
     sorted_codes = latest[latest > 0].sort_values(ascending=False).index.tolist()
     zero_codes = latest[latest == 0].index.tolist()
     df = df[sorted_codes + zero_codes]
-    df.columns = [col.replace(owner + "_", "") for col in df.columns]
     df.index = df.index.astype(str)
     st.markdown(f"#### {owner} 每月資產變化（目前資產 NT${summary_df.iloc[-1].get(owner, 0):,.0f} 元）")
     st.bar_chart(df)
 
+# --- 股利收入（已包含在現金餘額中，這裡單獨列出） ---
+st.subheader("💵 每年股利收入")
+dividend_by_year = summary_dividend_df.groupby(summary_dividend_df.index.year).sum()
+dividend_by_year.index = dividend_by_year.index.astype(str)
+st.bar_chart(dividend_by_year)
+
 # --- 資料表顯示 summary ---
 st.subheader("📊 整合後每月資產資料表 summary_df")
 st.dataframe(summary_df[::-1].style.format("{:,.0f}"))
 
 # --- 資料表顯示 fx ---
 st.subheader("📊 整合後每月資產資料表 fx_df")
-st.dataframe(fx_df[['USD']][::-1].style.format("{:.2f}"))
+st.dataframe(fx_df[list(FX_PAIRS)][::-1].style.format("{:.2f}"))
 st.subheader("📈 美金匯率變化")
 try:
-    fx_snapshot = pd.read_parquet(FX_SNAPSHOT_PATH)
+    fx_snapshot = read_snapshot(FX_SNAPSHOT_PATH)
     if isinstance(fx_snapshot.index, pd.PeriodIndex):
         fx_snapshot.index = fx_snapshot.index.to_timestamp()
     usd_rate = fx_snapshot["USD"].sort_index(ascending=False)
@@ -0,0 +1,48 @@
+#pages/3_年度損益分析.py
+import streamlit as st
+import pandas as pd
+from modules.asset_value import calculate_monthly_asset_value
+from modules.pnl_cube import build_pnl_cube, CUBE_MEASURES
+from config import TRANSACTION_FILE, CASH_ACCOUNT_FILE, DIVIDEND_FILE
+
+# --- 頁面設定 ---
+st.set_page_config(page_title="年度損益分析", layout="wide")
+st.title("📅 年度損益分析")
+
+# --- 載入資料：資產結果走增量快取，cube 只重建有變動的年度 ---
+result = calculate_monthly_asset_value(
+    filepath_transaction=TRANSACTION_FILE,
+    filepath_cash=CASH_ACCOUNT_FILE,
+    filepath_dividend=DIVIDEND_FILE
+)
+cube = build_pnl_cube(result)
+
+if cube.empty:
+    st.info("目前沒有任何交易紀錄。")
+    st.stop()
+
+# --- 篩選 ---
+owners = sorted(cube['出資者'].unique())
+years = sorted(cube['年度'].unique(), reverse=True)
+selected_owners = st.multiselect("出資者", options=owners, default=owners)
+view = cube[cube['出資者'].isin(selected_owners)]
+
+money = {col: "{:,.0f}" for col in CUBE_MEASURES}
+
+# --- 年度彙總 ---
+st.subheader("📊 各年度損益")
+by_year = view.groupby('年度')[['已實現損益', '股利收入', '未實現損益', '匯率影響', '總損益']].sum().sort_index()
+st.bar_chart(by_year[['已實現損益', '股利收入', '未實現損益', '匯率影響']])
+st.dataframe(by_year[::-1].style.format("{:,.0f}"))
+
+# --- 年度 × 出資者 ---
+st.subheader("👥 各出資者年度總損益")
+by_owner = view.pivot_table(index='年度', columns='出資者', values='總損益', aggfunc='sum', fill_value=0).sort_index(ascending=False)
+st.dataframe(by_owner.style.format("{:,.0f}"))
+
+# --- 個股明細 ---
+st.subheader("🔍 個股明細")
+selected_year = st.selectbox("年度", options=years)
+detail = view[view['年度'] == selected_year].drop(columns='年度')
+detail = detail[(detail[CUBE_MEASURES].abs() > 0.5).any(axis=1)].sort_values('總損益', ascending=False)
+st.dataframe(detail.style.format(money), hide_index=True)
@@ -1,12 +1,17 @@
 # pages/9_debug_summary_df.py
 import streamlit as st
 import pandas as pd
+import matplotlib.pyplot as plt
 from modules.asset_value import calculate_monthly_asset_value
 from modules.cash_parser import parse_cash_balances
+from modules.instrumentation import is_enabled, set_enabled, recent_traces
 from config import TRANSACTION_FILE
 
 st.set_page_config(page_title="DEBUG 資產表", layout="wide")
 
+# --- 效能追蹤開關（放在計算之前，本頁的計算也會被記錄；只影響目前 session 的這次頁面執行） ---
+set_enabled(st.sidebar.checkbox("⏱️ 啟用效能追蹤", value=is_enabled()))
+
 # --- 資料計算 ---
 result = calculate_monthly_asset_value(TRANSACTION_FILE)
 summary_df = result.summary_df
@@ -59,4 +64,42 @@ st.dataframe(filtered_stock_value_df[::-1].style.format("{:,.0f}"))
 st.subheader("💵 cash_summary（每人每月現金資產）")
 st.dataframe(cash_summary[::-1].style.format("{:,.0f}"))
 
+# --- 效能追蹤：各階段耗時瀑布圖 ---
+st.subheader("⏱️ 效能追蹤（最近的計算）")
+traces = recent_traces()
+if not traces:
+    st.info("尚無追蹤紀錄：請在側邊欄啟用效能追蹤後重新整理頁面。")
+else:
+    labels = [f"{trace['started_at']}  {trace['trace']}（{trace['duration_ms']:,.0f} ms）" for trace in traces]
+    trace = traces[labels.index(st.selectbox("選擇追蹤", options=labels))]
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("總耗時 (ms)", f"{trace['duration_ms']:,.0f}")
+    col2.metric("網路請求數", trace['counters'].get('network.requests', 0))
+    col3.metric("階段數", len(trace['spans']))
+
+    # 依 parent 算出層級，子階段縮排顯示
+    spans = pd.DataFrame(trace['spans'])
+    depth = {}
+    for record in trace['spans']:
+        depth[record['id']] = depth.get(record['parent'], -1) + 1
+    spans['階段'] = ["    " * depth[i] + name for i, name in zip(spans['id'], spans['name'])]
+
+    fig, ax = plt.subplots(figsize=(10, max(2, 0.35 * len(spans))))
+    ax.barh(range(len(spans)), spans['duration_ms'], left=spans['start_ms'], color="#4C78A8")
+    ax.set_yticks(range(len(spans)))
+    ax.set_yticklabels(spans['階段'])
+    ax.invert_yaxis()
+    ax.set_xlabel("ms")
+    ax.grid(axis="x", alpha=0.3)
+    fig.tight_layout()
+    st.pyplot(fig)
+
+    detail = spans[['階段', 'start_ms', 'duration_ms', 'thread']].copy()
+    detail['列數'] = [attrs.get('rows') for attrs in spans['attrs']]
+    detail['計數'] = [", ".join(f"{k}={v}" for k, v in counters.items()) for counters in spans['counters']]
+    st.dataframe(detail, hide_index=True)
 
+    if trace['cache_hit_ratio']:
+        st.markdown("**快取命中率**")
+        st.dataframe(pd.Series(trace['cache_hit_ratio'], name="命中率").to_frame().style.format("{:.0%}"))
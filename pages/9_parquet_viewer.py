@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 import os
+from modules.snapshot_store import read_snapshot
 
 st.set_page_config(page_title="Parquet 檔案瀏覽器", layout="wide")
 st.title("📦 Parquet 檔案瀏覽器")
@@ -9,7 +10,7 @@ st.title("📦 Parquet 檔案瀏覽器")
 parquet_folder = "data"
 
 # 取得所有 parquet 檔案清單
-all_files = [f for f in os.listdir(parquet_folder) if f.endswith(".parquet")]
+all_files = [f for f in os.listdir(parquet_folder) if f.endswith(".parquet") and not f.startswith(".")]
 
 if not all_files:
     st.warning("找不到任何 .parquet 檔案")
@@ -18,7 +19,7 @@ else:
     parquet_path = os.path.join(parquet_folder, selected_file)
 
     try:
-        df = pd.read_parquet(parquet_path)
+        df = read_snapshot(parquet_path)
 
         # 如果 index 是 datetime 或 period，就排序降冪顯示最新在前
         if isinstance(df.index, (pd.DatetimeIndex, pd.PeriodIndex)):